@@ -31,7 +31,7 @@ export interface SelectFileOptions {
 }
 
 // This list coincides with the extensions defined in core/plugins/manifest.yml
-export const EXTENSIONS_IMPORTABLE_WITHIN_DOC = [".xlsx", ".json", ".csv", ".tsv", ".dsv"];
+export const EXTENSIONS_IMPORTABLE_WITHIN_DOC = [".xlsx", ".json", ".jsonl", ".csv", ".tsv", ".dsv"];
 
 export const EXTENSIONS_IMPORTABLE_AS_DOC = [".grist", ".csv", ".tsv", ".dsv", ".txt", ".xlsx", ".xlsm"];
 
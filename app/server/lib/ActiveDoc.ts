@@ -3465,6 +3465,8 @@ export class ActiveDoc extends EventEmitter {
           request: (key: string, args: SandboxRequest) => this._requests.handleSingleRequestWithCache(key, args),
           guessColInfo,
           convertFromColumn,
+          // Supplies the data of tables registered with load_table_lazily, when first needed.
+          fetch_table_data: (tableName: string) => this._fetchTableIfPresent(tableName),
         },
       },
     });
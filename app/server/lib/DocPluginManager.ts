@@ -141,6 +141,7 @@ export class DocPluginManager {
       const extToType: Record<string, string> = {
         ".xlsx": "Excel",
         ".json": "JSON",
+        ".jsonl": "JSON Lines",
         ".csv": "CSV",
         ".tsv": "TSV",
         ".dsv": "PSV",
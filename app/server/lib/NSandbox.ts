@@ -1184,6 +1184,10 @@ export function getInsertedEnv(options: ISandboxOptions) {
     env.GRIST_FALSY_VALUES = process.env.GRIST_FALSY_VALUES;
   }
 
+  if (process.env.GRIST_IMPORT_WORKERS) {
+    env.GRIST_IMPORT_WORKERS = process.env.GRIST_IMPORT_WORKERS;
+  }
+
   return env;
 }
 
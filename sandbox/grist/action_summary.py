@@ -7,6 +7,14 @@ from collections import namedtuple
 import actions
 from objtypes import equal_encoding
 
+# Types whose values are equal in encoding exactly when they are equal in Python, as long as both
+# values have the same type. Floats only need special handling of NaN; other values are compared
+# with equal_encoding().
+_PLAIN_TYPES = frozenset([int, str, bool, type(None)])
+
+# ColumnDelta doesn't bother combining repeated changes to the same rows until it has this many.
+_MIN_COMPACTED_SIZE = 1000
+
 # Pairs of before/after names of tables and columns.  None represents non-existence for `before`,
 # while "defunct_name" (i.e. `-{name}`) represents non-existence for `after`. This way,
 # addition and removal of tables/columns can be represented.
@@ -26,11 +34,11 @@ class ActionSummary(object):
     """
     Record changes for the given table and column, in the form (row_id, before, after).
     """
-    col_deltas = self._forTable(table_id).column_deltas.setdefault(col_id, {})
-    for (row_id, before, after) in changes:
-      # If a change was already recorded, update the 'after' value and keep the 'before' one.
-      previous = col_deltas.get(row_id)
-      col_deltas[row_id] = (previous[0] if previous else before, after)
+    column_deltas = self._forTable(table_id).column_deltas
+    col_delta = column_deltas.get(col_id)
+    if col_delta is None:
+      col_delta = column_deltas[col_id] = ColumnDelta()
+    col_delta.add_changes(changes)
 
   def convert_deltas_to_actions(self, out_stored, out_undo):
     """
@@ -50,7 +58,7 @@ class ActionSummary(object):
     """
     table_delta = self._tables.get(table_id)
     col_delta = table_delta and table_delta.column_deltas.pop(col_id, None)
-    return self._changes_to_actions(table_id, col_id, col_delta or {}, out_stored, out_undo)
+    return self._changes_to_actions(table_id, col_id, col_delta, out_stored, out_undo)
 
   def update_new_rows_map(self, table_id, temp_row_ids, final_row_ids):
     """
@@ -71,13 +79,14 @@ class ActionSummary(object):
 
   def _changes_to_actions(self, table_id, col_id, column_delta, out_stored, out_undo):
     """
-    Given a column and a dict of column_deltas for it, of the form {row_id: (before_value,
-    after_value)}, creates DocActions and adds them to out_stored and out_undo lists.
+    Given a column and a ColumnDelta for it (or None), creates DocActions and adds them to
+    out_stored and out_undo lists.
     """
     if not column_delta:
       return
-    full_row_ids = sorted(r for r, (before, after) in column_delta.items()
-                          if not equal_encoding(before, after))
+    full_row_ids, before_values, after_values = column_delta.get_changed()
+    if not full_row_ids:
+      return
 
     defunct = is_defunct(table_id) or is_defunct(col_id)
     # The front restore (defunct branch below) is inserted at the front of the undo list, which
@@ -90,38 +99,40 @@ class ActionSummary(object):
     table_id = root_name(table_id)
     col_id = root_name(col_id)
 
-    def update_action(filtered_row_ids, delta_index, tid=None, cid=None):
-      values = [column_delta[r][delta_index] for r in filtered_row_ids]
-      return actions.BulkUpdateRecord(tid if tid is not None else table_id, filtered_row_ids,
-                                      {cid if cid is not None else col_id: values}).simplify()
+    def update_action(row_ids, values, tid=table_id, cid=col_id):
+      return actions.BulkUpdateRecord(tid, row_ids, {cid: values}).simplify()
+
+    t = self._tables.get(table_id)
+    rows_before = t._rows_present_before if t else {}
+    rows_after = t._rows_present_after if t else {}
 
     if not defunct:
-      row_ids_after = self.filter_out_gone_rows(table_id, full_row_ids)
+      row_ids_after, values_after = _filter_rows(rows_after, full_row_ids, after_values)
       if row_ids_after:
-        out_stored.append(update_action(row_ids_after, 1))
+        out_stored.append(update_action(row_ids_after, values_after))
 
     if self.is_created(table_id, col_id) and not defunct:
       # A newly-created column, and not replacing a defunct one. Don't generate undo actions.
       return
 
     ## Maybe add one or two undo update actions for rows that existed before the change.
-    row_ids_before = self.filter_out_new_rows(table_id, full_row_ids)
+    row_ids_before, values_before = _filter_rows(rows_before, full_row_ids, before_values)
 
     if defunct:
-      preserved_row_ids = []
+      preserved_row_ids, preserved_values = [], []
+      defunct_row_ids, defunct_values = row_ids_before, values_before
     else:
-      preserved_row_ids = self.filter_out_gone_rows(table_id, row_ids_before)
-
-    preserved_row_ids_set = set(preserved_row_ids)
-    defunct_row_ids = [r for r in row_ids_before if r not in preserved_row_ids_set]
+      preserved_row_ids, preserved_values = _filter_rows(rows_after, row_ids_before, values_before)
+      defunct_row_ids, defunct_values = _filter_rows(rows_after, row_ids_before, values_before,
+                                                     keep_present=False)
 
     if preserved_row_ids:
-      out_undo.append(update_action(preserved_row_ids, 0))
+      out_undo.append(update_action(preserved_row_ids, preserved_values))
 
     if defunct_row_ids:
       # Insert at the front so the restore lands after the rows/columns/tables are re-added on
       # undo. It runs last, so it uses the pre-rename names (see note above).
-      out_undo.insert(0, update_action(defunct_row_ids, 0, orig_table_id, orig_col_id))
+      out_undo.insert(0, update_action(defunct_row_ids, defunct_values, orig_table_id, orig_col_id))
 
   def _forTable(self, table_id):
     return self._tables.get(table_id) or self._tables.setdefault(table_id, TableDelta())
@@ -132,18 +143,6 @@ class ActionSummary(object):
     t = self._tables.get(table_id)
     return t and t.column_renames.is_created(col_id)
 
-  def filter_out_new_rows(self, table_id, row_ids):
-    t = self._tables.get(table_id)
-    if not t:
-      return row_ids
-    return [r for r in row_ids if t._rows_present_before.get(r) != False]
-
-  def filter_out_gone_rows(self, table_id, row_ids):
-    t = self._tables.get(table_id)
-    if not t:
-      return row_ids
-    return [r for r in row_ids if t._rows_present_after.get(r) != False]
-
   def add_records(self, table_id, row_ids):
     t = self._forTable(table_id)
     for r in row_ids:
@@ -188,13 +187,104 @@ class TableDelta(object):
     self._rows_present_before = {}
     self._rows_present_after = {}
     self.column_renames = LabelRenames()
-    self.column_deltas = {}   # maps col_id to the dict {row_id: (before_value, after_value)}
+    self.column_deltas = {}   # maps col_id to ColumnDelta
 
     # Map of negative row_ids that may be used in [Bulk]AddRecord actions to the final row_ids for
     # those rows; to allow translating Reference values added in the same action bundle.
     self.temp_row_ids = {}
 
 
+class ColumnDelta(object):
+  """
+  The changes to the cells of one column, kept as parallel lists of row_ids and of before and
+  after values. While changes come in order of row_id (e.g. from a recalculation of the column),
+  they are simply appended. Otherwise, the same row may appear more than once, and entries for the
+  same row get combined into one, keeping the first 'before' and the last 'after' values, once the
+  lists have doubled in size. So the lists hold at most about twice as many entries as there are
+  changed cells, and combining them takes amortized O(log N) time per change.
+  """
+  __slots__ = ('row_ids', 'before', 'after', '_is_sorted', '_compacted_size')
+
+  def __init__(self):
+    self.row_ids = []
+    self.before = []
+    self.after = []
+    self._is_sorted = True        # Whether row_ids are strictly increasing, i.e. all different.
+    self._compacted_size = 0      # The number of entries after the last call to _compact().
+
+  def __len__(self):
+    return len(self.row_ids)
+
+  def add_changes(self, changes):
+    """
+    Records changes in the form (row_id, before, after).
+    """
+    row_ids = self.row_ids
+    add_row_id, add_before, add_after = row_ids.append, self.before.append, self.after.append
+    is_sorted = self._is_sorted
+    last_row_id = row_ids[-1] if row_ids else None
+    for (row_id, before, after) in changes:
+      if is_sorted and last_row_id is not None and row_id <= last_row_id:
+        is_sorted = False
+      last_row_id = row_id
+      add_row_id(row_id)
+      add_before(before)
+      add_after(after)
+    self._is_sorted = is_sorted
+    if not is_sorted and len(row_ids) >= 2 * max(self._compacted_size, _MIN_COMPACTED_SIZE):
+      self._compact()
+
+  def _compact(self):
+    """
+    Sorts the entries by row_id, combining entries for the same row.
+    """
+    row_ids, before, after = self.row_ids, self.before, self.after
+    # Sorting is stable, so repeated changes to a row stay in the order they were recorded. It's
+    # also fast for a few sorted runs, e.g. when the same rows were recalculated a few times.
+    new_row_ids, new_before, new_after = [], [], []
+    for i in sorted(range(len(row_ids)), key=row_ids.__getitem__):
+      row_id = row_ids[i]
+      if new_row_ids and new_row_ids[-1] == row_id:
+        new_after[-1] = after[i]
+      else:
+        new_row_ids.append(row_id)
+        new_before.append(before[i])
+        new_after.append(after[i])
+    self.row_ids, self.before, self.after = new_row_ids, new_before, new_after
+    self._is_sorted = True
+    self._compacted_size = len(new_row_ids)
+
+  def get_changed(self):
+    """
+    Returns parallel lists (row_ids, before_values, after_values), sorted by row_id, with one
+    entry per row, for the rows whose after value differs from the before value.
+    """
+    if not self._is_sorted:
+      self._compact()
+    row_ids, before, after = self.row_ids, self.before, self.after
+
+    out_row_ids, out_before, out_after = [], [], []
+    for i in range(len(row_ids)):
+      a, b = before[i], after[i]
+      value_type = type(a)
+      if value_type is not type(b):
+        if equal_encoding(a, b):
+          continue
+      elif value_type in _PLAIN_TYPES:
+        if a == b:
+          continue
+      elif value_type is float:
+        # Compare NaNs as equal, as equal_encoding() does.
+        if a == b or (a != a and b != b):   # pylint:disable=comparison-with-itself
+          continue
+      elif equal_encoding(a, b):
+        continue
+      out_row_ids.append(row_ids[i])
+      out_before.append(a)
+      out_after.append(b)
+    return out_row_ids, out_before, out_after
+
+
 class LabelRenames(object):
   """
   Maintains a set of renames, for tables in a doc, or for columns in a table. For now, we only
@@ -227,3 +317,15 @@ def is_defunct(name):
 
 def root_name(name):
   return name[1:] if name.startswith('-') else name
+
+def _filter_rows(rows_present, row_ids, values, keep_present=True):
+  """
+  Returns (row_ids, values) for the rows that aren't marked absent in the rows_present map (see
+  TableDelta), or, with keep_present=False, only for those that are.
+  """
+  if not rows_present:
+    # Copy row_ids, since the same list is filtered for both stored and undo actions.
+    return (row_ids[:], values) if keep_present else ([], [])
+  keep = [(rows_present.get(r) != False) == keep_present for r in row_ids]
+  return ([r for r, k in zip(row_ids, keep) if k],
+          [v for v, k in zip(values, keep) if k])
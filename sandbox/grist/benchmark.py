@@ -0,0 +1,261 @@
+"""
+Benchmarks of the data engine on synthetic documents, to catch performance regressions.
+
+Each scenario generates a document from a DocSpec, and times the main engine operations on it:
+loading tables, the initial calculation, adding, updating and fetching records, and undo. With a
+reference chain, it also times updating referenced records, which dirties rows scattered over
+the table. Results
+are printed as JSON, which can be saved and compared with results from another commit:
+
+  python benchmark.py --output before.json
+  ... (switch to another commit)
+  python benchmark.py --compare before.json
+
+With --compare, the script exits with an error status if any operation got slower than allowed by
+--threshold. Timings are the minimum over --repeat runs, with a fresh engine for each run.
+
+The generated document has a "Data" table with `rows` records, and data columns Key (with
+`lookup_keys` distinct values), Value, and Label. It gets `formulas` formula columns, each
+depending on the data columns and on the previous formula column. If `lookup_keys` is set, a
+"Groups" table has a record per key, with formulas aggregating lookupRecords over Data. If
+`ref_chain` is set, Data has a reference to the first of that many "ChainN" tables, each
+referring to the next, and a formula that follows the whole chain. If `summary` is set, a summary
+table of Data grouped by Key is added.
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+from collections import namedtuple, OrderedDict
+
+import actions
+import engine
+import testutil
+import useractions
+
+log = logging.getLogger(__name__)
+
+# Bumped when the generated documents or the set of timed operations change, since results are
+# only comparable for the same version.
+BENCHMARK_VERSION = 2
+
+DocSpec = namedtuple('DocSpec', ('rows', 'formulas', 'lookup_keys', 'summary', 'ref_chain'))
+
+# The default scenarios, each stressing a different part of the engine.
+SCENARIOS = OrderedDict([
+  ("data",      DocSpec(rows=50000, formulas=0, lookup_keys=0,    summary=False, ref_chain=0)),
+  ("formulas",  DocSpec(rows=20000, formulas=8, lookup_keys=0,    summary=False, ref_chain=0)),
+  ("lookups",   DocSpec(rows=20000, formulas=1, lookup_keys=1000, summary=False, ref_chain=0)),
+  ("summary",   DocSpec(rows=20000, formulas=1, lookup_keys=100,  summary=True,  ref_chain=0)),
+  ("ref_chain", DocSpec(rows=20000, formulas=1, lookup_keys=0,    summary=False, ref_chain=4)),
+  ("scattered", DocSpec(rows=100000, formulas=0, lookup_keys=0,   summary=False, ref_chain=1)),
+])
+
+# Names of the timed operations, in the order they run. The last one only runs for documents with
+# a reference chain.
+OPERATIONS = ("load_table", "calculate", "bulk_add", "bulk_update", "fetch_table", "undo",
+              "update_refs")
+
+
+def make_doc(spec):
+  """
+  Returns a sample for the given DocSpec, with "SCHEMA" and "DATA" keys as produced by
+  testutil.parse_test_sample(). Generated values are deterministic.
+  """
+  tables = []
+  data = OrderedDict()
+  col_ids = iter(range(1, 10000))
+  def col(col_id, col_type, formula=""):
+    return [next(col_ids), col_id, col_type, bool(formula), formula, "", ""]
+
+  row_ids = list(range(1, spec.rows + 1))
+  data_cols = [col("Key", "Int"), col("Value", "Numeric"), col("Label", "Text")]
+  data_values = {
+    "Key": [r % (spec.lookup_keys or 1) for r in row_ids],
+    "Value": [r * 0.5 for r in row_ids],
+    "Label": ["label %d" % (r % 100) for r in row_ids],
+  }
+  for i in range(spec.formulas):
+    prev = "$F%d" % (i - 1) if i else "$Key"
+    data_cols.append(col("F%d" % i, "Numeric", "%s + $Value * %d" % (prev, i + 1)))
+
+  if spec.ref_chain:
+    chain_rows = list(range(1, (spec.lookup_keys or 100) + 1))
+    data_cols.append(col("Ref", "Ref:Chain1"))
+    data_values["Ref"] = [r % len(chain_rows) + 1 for r in row_ids]
+    data_cols.append(col("Chained", "Any", "$Ref" + ".Next" * (spec.ref_chain - 1) + ".Name"))
+    for depth in range(1, spec.ref_chain + 1):
+      chain_cols = [col("Name", "Text")]
+      chain_data = {"Name": ["chain %d.%d" % (depth, r) for r in chain_rows]}
+      if depth < spec.ref_chain:
+        chain_cols.append(col("Next", "Ref:Chain%d" % (depth + 1)))
+        chain_data["Next"] = [(r * 7) % len(chain_rows) + 1 for r in chain_rows]
+      tables.append(("Chain%d" % depth, chain_cols))
+      data["Chain%d" % depth] = actions.TableData("Chain%d" % depth, chain_rows, chain_data)
+
+  tables.insert(0, ("Data", data_cols))
+  data["Data"] = actions.TableData("Data", row_ids, data_values)
+
+  if spec.lookup_keys:
+    tables.append(("Groups", [
+      col("Key", "Int"),
+      col("Count", "Int", "len(Data.lookupRecords(Key=$Key))"),
+      col("Total", "Numeric", "SUM(Data.lookupRecords(Key=$Key).Value)"),
+    ]))
+    keys = list(range(spec.lookup_keys))
+    data["Groups"] = actions.TableData("Groups", [k + 1 for k in keys], {"Key": keys})
+
+  schema = testutil.parse_test_sample({
+    "SCHEMA": [[i + 1, table_id, cols] for (i, (table_id, cols)) in enumerate(tables)],
+    "DATA": {},
+  })["SCHEMA"]
+  return {"SCHEMA": schema, "DATA": data}
+
+
+def _apply(eng, *user_action_reprs):
+  return eng.apply_user_actions([useractions.from_repr(a) for a in user_action_reprs])
+
+
+def run_scenario(spec):
+  """
+  Runs all timed operations once, on a fresh engine, for a document built from spec. Returns a
+  dict mapping operation names to durations in seconds.
+  """
+  sample = make_doc(spec)
+  timings = OrderedDict()
+  def timed(name, func):
+    start = time.perf_counter()
+    result = func()
+    timings[name] = time.perf_counter() - start
+    return result
+
+  eng = engine.Engine()
+  schema = sample["SCHEMA"]
+  def load_tables():
+    eng.load_meta_tables(schema['_grist_Tables'], schema['_grist_Tables_column'])
+    for table_data in sample["DATA"].values():
+      eng.load_table(table_data)
+  timed("load_table", load_tables)
+  timed("calculate", lambda: _apply(eng, ["Calculate"]))
+
+  if spec.summary:
+    # Adding the summary table isn't timed, but its formulas are included in later operations.
+    key_col_ref = schema['_grist_Tables_column'].row_ids[0]
+    _apply(eng, ["CreateViewSection", 1, 0, "record", [key_col_ref], None])
+
+  count = max(spec.rows // 10, 1)
+  next_row_id = spec.rows + 1
+  timed("bulk_add", lambda: _apply(eng, ["BulkAddRecord", "Data", [None] * count, {
+    "Key": [r % (spec.lookup_keys or 1) for r in range(count)],
+    "Value": [r * 0.25 for r in range(count)],
+    "Label": ["added %d" % r for r in range(count)],
+  }]))
+
+  # Update rows spread over the whole table.
+  update_rows = list(range(1, next_row_id, 10))
+  update = timed("bulk_update", lambda: _apply(eng, ["BulkUpdateRecord", "Data", update_rows, {
+    "Value": [r * 0.75 for r in update_rows],
+  }]))
+  timed("fetch_table", lambda: eng.fetch_table("Data"))
+  timed("undo", lambda: _apply(eng, [
+    "ApplyUndoActions", [actions.get_action_repr(a) for a in update.undo]]))
+
+  if spec.ref_chain:
+    # Data records refer to Chain1 records in turn, so updating every other Chain1 record makes
+    # every other Data record dirty: scattered rows rather than consecutive ones.
+    chain_rows = list(range(1, (spec.lookup_keys or 100) + 1, 2))
+    timed("update_refs", lambda: _apply(eng, ["BulkUpdateRecord", "Chain1", chain_rows, {
+      "Name": ["updated %d" % r for r in chain_rows],
+    }]))
+  return timings
+
+
+def run_benchmarks(scenarios, repeat=3, scale=1.0):
+  """
+  Runs the given scenarios (a dict mapping names to DocSpecs), each `repeat` times, with row
+  counts multiplied by `scale`. Returns the results as a JSON-serializable dict, with the minimum
+  duration of each operation.
+  """
+  results = OrderedDict()
+  for name, spec in scenarios.items():
+    spec = spec._replace(rows=max(int(spec.rows * scale), 1))
+    best = OrderedDict()
+    for _ in range(repeat):
+      for op, duration in run_scenario(spec).items():
+        best[op] = min(duration, best.get(op, duration))
+    log.info("Scenario %s: %s", name, ", ".join("%s %.3fs" % item for item in best.items()))
+    results[name] = OrderedDict([("spec", spec._asdict()), ("timings", best)])
+
+  return OrderedDict([
+    ("version", BENCHMARK_VERSION),
+    ("python", platform.python_version()),
+    ("repeat", repeat),
+    ("scenarios", results),
+  ])
+
+
+def compare_results(baseline, results, threshold):
+  """
+  Compares two results of run_benchmarks(). Returns a list of (scenario, operation, baseline
+  duration, new duration) for all operations present in both, and a list of those that got slower
+  by more than the given threshold ratio.
+  """
+  if baseline.get("version") != results.get("version"):
+    raise ValueError("Can't compare results of benchmark versions %s and %s" %
+                     (baseline.get("version"), results.get("version")))
+  rows = []
+  regressions = []
+  for name, result in results["scenarios"].items():
+    base = baseline["scenarios"].get(name)
+    if not base or base["spec"] != result["spec"]:
+      continue
+    for op, duration in result["timings"].items():
+      if op in base["timings"]:
+        row = (name, op, base["timings"][op], duration)
+        rows.append(row)
+        if duration > base["timings"][op] * threshold:
+          regressions.append(row)
+  return rows, regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("scenarios", nargs="*",
+                      help="Scenarios to run, among: %s (default: all)" % ", ".join(SCENARIOS))
+  parser.add_argument("--repeat", type=int, default=3, help="Runs of each scenario")
+  parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for row counts")
+  parser.add_argument("--output", help="File to save results to, as JSON")
+  parser.add_argument("--compare", help="File with JSON results to compare against")
+  parser.add_argument("--threshold", type=float, default=1.25,
+                      help="Slowdown ratio reported as a regression by --compare")
+  args = parser.parse_args()
+  for name in args.scenarios:
+    if name not in SCENARIOS:
+      parser.error("Unknown scenario %r" % name)
+
+  logging.basicConfig(level=logging.INFO, format="%(message)s")
+  # The engine logs a lot at INFO level, which would skew timings.
+  logging.getLogger(engine.__name__).setLevel(logging.WARNING)
+
+  scenarios = OrderedDict((name, SCENARIOS[name]) for name in (args.scenarios or SCENARIOS))
+  results = run_benchmarks(scenarios, repeat=args.repeat, scale=args.scale)
+  output = json.dumps(results, indent=2)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output + "\n")
+  print(output)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    rows, regressions = compare_results(baseline, results, args.threshold)
+    for (name, op, before, after) in rows:
+      log.info("%-10s %-12s %8.3fs -> %8.3fs  (x%.2f)", name, op, before, after, after / before)
+    if regressions:
+      log.error("%d operation(s) slower than x%.2f", len(regressions), args.threshold)
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -193,6 +193,90 @@ def _do_make_formula_body(formula, default_value, assoc_value=None):
   return final_formula
 
 
+# AST node types allowed in formulas that make_batch_formula() accepts.
+_BATCH_NODE_TYPES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+                     ast.Constant, ast.Name, ast.expr_context, ast.operator, ast.unaryop,
+                     ast.boolop, ast.cmpop)
+
+def make_batch_formula(formula):
+  """
+  Checks if the formula is a single expression that only uses `$col` attributes of the record
+  being computed, constants, and operators, e.g. `$Price * $Qty`. If so, returns a pair
+  (col_ids, func), where func(*values) evaluates the formula given the values of those columns
+  for a record. It allows evaluating such formulas without creating Record objects. For all other
+  formulas, returns None.
+  """
+  if isinstance(formula, bytes):
+    formula = formula.decode('utf8')
+  # We rely on "$foo" becoming the name "DOLLARfoo", so skip formulas that use "DOLLAR" already.
+  if 'DOLLAR' in formula:
+    return None
+  try:
+    tree = ast.parse(DOLLAR_REGEX.sub('DOLLAR', formula.strip()), mode='eval')
+  except SyntaxError:
+    return None
+
+  names = []
+  for node in ast.walk(tree):
+    if not isinstance(node, _BATCH_NODE_TYPES):
+      return None
+    if isinstance(node, ast.Name):
+      if not node.id.startswith('DOLLAR'):
+        return None
+      names.append(node)
+    elif isinstance(node, ast.Constant) and 'DOLLAR' in repr(node.value):
+      # A "$foo" inside a string literal would have been replaced too.
+      return None
+
+  # List the columns in the order in which they first appear in the formula.
+  col_ids = []
+  for node in sorted(names, key=lambda n: (n.lineno, n.col_offset)):
+    if node.id not in col_ids:
+      col_ids.append(node.id)
+
+  args = ast.arguments(posonlyargs=[], args=[ast.arg(arg=name) for name in col_ids],
+                       kwonlyargs=[], kw_defaults=[], defaults=[])
+  lambda_tree = ast.fix_missing_locations(ast.Expression(body=ast.Lambda(args=args,
+                                                                         body=tree.body)))
+  # pylint: disable=eval-used
+  func = eval(compile(lambda_tree, code_filename, 'eval'), {'__builtins__': {}})
+  return tuple(name[len('DOLLAR'):] for name in col_ids), func
+
+
+# Functions that parse_summary_aggregate() recognizes when applied to `$group.Col`.
+SUMMARY_AGGREGATE_FUNCS = ('SUM', 'COUNT', 'AVERAGE', 'MIN', 'MAX')
+
+def parse_summary_aggregate(formula):
+  """
+  Checks if the formula is one of the aggregates that summary tables can maintain incrementally:
+  `len($group)`, or a function in SUMMARY_AGGREGATE_FUNCS applied to `$group.Col`, e.g.
+  `SUM($group.Amount)`. Returns a pair (func_name, col_id), i.e. ("len", None) or e.g.
+  ("SUM", "Amount"). For all other formulas, returns None.
+  """
+  if isinstance(formula, bytes):
+    formula = formula.decode('utf8')
+  if 'DOLLAR' in formula:
+    return None
+  try:
+    tree = ast.parse(DOLLAR_REGEX.sub('DOLLAR', formula.strip()), mode='eval')
+  except SyntaxError:
+    return None
+
+  call = tree.body
+  if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and
+          len(call.args) == 1 and not call.keywords):
+    return None
+  arg = call.args[0]
+  if call.func.id == 'len':
+    if isinstance(arg, ast.Name) and arg.id == 'DOLLARgroup':
+      return ('len', None)
+  elif call.func.id in SUMMARY_AGGREGATE_FUNCS:
+    if (isinstance(arg, ast.Attribute) and isinstance(arg.value, ast.Name) and
+        arg.value.id == 'DOLLARgroup'):
+      return (call.func.id, arg.attr)
+  return None
+
+
 _whitespace_only_re = re.compile('^[ \t]+$', re.MULTILINE)
 _leading_whitespace_re = re.compile('(^[ \t]*)(?:[^ \t\n])', re.MULTILINE)
 
@@ -280,6 +364,7 @@ def infer(node):
 
 _lookup_method_names = ('lookupOne', 'lookupRecords')
 _prev_next_functions = ('PREVIOUS', 'NEXT', 'RANK')
+_cumulative_functions = ('CUMSUM',)
 _lookup_find_methods = ('lt', 'le', 'gt', 'ge', 'eq', 'previous', 'next')
 
 def _is_table(node):
@@ -581,8 +666,8 @@ def parse_grist_names(builder):
             parsed_names.append(make_tuple(start, end, table_id, node.arg))
 
       elif (isinstance(func, astroid.nodes.Name)
-          # Rename values in 'order_by' and 'group_by' arguments to PREVIOUS() and NEXT().
-          and func.name in _prev_next_functions
+          # Rename values in 'order_by' and 'group_by' arguments to PREVIOUS(), NEXT(), etc.
+          and func.name in _prev_next_functions + _cumulative_functions
           and node.arg in ('order_by', 'group_by')
           and node.parent.args):
         obj = infer(node.parent.args[0])
@@ -592,6 +677,16 @@ def parse_grist_names(builder):
             table_id = cls.name
             parsed_names.extend(list_order_group_by_tuples(table_id, node.value))
 
+    elif (isinstance(node, astroid.nodes.Call) and isinstance(node.func, astroid.nodes.Name)
+        # Rename the column ID argument to CUMSUM().
+        and node.func.name in _cumulative_functions
+        and len(node.args) >= 2):
+      obj = infer(node.args[0])
+      if isinstance(obj, astroid.bases.Instance):
+        cls = obj._proxied
+        if _is_table(cls):
+          parsed_names.extend(list_order_group_by_tuples(cls.name, node.args[1]))
+
   return [name for name in parsed_names if name]
 
 
@@ -5,6 +5,7 @@ from collections import namedtuple
 from numbers import Number
 
 import actions
+import column_storage
 import depend
 import objtypes
 import usertypes
@@ -61,7 +62,7 @@ class BaseColumn(object):
   def __init__(self, table, col_id, col_info):
     self.type_obj = col_info.type_obj
     self._is_right_type = self.type_obj.is_right_type
-    self._data = []
+    self._data = self._make_data()
     self.col_id = col_id
     self.table_id = table.table_id
     self.node = depend.Node(self.table_id, col_id)
@@ -100,15 +101,23 @@ class BaseColumn(object):
     """
     return self.method is not None
 
+  def _make_data(self, values=()):
+    """
+    Returns a new container for this column's cell values, initialized from the given iterable.
+    Columns of primitive types override it to use compact typed storage (see TypedArrayColumn).
+    """
+    # pylint: disable=no-self-use
+    return list(values)
+
   def clear(self):
-    self._data = []
+    self._data = self._make_data()
     self.growto(1)    # Always include the special empty record at index 0.
 
   def destroy(self):
     """
     Called when the column is deleted.
     """
-    del self._data[:]
+    self._data.clear()
 
   def growto(self, size):
     if len(self._data) < size:
@@ -117,6 +126,12 @@ class BaseColumn(object):
   def size(self):
     return len(self._data)
 
+  def get_memory_usage(self):
+    """
+    Returns the approximate number of bytes used to store this column's cell values.
+    """
+    return column_storage.list_memory_usage(self._data)
+
   def set(self, row_id, value):
     """
     Sets the value of this column for the given row_id. Value should be as returned by convert(),
@@ -128,12 +143,29 @@ class BaseColumn(object):
       self.growto(row_id + 1)
       self._data[row_id] = value
 
+  def set_many(self, row_ids, values):
+    """
+    Sets the values for the given row_ids, which must be distinct. It's the same as calling set()
+    for each one, but some columns do it faster.
+    """
+    for row_id, value in zip(row_ids, values):
+      self.set(row_id, value)
+
   def unset(self, row_id):
     """
     Sets the value for the given row_id to the default value.
     """
     self.set(row_id, self.getdefault())
 
+  def load_packed(self, row_ids, packed):
+    """
+    Loads values for the given row_ids from a columnar.PackedValues object in bulk, if this column
+    supports it. Returns whether the values got loaded; if not, the caller should set them one at
+    a time.
+    """
+    # pylint: disable=no-self-use,unused-argument
+    return False
+
   def get_cell_value(self, row_id, restore=False):
     """
     Returns the "rich" value for the given row_id, i.e. the value that would be seen by formulas.
@@ -212,7 +244,7 @@ class BaseColumn(object):
     """
     Replace this column's data entirely with data from another column of the same exact type.
     """
-    self._data[:] = other_column._data
+    self._data = self._make_data(other_column._data)
 
   def convert(self, value_to_convert):
     """
@@ -246,6 +278,51 @@ class DataColumn(BaseColumn):
   pass
 
 
+class TypedArrayColumn(BaseColumn):
+  """
+  Base class for columns of primitive types, which keep their values in a compact typed array
+  rather than a list. Values of other types (e.g. alttext or errors) are still supported, but are
+  stored in a sparse side-table. See column_storage.py for details.
+  """
+  def _new_typed_data(self):
+    """
+    Should be implemented by derived classes to return an empty column_storage.TypedColumnData.
+    """
+    raise NotImplementedError()
+
+  def _make_data(self, values=()):
+    data = self._new_typed_data()
+    if data.is_compatible(values):
+      return values.copy()
+    data.extend(values)
+    return data
+
+  def growto(self, size):
+    self._data.growto(size, self.getdefault())
+
+  def get_memory_usage(self):
+    return self._data.memory_usage()
+
+  def load_packed(self, row_ids, packed):
+    # Packed values that use the same typed array as this column get loaded without handling each
+    # cell separately.
+    if packed.typecode != self._data.typecode:
+      return False
+    self._data.set_packed(packed.row_range or row_ids, packed.values)
+    # The sparse values still go through set(), which takes care of any conversions.
+    for pos, value in packed.other.items():
+      self.set(row_ids[pos], value)
+    return True
+
+
+class IntColumn(TypedArrayColumn):
+  """
+  IntColumn holds 32-bit integers. It's used for Int columns, and for the special 'id' column.
+  """
+  def _new_typed_data(self):
+    return column_storage.make_int_data()
+
+
 class ChoiceColumn(DataColumn):
   def rename_choices(self, renames):
     row_ids = []
@@ -263,7 +340,10 @@ class ChoiceColumn(DataColumn):
     return renames.get(value)
 
 
-class BoolColumn(BaseColumn):
+class BoolColumn(TypedArrayColumn):
+  def _new_typed_data(self):
+    return column_storage.make_bool_data()
+
   def set(self, row_id, value):
     # When 1 or 1.0 is loaded, we should see it as True, and similarly 0 as False. This is similar
     # to how, after loading a number into a DateColumn, we should see a date, except we adjust
@@ -271,7 +351,10 @@ class BoolColumn(BaseColumn):
     bool_value = True if value == 1 else (False if value == 0 else value)
     super(BoolColumn, self).set(row_id, bool_value)
 
-class NumericColumn(BaseColumn):
+class NumericColumn(TypedArrayColumn):
+  def _new_typed_data(self):
+    return column_storage.make_float_data()
+
   def set(self, row_id, value):
     # Make sure any integers are treated as floats to avoid truncation.
     # Uses `type(value) == int` rather than `isintance(value, int)` to specifically target
@@ -367,6 +450,14 @@ class PositionColumn(NumericColumn):
     if value != self.getdefault():
       self._sorted_rows.add(row_id)
 
+  def load_packed(self, row_ids, packed):
+    if not super(PositionColumn, self).load_packed(row_ids, packed):
+      return False
+    default = self.getdefault()
+    self._sorted_rows.clear()
+    self._sorted_rows.update(r for r in row_ids if self.raw_get(r) != default)
+    return True
+
   def copy_from_column(self, other_column):
     super(PositionColumn, self).copy_from_column(other_column)
     self._sorted_rows = SortedListWithKey(other_column._sorted_rows[:],
@@ -378,11 +469,10 @@ class PositionColumn(NumericColumn):
     # used for updating a position for an existing row: we'll find a new value for it; later when
     # this value is set, the old position will be removed and the new one added.
     if ignore_data:
-      rows = []
+      rows = SortedListWithKey(key=self.raw_get)
     else:
-      rows = self._sorted_rows
-    # prepare_inserts expects floats as keys, not MixedTypesKeys
-    rows = SortedListWithKey(rows, key=self.raw_get)
+      # prepare_inserts expects floats as keys, not the SafeSortKeys that _sorted_rows uses.
+      rows = relabeling.SortedKeyView(self._sorted_rows, self.raw_get, SafeSortKey)
     adjustments, new_values = relabeling.prepare_inserts(rows, values)
     adj_action = _adjustments_to_action(self.node,
         [(self._sorted_rows[i], pos) for (i, pos) in adjustments])
@@ -458,21 +548,33 @@ class BaseReferenceColumn(BaseColumn):
   def _list_to_value(self, value_as_list):
     raise NotImplementedError()
 
+  def clear(self):
+    super(BaseReferenceColumn, self).clear()
+    self._relation.clear()
+
   def set(self, row_id, value):
     old = self.safe_get(row_id)
     super(BaseReferenceColumn, self).set(row_id, self._clean_up_value(value))
     new = self.safe_get(row_id)
     self._update_references(row_id, old, new)
 
+  def set_many(self, row_ids, values):
+    # Collect the new references, to add them to the relation together.
+    new_references = []
+    for row_id, value in zip(row_ids, values):
+      old = self.safe_get(row_id)
+      super(BaseReferenceColumn, self).set(row_id, self._clean_up_value(value))
+      self._update_references(row_id, old, None)
+      new_references.extend((row_id, r) for r in self._value_iterable(self.safe_get(row_id)))
+    self._relation.add_references(new_references)
+
   def copy_from_column(self, other_column):
     super(BaseReferenceColumn, self).copy_from_column(other_column)
-    self._relation.clear()
     # This is hacky: we should have an interface to iterate through values of a column. (As it is,
     # self._data may include values for non-existent rows; it works here because those values are
-    # falsy, which makes them ignored by self._update_references).
-    for row_id, value in enumerate(self._data):
-      if self.type_obj.is_right_type(value):
-        self._update_references(row_id, None, value)
+    # falsy, which makes them ignored by self._value_iterable).
+    self._relation.reset_references(
+      (row_id, r) for row_id, value in enumerate(self._data) for r in self._value_iterable(value))
 
   def sample_value(self):
     return self._target_table.sample_record
@@ -513,8 +615,8 @@ class BaseReferenceColumn(BaseColumn):
     reverse_col = self._target_table.get_column(rev_col_id)
     reverse_adjustments = []
     for target_row_id in self._target_table.row_ids:
-      reverse_value = self._relation.get_affected_rows((target_row_id,))
-      reverse_adjustments.append((target_row_id, sorted(reverse_value)))
+      reverse_value = self._relation.get_referring_rows(target_row_id)
+      reverse_adjustments.append((target_row_id, list(reverse_value)))
     return _adjustments_to_action(reverse_col.node,
         [(row_id, reverse_col._list_to_value(value)) for (row_id, value) in reverse_adjustments])
 
@@ -685,6 +787,8 @@ usertypes.Date.ColType = DateColumn
 usertypes.PositionNumber.ColType = PositionColumn
 usertypes.Bool.ColType = BoolColumn
 usertypes.Numeric.ColType = NumericColumn
+usertypes.Int.ColType = IntColumn
+usertypes.Id.ColType = IntColumn
 
 def create_column(table, col_id, col_info):
   return col_info.type_obj.ColType(table, col_id, col_info)
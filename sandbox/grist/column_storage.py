@@ -0,0 +1,222 @@
+"""
+Compact storage for the cell values of typed columns.
+
+A plain Python list costs a pointer per cell plus a boxed object for every distinct value (e.g. 24
+bytes for each float). For columns whose values are almost always of one primitive type (Numeric,
+Date, DateTime, Bool, Int, and the special 'id' column) we instead keep values in an
+`array.array`, which stores them unboxed.
+
+A cell may still contain a value of the wrong type (alttext, or a RaisedException for formula
+columns), and also None for an empty cell. Such cells are marked in a parallel `bytearray` of
+flags, with the actual value kept in a sparse side-table (a dict keyed by row_id). None values are
+not stored at all: a flagged cell missing from the side-table is None. This makes columns with
+mostly empty cells (common for Date columns, whose default is None) cheap too.
+
+TypedColumnData implements enough of the list interface (indexing, len(), iteration, extend())
+for column.BaseColumn to use it in place of a list.
+"""
+import array
+import sys
+
+from objtypes import is_int_short
+
+# Typecode for a signed 32-bit integer, used for Int and Id columns, whose right-type values are
+# limited to 32 bits (see objtypes.is_int_short).
+INT32_TYPECODE = 'i' if array.array('i').itemsize >= 4 else 'l'
+
+
+class TypedColumnData(object):
+  """
+  A list-like container of cell values, backed by an array.array of the given typecode. The
+  `fits` function decides which values are stored in the array; all others go to the side-table.
+  Reading a value stored in the array returns it as the array returns it, so `fits` must only
+  accept values that round-trip exactly (e.g. `type(value) is float` for typecode 'd').
+  """
+  __slots__ = ('_typecode', '_fits', '_values', '_flags', '_other')
+
+  def __init__(self, typecode, fits, values=()):
+    self._typecode = typecode
+    self._fits = fits
+    self._values = array.array(typecode)
+    self._flags = bytearray()
+    self._other = {}
+    self.extend(values)
+
+  def copy(self):
+    """
+    Returns a copy of this container; it's much faster than copying value by value.
+    """
+    result = self.__class__(self._typecode, self._fits)
+    result._values = array.array(self._typecode, self._values)
+    result._flags = bytearray(self._flags)
+    result._other = self._other.copy()
+    return result
+
+  def is_compatible(self, other):
+    """
+    Returns whether `other` is a TypedColumnData that stores values in the same way as self, so
+    that it can be copied with copy().
+    """
+    return (type(other) is type(self) and other._typecode == self._typecode and
+            other._fits is self._fits)
+
+  @property
+  def typecode(self):
+    return self._typecode
+
+  def __len__(self):
+    return len(self._flags)
+
+  def __getitem__(self, index):
+    # Both lookups raise IndexError for out-of-range indices, like a list would.
+    if self._flags[index]:
+      return self._other.get(index)
+    return self._values[index]
+
+  def __setitem__(self, index, value):
+    if self._fits(value):
+      self._values[index] = value
+      if self._flags[index]:
+        self._flags[index] = 0
+        self._other.pop(index, None)
+    else:
+      self._flags[index] = 1
+      if value is None:
+        self._other.pop(index, None)
+      else:
+        self._other[index] = value
+
+  def __iter__(self):
+    for i in range(len(self._flags)):
+      yield self[i]
+
+  def append(self, value):
+    index = len(self._flags)
+    if self._fits(value):
+      self._values.append(value)
+      self._flags.append(0)
+    else:
+      self._values.append(0)
+      self._flags.append(1)
+      if value is not None:
+        self._other[index] = value
+
+  def extend(self, values):
+    for value in values:
+      self.append(value)
+
+  def growto(self, size, default):
+    """
+    Grows the container to the given size, filling new cells with `default`. This is the
+    equivalent of `extend([default] * count)`, but avoids building the intermediate list.
+    """
+    start = len(self._flags)
+    count = size - start
+    if count <= 0:
+      return
+    if self._fits(default):
+      self._values.extend(array.array(self._typecode, [default]) * count)
+      self._flags.extend(bytearray(count))
+    else:
+      self._values.extend(array.array(self._typecode, [0]) * count)
+      self._flags.extend(b'\x01' * count)
+      if default is not None:
+        self._other.update((i, default) for i in range(start, size))
+
+  def pack(self, row_ids):
+    """
+    Returns a pair (values, other) for the given row_ids. Here `values` is a buffer with an item of
+    the array for each row, and `other` is a dict mapping positions in row_ids to the values of
+    cells that don't fit in the array (including None); their items in `values` are meaningless.
+    If row_ids is a range (with step 1), `values` is a single slice of the array. It's a copy, so
+    that it doesn't change with the column, or prevent the array from growing.
+    """
+    flags = self._flags
+    if isinstance(row_ids, range) and row_ids.step == 1:
+      start, stop = row_ids.start, row_ids.stop
+      values = self._values[start:stop]
+      other = {}
+      index = flags.find(1, start, stop)
+      while index != -1:
+        other[index - start] = self._other.get(index)
+        index = flags.find(1, index + 1, stop)
+      return values, other
+
+    all_values = self._values
+    values = array.array(self._typecode, [all_values[r] for r in row_ids])
+    other = {pos: self._other.get(r) for (pos, r) in enumerate(row_ids) if flags[r]}
+    return values, other
+
+  def set_packed(self, row_ids, values):
+    """
+    Sets the cells for the given row_ids to the items of `values`, an array.array of the same
+    typecode (all of whose items fit). The row_ids must be within range. If row_ids is a range
+    (with step 1), this is done with a single slice assignment.
+    """
+    if isinstance(row_ids, range) and row_ids.step == 1:
+      start, stop = row_ids.start, row_ids.stop
+      self._values[start:stop] = values
+      self._flags[start:stop] = bytes(stop - start)
+      for index in [i for i in self._other if start <= i < stop]:
+        del self._other[index]
+      return
+
+    for (row_id, value) in zip(row_ids, values):
+      self._values[row_id] = value
+      if self._flags[row_id]:
+        self._flags[row_id] = 0
+        self._other.pop(row_id, None)
+
+  def clear(self):
+    del self._values[:]
+    del self._flags[:]
+    self._other.clear()
+
+  def memory_usage(self):
+    """
+    Returns the approximate number of bytes used by this container, including the side-table.
+    """
+    return (sys.getsizeof(self._values) + sys.getsizeof(self._flags) +
+            sys.getsizeof(self._other) + sum(sys.getsizeof(v) for v in self._other.values()))
+
+
+class BoolColumnData(TypedColumnData):
+  """
+  TypedColumnData for booleans. The array stores them as 0 or 1, so reads convert back to bool.
+  """
+  __slots__ = ()
+
+  def __getitem__(self, index):
+    if self._flags[index]:
+      return self._other.get(index)
+    return bool(self._values[index])
+
+
+# pylint: disable=unidiomatic-typecheck
+def fits_float(value):
+  return type(value) is float
+
+def fits_bool(value):
+  return type(value) is bool
+
+def fits_int32(value):
+  return type(value) is int and is_int_short(value)
+
+
+def make_float_data(values=()):
+  return TypedColumnData('d', fits_float, values)
+
+def make_bool_data(values=()):
+  return BoolColumnData('b', fits_bool, values)
+
+def make_int_data(values=()):
+  return TypedColumnData(INT32_TYPECODE, fits_int32, values)
+
+
+def list_memory_usage(values):
+  """
+  Returns the approximate number of bytes used by a plain list of cell values, counting each
+  distinct value object once (so that e.g. shared default values aren't over-counted).
+  """
+  seen = {id(v): v for v in values}
+  return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in seen.values())
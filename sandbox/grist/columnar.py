@@ -0,0 +1,195 @@
+"""
+A packed columnar encoding of table data, used as an optional alternative to marshalled lists of
+values when transferring whole tables between the sandbox and the Node server (see the
+fetch_table_columnar and load_table_columnar functions in main.py).
+
+The encoding is a dict (suitable for marshal), with keys:
+  "format": FORMAT, to identify the encoding and its version.
+  "byteorder": "little" or "big", the byte order of all numeric buffers.
+  "table_id": the table ID.
+  "row_ids": a buffer of int32 row IDs.
+  "columns": a dict mapping col_ids to column encodings, each with values in the order of row_ids.
+
+A column encoding is a dict whose "kind" key determines the other keys:
+  "f64", "i32", "bool": "data" is a buffer of float64, int32, or int8 values, one per row.
+  "text": "strings" is a list of distinct strings, and "codes" is a buffer of int32 indices into
+      it, one per row.
+  "list": "values" is a list of values encoded with objtypes.encode_object(), one per row. This is
+      used for all other columns.
+
+Cells whose values don't fit the kind of their column (e.g. alttext, errors, None) are listed in
+a separate sparse channel: "other_pos" is a buffer of int32 positions (indices into row_ids), and
+"other_values" is a list of the values at those positions, encoded with objtypes.encode_object().
+The items of "data" or "codes" at those positions are meaningless.
+
+Buffers are produced from the typed arrays of columns (see column_storage.py) as single slices
+when row IDs are contiguous, and loaded into them without decoding each cell.
+"""
+import array
+import sys
+
+from column_storage import INT32_TYPECODE
+import actions
+import objtypes
+
+FORMAT = "grist-columnar-1"
+
+# Maps the kinds of typed buffers to array typecodes.
+_KIND_TYPECODES = {
+  "f64": 'd',
+  "i32": INT32_TYPECODE,
+  "bool": 'b',
+}
+_TYPECODE_KINDS = {typecode: kind for (kind, typecode) in _KIND_TYPECODES.items()}
+
+# Column types whose values are dictionary-encoded.
+_TEXT_TYPES = ('Text', 'Choice')
+
+
+class PackedValues(object):
+  """
+  A decoded column from the columnar encoding, acting as a read-only list of cell values. When
+  `typecode` is set, `values` is an array.array of that typecode, and a column using compatible
+  storage can load it directly (see column.TypedArrayColumn.load_packed). Cells in `other` (a dict
+  mapping positions to decoded values) override the corresponding items of `values`.
+
+  If the row IDs are contiguous, `row_range` is the range of them, which allows loading the values
+  into a typed array with a single slice assignment.
+  """
+  __slots__ = ('typecode', 'values', 'other', 'row_range')
+
+  def __init__(self, typecode, values, other, row_range):
+    self.typecode = typecode
+    self.values = values
+    self.other = other
+    self.row_range = row_range
+
+  def __len__(self):
+    return len(self.values)
+
+  def __getitem__(self, pos):
+    if pos in self.other:
+      return self.other[pos]
+    value = self.values[pos]
+    return bool(value) if self.typecode == 'b' else value
+
+  def __iter__(self):
+    for pos in range(len(self.values)):
+      yield self[pos]
+
+
+def _get_row_range(row_ids):
+  """
+  Returns a range equal to the given sorted list of row_ids if they are contiguous, else None.
+  """
+  if row_ids and row_ids[-1] - row_ids[0] == len(row_ids) - 1:
+    return range(row_ids[0], row_ids[-1] + 1)
+  return None
+
+
+def _int32_buffer(values):
+  return array.array(INT32_TYPECODE, values)
+
+
+def _encode_other(other):
+  positions = sorted(other)
+  return {
+    "other_pos": _int32_buffer(positions),
+    "other_values": [objtypes.encode_object(other[pos]) for pos in positions],
+  }
+
+
+def encode_column(col, row_ids, row_range=None):
+  """
+  Returns the encoding of the values of the given column for the given row_ids. If row_range is
+  given, it must be a range equal to row_ids.
+  """
+  data = col._data
+  typecode = getattr(data, 'typecode', None)
+  if typecode in _TYPECODE_KINDS:
+    values, other = data.pack(row_range or row_ids)
+    result = {"kind": _TYPECODE_KINDS[typecode], "data": values}
+    result.update(_encode_other(other))
+    return result
+
+  raw_get = col.raw_get
+  if col.type_obj.typename() in _TEXT_TYPES:
+    strings = []
+    string_codes = {}
+    codes = _int32_buffer([])
+    other = {}
+    for pos, row_id in enumerate(row_ids):
+      value = raw_get(row_id)
+      if type(value) is str:   # pylint: disable=unidiomatic-typecheck
+        code = string_codes.get(value)
+        if code is None:
+          code = string_codes[value] = len(strings)
+          strings.append(value)
+        codes.append(code)
+      else:
+        codes.append(-1)
+        other[pos] = value
+    result = {"kind": "text", "strings": strings, "codes": codes}
+    result.update(_encode_other(other))
+    return result
+
+  return {"kind": "list", "values": [objtypes.encode_object(raw_get(r)) for r in row_ids]}
+
+
+def encode_table(table, row_ids, col_ids):
+  """
+  Returns the columnar encoding of the given columns of a table, for the given sorted row_ids.
+  """
+  row_range = _get_row_range(row_ids)
+  return {
+    "format": FORMAT,
+    "byteorder": sys.byteorder,
+    "table_id": table.table_id,
+    "row_ids": _int32_buffer(row_ids),
+    "columns": {col_id: encode_column(table.get_column(col_id), row_ids, row_range)
+                for col_id in col_ids},
+  }
+
+
+def _load_buffer(typecode, buf, byteorder):
+  values = array.array(typecode)
+  values.frombytes(buf)
+  if byteorder != sys.byteorder:
+    values.byteswap()
+  return values
+
+
+def decode_table(encoded):
+  """
+  Decodes the columnar encoding into an actions.TableData, whose column values are PackedValues
+  objects. Only the cells in the sparse channel get decoded individually.
+  """
+  if encoded.get("format") != FORMAT:
+    raise ValueError("Unsupported columnar format %r" % (encoded.get("format"),))
+  byteorder = encoded["byteorder"]
+  row_ids = _load_buffer(INT32_TYPECODE, encoded["row_ids"], byteorder).tolist()
+  row_range = _get_row_range(row_ids)
+
+  columns = {}
+  for col_id, enc in encoded["columns"].items():
+    kind = enc["kind"]
+    other = {}
+    if "other_pos" in enc:
+      positions = _load_buffer(INT32_TYPECODE, enc["other_pos"], byteorder)
+      other = dict(zip(positions, map(objtypes.decode_object, enc["other_values"])))
+
+    if kind in _KIND_TYPECODES:
+      typecode = _KIND_TYPECODES[kind]
+      columns[col_id] = PackedValues(typecode, _load_buffer(typecode, enc["data"], byteorder),
+                                     other, row_range)
+    elif kind == "text":
+      strings = enc["strings"]
+      codes = _load_buffer(INT32_TYPECODE, enc["codes"], byteorder)
+      columns[col_id] = PackedValues(None, [strings[c] if c >= 0 else None for c in codes],
+                                     other, row_range)
+    elif kind == "list":
+      columns[col_id] = [objtypes.decode_object(v) for v in enc["values"]]
+    else:
+      raise ValueError("Unknown column kind %r in columnar data" % (kind,))
+
+  return actions.TableData(encoded["table_id"], row_ids, columns)
@@ -18,8 +18,11 @@ in use, while property access determines which Nodes (or columns) depend on one
 # for this (with computed values properly persisted) could allow some cool use cases, like columns
 # that recompute manually rather than automatically.
 
+import sys
+from array import array
 from collections import namedtuple
-from sortedcontainers import SortedSet
+
+from rowset import RowSet
 
 class Node(namedtuple('Node', ('table_id', 'col_id'))):
   """
@@ -59,66 +62,206 @@ class _AllRows(object):
 
 ALL_ROWS = _AllRows()
 
+# Edges are stored as ints combining two ids (see Graph), each taking this many bits.
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+
 class Graph(object):
   """
   Represents the dependency graph for all data in a grist document.
+
+  Nodes and relations are interned as small integer ids, and each edge is stored as an int packing
+  two of them: in an array for its out_node (as in_id and relation id), and in a set for its
+  in_node (as out_id and relation id). This keeps large graphs compact, and makes checking for a
+  known edge a single set lookup.
   """
   def __init__(self):
-    # The set of all Edges, i.e. the complete dependency graph.
-    self._all_edges = set()
+    # Interned nodes: _nodes[node_id] is the Node, and _node_ids maps it back to its id. A node's
+    # id is released once it has no edges, and ids of released nodes (whose entries in _nodes are
+    # None) get reused.
+    self._nodes = []
+    self._node_ids = {}
+    self._free_node_ids = []
+
+    # Interned relations, with the number of edges using each, to release them when unused. Ids of
+    # released relations (whose entries in _relations are None) get reused.
+    self._relations = []
+    self._relation_ids = {}
+    self._relation_edge_counts = []
+    self._free_relation_ids = []
+
+    # Map from out_node id to an array of (in_id << _ID_BITS | relation_id), i.e. its dependencies.
+    # Dependencies only get removed all at once (see clear_dependencies), so an array will do.
+    self._out_edges = {}
+
+    # Map from in_node id to the set of (out_id << _ID_BITS | relation_id), i.e. its dependents.
+    self._in_edges = {}
 
-    # Map from node to the set of edges having it as the in_node (i.e. edges to dependents).
-    self._in_node_map = {}
+    self._edge_count = 0
 
-    # Map from node to the set of edges having it as the out_node (i.e. edges to dependencies).
-    self._out_node_map = {}
+    # In incremental mode, invalidating a whole column doesn't cascade into full recomputation of
+    # its dependents. See invalidate_deps() for details.
+    self.incremental = False
+
+    # When set to a set, add_edge() adds to it each Edge it's called with, whether the edge is new
+    # or already known (see parallel_recalc.py).
+    self.used_edges = None
+
+  def _get_node_id(self, node):
+    node_id = self._node_ids.get(node)
+    if node_id is None:
+      if self._free_node_ids:
+        node_id = self._free_node_ids.pop()
+        self._nodes[node_id] = node
+      else:
+        node_id = len(self._nodes)
+        self._nodes.append(node)
+      self._node_ids[node] = node_id
+    return node_id
+
+  def _release_node_id_if_unused(self, node_id):
+    if node_id not in self._out_edges and node_id not in self._in_edges:
+      del self._node_ids[self._nodes[node_id]]
+      self._nodes[node_id] = None
+      self._free_node_ids.append(node_id)
+
+  def _acquire_relation_id(self, relation):
+    rel_id = self._relation_ids.get(relation)
+    if rel_id is None:
+      if self._free_relation_ids:
+        rel_id = self._free_relation_ids.pop()
+        self._relations[rel_id] = relation
+      else:
+        rel_id = len(self._relations)
+        self._relations.append(relation)
+        self._relation_edge_counts.append(0)
+      self._relation_ids[relation] = rel_id
+    self._relation_edge_counts[rel_id] += 1
+    return rel_id
+
+  def _release_relation_id(self, rel_id):
+    self._relation_edge_counts[rel_id] -= 1
+    if self._relation_edge_counts[rel_id] == 0:
+      del self._relation_ids[self._relations[rel_id]]
+      self._relations[rel_id] = None
+      self._free_relation_ids.append(rel_id)
+
+  def iter_edges(self):
+    """
+    Yields all Edges in the graph.
+    """
+    nodes, relations = self._nodes, self._relations
+    for out_id, out_edges in self._out_edges.items():
+      for key in out_edges:
+        yield Edge(nodes[out_id], nodes[key >> _ID_BITS], relations[key & _ID_MASK])
 
   def dump_graph(self):
     """
     Print out the graph to stdout, for debugging.
     """
-    print("Dependency graph (%d edges):" % len(self._all_edges))
-    for edge in sorted(self._all_edges):
+    print("Dependency graph (%d edges):" % self._edge_count)
+    for edge in sorted(self.iter_edges()):
       print("  %s" % (edge,))
 
+  def get_stats(self):
+    """
+    Returns a dict with the numbers of nodes, edges and relations in the graph, and the approximate
+    number of bytes taken by its bookkeeping (not including the Node and Relation objects).
+    """
+    size = sys.getsizeof
+    num_bytes = sum(size(obj) for obj in (
+      self._nodes, self._node_ids, self._free_node_ids, self._relations, self._relation_ids,
+      self._relation_edge_counts, self._free_relation_ids, self._out_edges, self._in_edges))
+    num_bytes += sum(size(count) for count in self._relation_edge_counts)
+    num_bytes += sum(size(edges) for edges in self._out_edges.values())
+    for edges in self._in_edges.values():
+      num_bytes += size(edges) + sum(size(key) for key in edges)
+    return {
+      "nodes": len(self._node_ids),
+      "edges": self._edge_count,
+      "relations": len(self._relation_ids),
+      "bytes": num_bytes,
+    }
+
   def add_edge(self, out_node, in_node, relation):
     """
     Adds an edge to the global dependency graph: out_node depends on in_node, i.e. a change to
-    in_node should trigger a recomputation of out_node.
+    in_node should trigger a recomputation of out_node. Returns True if the edge is new, and False
+    if it was already in the graph.
     """
-    edge = Edge(out_node, in_node, relation)
-    self._all_edges.add(edge)
-    self._in_node_map.setdefault(edge.in_node, set()).add(edge)
-    self._out_node_map.setdefault(edge.out_node, set()).add(edge)
+    # This is called for every access to a column in a formula, so checking for a known edge is
+    # kept fast.
+    node_ids = self._node_ids
+    out_id = node_ids.get(out_node)
+    in_id = node_ids.get(in_node)
+    rel_id = self._relation_ids.get(relation)
+    if self.used_edges is not None:
+      self.used_edges.add(Edge(out_node, in_node, relation))
+    if out_id is not None and in_id is not None and rel_id is not None:
+      in_edges = self._in_edges.get(in_id)
+      if in_edges and (out_id << _ID_BITS | rel_id) in in_edges:
+        return False
+    if out_id is None:
+      out_id = self._get_node_id(out_node)
+    if in_id is None:
+      in_id = self._get_node_id(in_node)
+    rel_id = self._acquire_relation_id(relation)
+    out_edges = self._out_edges.get(out_id)
+    if out_edges is None:
+      out_edges = self._out_edges[out_id] = array('Q')
+    out_edges.append(in_id << _ID_BITS | rel_id)
+    self._in_edges.setdefault(in_id, set()).add(out_id << _ID_BITS | rel_id)
+    self._edge_count += 1
+    return True
 
   def clear_dependencies(self, out_node):
     """
     Removes all edges which affect the given out_node, i.e. all of its dependencies.
     """
-    remove_edges = self._out_node_map.pop(out_node, ())
-    for edge in remove_edges:
-      self._all_edges.remove(edge)
-      self._in_node_map.get(edge.in_node, set()).remove(edge)
-      edge.relation.reset_all()
+    out_id = self._node_ids.get(out_node)
+    if out_id is None:
+      return
+    unused_in_ids = []
+    for key in self._out_edges.pop(out_id, ()):
+      in_id, rel_id = key >> _ID_BITS, key & _ID_MASK
+      in_edges = self._in_edges[in_id]
+      in_edges.remove(out_id << _ID_BITS | rel_id)
+      if not in_edges:
+        del self._in_edges[in_id]
+        if in_id != out_id:
+          unused_in_ids.append(in_id)
+      relation = self._relations[rel_id]
+      self._release_relation_id(rel_id)
+      self._edge_count -= 1
+      relation.reset_all()
+    for in_id in unused_in_ids:
+      self._release_node_id_if_unused(in_id)
+    self._release_node_id_if_unused(out_id)
 
   def reset_dependencies(self, node, dirty_rows):
     """
     For edges the given node depends on, reset the given output rows. This is called just before
     the rows get recomputed, to allow the relations to clear out state for those rows if needed.
     """
-    in_edges = self._out_node_map.get(node, ())
-    for edge in in_edges:
-      edge.relation.reset_rows(dirty_rows)
+    node_id = self._node_ids.get(node)
+    for key in self._out_edges.get(node_id, ()):
+      self._relations[key & _ID_MASK].reset_rows(dirty_rows)
+
+  def get_in_nodes(self, out_node):
+    """
+    Returns the set of nodes that the given out_node depends on.
+    """
+    out_id = self._node_ids.get(out_node)
+    return {self._nodes[key >> _ID_BITS] for key in self._out_edges.get(out_id, ())}
 
   def remove_node_if_unused(self, node):
     """
     Removes the given node if it has no dependents. Returns True if the node is gone, False if the
     node has dependents.
     """
-    if self._in_node_map.get(node, None):
+    if self._in_edges.get(self._node_ids.get(node)):
       return False
     self.clear_dependencies(node)
-    self._in_node_map.pop(node, None)
     return True
 
   def invalidate_deps(self, dirty_node, dirty_rows, recompute_map, include_self=True):
@@ -130,22 +273,32 @@ class Graph(object):
 
     If dirty_rows is ALL_ROWS, the whole column is affected, and dependencies get recomputed from
     scratch. ALL_ROWS propagates to all dependent columns, so those also get recomputed in full.
+
+    In incremental mode, only dirty_node itself has its dependencies cleared. The formulas of its
+    dependents haven't changed, so their edges stay valid, and each edge's relation is asked which
+    of its rows depend on the column as a whole (see Relation.get_all_affected_rows). E.g. when a
+    formula changes, only the rows that looked up values in its column get recomputed elsewhere.
     """
     to_invalidate = [(dirty_node, dirty_rows)]
+    is_origin = True
 
     while to_invalidate:
       dirty_node, dirty_rows = to_invalidate.pop()
       if include_self:
         if recompute_map.get(dirty_node) == ALL_ROWS:
+          if self.incremental and is_origin:
+            # It may have been reached as a dependent earlier, which kept its dependencies.
+            self.clear_dependencies(dirty_node)
           continue
         if dirty_rows == ALL_ROWS:
           recompute_map[dirty_node] = ALL_ROWS
           # If all rows are being recomputed, clear the dependencies of the affected column. (We add
           # dependencies in the course of recomputing, but we can only start from an empty set of
           # dependencies if we are about to recompute all rows.)
-          self.clear_dependencies(dirty_node)
+          if not self.incremental or is_origin:
+            self.clear_dependencies(dirty_node)
         else:
-          out_rows = recompute_map.setdefault(dirty_node, SortedSet())
+          out_rows = recompute_map.setdefault(dirty_node, RowSet())
           prev_count = len(out_rows)
           out_rows.update(dirty_rows)
           # Don't bother recursing into dependencies if we didn't actually update anything.
@@ -153,12 +306,18 @@ class Graph(object):
             continue
 
       include_self = True
+      is_origin = False
+      all_rows = self.incremental and dirty_rows == ALL_ROWS
 
-      for edge in self._in_node_map.get(dirty_node, ()):
-        affected_rows = edge.relation.get_affected_rows(dirty_rows)
+      for key in self._in_edges.get(self._node_ids.get(dirty_node), ()):
+        relation = self._relations[key & _ID_MASK]
+        if all_rows:
+          affected_rows = relation.get_all_affected_rows()
+        else:
+          affected_rows = relation.get_affected_rows(dirty_rows)
 
         # Previously this was:
         #   self.invalidate_deps(edge.out_node, affected_rows, recompute_map, include_self=True)
         # but that led to a recursion error, so now we do the equivalent
         # without actual recursion, hence the while loop
-        to_invalidate.append((edge.out_node, affected_rows))
+        to_invalidate.append((self._nodes[key >> _ID_BITS], affected_rows))
@@ -3,6 +3,7 @@
 The data engine ties the code generated from the schema with the document data, and with
 dependency tracking.
 """
+import hashlib
 import itertools
 import logging
 import re
@@ -13,35 +14,51 @@ import traceback
 from collections import namedtuple, OrderedDict, defaultdict
 
 from collections.abc import Hashable
-from sortedcontainers import SortedSet
 
 import acl
 import actions
 import action_obj
 from attribute_recorder import AttributeRecorder
 from autocomplete_context import AutocompleteContext, lookup_autocomplete_options, eval_suggestion
+import codebuilder
+import columnar
 from codebuilder import DOLLAR_REGEX
 import depend
 import docactions
 import docmodel
 from fake_std_streams import FakeStdStreams
 import gencode
+import lookup
 import match_counter
 import objtypes
 from objtypes import strict_equal
+import parallel_recalc
+from rowset import RowSet
 from relation import SingleRowsIdentityRelation
 import sandbox
 import schema
 from schema import RecalcWhen
 import table as table_module
 from timing import DummyTiming
+from profiler import DummyProfiler, Profiler
 from user import User # pylint:disable=wrong-import-order
 import useractions
+import usertypes
 import column
 import urllib_patch  # noqa imported for side effect # pylint:disable=unused-import
 
 log = logging.getLogger(__name__)
 
+# Default number of rows returned by fetch_table_chunk().
+FETCH_CHUNK_SIZE = 10000
+
+# Column types for which fetch_table queries may use a lookup index (see _get_indexed_rows).
+_INDEXED_QUERY_TYPES = ('Text', 'Choice', 'Numeric', 'Int', 'Bool', 'Ref')
+
+
+def _no_formula_tracer(_col, _record):
+  pass
+
 
 class OrderError(Exception):
   """
@@ -77,6 +94,39 @@ class RequestingError(Exception):
 # An item of work to be done by Engine._update
 WorkItem = namedtuple('WorkItem', ('node', 'row_ids', 'locks'))
 
+# A user table registered with Engine.register_lazy_table(), whose data isn't loaded yet.
+LazyTable = namedtuple('LazyTable', ('row_count', 'load_func'))
+
+# Identifiers in formulas, used to find the tables that formulas may refer to by name.
+_identifier_re = re.compile(r'\b[A-Za-z_]\w*\b')
+
+# Included in get_formula_fingerprint(), to be incremented when a change to the engine may change
+# the results of existing formulas.
+FORMULA_FINGERPRINT_VERSION = 1
+
+# Functions whose results don't only depend on the document's data, and need recalculating on open.
+_VOLATILE_FUNCTIONS = frozenset(['NOW', 'TODAY', 'REQUEST'])
+
+# User actions and doc actions that don't read or change data in user tables directly. Applying
+# them doesn't require loading any lazy tables.
+_NO_LAZY_LOAD_ACTIONS = frozenset([
+  'Calculate', 'UpdateCurrentTime', 'RespondToRequests', 'ApplyDocActions', 'ApplyUndoActions',
+])
+
+# Actions that only change the records of the table given by their table_id, mapped to the name
+# of the bulk action used to implement them.
+_RECORD_ACTIONS = {
+  'AddRecord': 'BulkAddRecord',
+  'BulkAddRecord': 'BulkAddRecord',
+  'UpdateRecord': 'BulkUpdateRecord',
+  'BulkUpdateRecord': 'BulkUpdateRecord',
+  'RemoveRecord': 'BulkRemoveRecord',
+  'BulkRemoveRecord': 'BulkRemoveRecord',
+  'AddOrUpdateRecord': 'BulkAddOrUpdateRecord',
+  'BulkAddOrUpdateRecord': 'BulkAddOrUpdateRecord',
+  'ReplaceTableData': 'ReplaceTableData',
+}
+
 # skip private members, and methods we don't want to expose to users.
 skipped_completions = re.compile(r'\.(_|lookupOrAddDerived|getSummarySourceGroup)')
 
@@ -164,9 +214,6 @@ class Engine(object):
     # Contains Nodes once an exception value has been seen for them.
     self._is_node_exception_reported = set()
 
-    # Contains Edges (node1, node2, relation) already seen during formula accesses.
-    self._recompute_edge_set = set()
-
     # Sanity-check counter to check if we are making progress.
     self._recompute_done_counter = 0
 
@@ -207,7 +254,15 @@ class Engine(object):
 
     # Create the formula tracer that can be overridden to trace formula evaluations. It is called
     # with the Column and Record object for the formula about to be evaluated. It's used in tests.
-    self.formula_tracer = lambda col, record: None
+    self.formula_tracer = _no_formula_tracer
+
+    # Maps formula text to the result of codebuilder.make_batch_formula() for it, i.e. to None or
+    # to a (col_ids, func) pair, for formulas that can be evaluated by _recompute_batch().
+    self._batch_formulas = {}
+
+    # Maps formula text to the result of codebuilder.parse_summary_aggregate() for it, i.e. to None
+    # or to a (func_name, col_id) pair, for summary formulas maintained by an AggregateMapColumn.
+    self._summary_aggregates = {}
 
     # Create the object that knows how to interpret UserActions.
     self.doc_actions = docactions.DocActions(self)
@@ -245,6 +300,17 @@ class Engine(object):
 
     self._table_stats = {"meta": [], "user": []}
 
+    # Maps table_ids of lazily-loaded user tables that haven't been loaded yet to LazyTable tuples.
+    # See register_lazy_table().
+    self._lazy_tables = {}
+
+    # Cached result of _get_table_sources(), cleared when the schema changes.
+    self._table_sources = None
+
+    # The set of nodes of formula columns whose loaded values were trusted by
+    # trust_formula_values(), and which haven't been computed since.
+    self._trusted_nodes = set()
+
     #### Attributes used by the REQUEST function:
     # True when the formula should synchronously call the exported JS method to make the request
     # immediately instead of reevaluating the formula later. Used when reevaluating a single
@@ -259,6 +325,10 @@ class Engine(object):
     self._cached_request_keys = set()
 
     self._timing = DummyTiming()
+    self._profiler = DummyProfiler()
+
+    # Number of worker processes to use for evaluating formulas; see set_recalc_workers().
+    self._recalc_workers = 0
 
   @property
   def autocomplete_context(self):
@@ -294,8 +364,55 @@ class Engine(object):
         key = "user_%s" % field
         result[key] += table[field]
 
+    # Memory used to track which rows did which lookups, which can be significant in large docs.
+    result["lookup_relations_bytes"] = sum(
+      col._relation_tracker.memory_size()
+      for table in self.tables.values() for col in table._special_cols.values()
+      if isinstance(col, lookup.NoValueColumn))
+
+    # Memory used by the indexes of rows referring to each target row, for Reference columns.
+    result["reference_relations_bytes"] = sum(
+      col._relation.memory_size()
+      for table in self.tables.values() for col in table.all_columns.values()
+      if isinstance(col, column.BaseReferenceColumn))
+
+    for field, value in self.dep_graph.get_stats().items():
+      result["dependency_graph_%s" % field] = value
+
     return dict(result)
 
+  def start_profiling(self):
+    """
+    Starts collecting per-formula stats, as described in profiler.py. Formulas that would
+    otherwise be evaluated in a batch (see _recompute_batch) get evaluated per cell while
+    profiling, so that their cells are measured.
+    """
+    self._profiler = Profiler()
+
+  def stop_profiling(self):
+    """
+    Stops profiling, and returns the stats collected since profiling started, or since the last
+    call to get_profile(clear=True).
+    """
+    result = self._profiler.get()
+    self._profiler = DummyProfiler()
+    return result
+
+  def get_profile(self, clear=False):
+    """
+    Returns the stats collected since profiling started, or since the last call with clear=True.
+    With clear=True, also clears the stats, so that the next call only returns new ones.
+    """
+    return self._profiler.get(clear)
+
+  def set_recalc_workers(self, num_workers):
+    """
+    Sets the number of forked worker processes among which to divide independent formula columns
+    when recalculating, as described in parallel_recalc.py. With 0 or 1 (the default), or where
+    forking isn't supported, all formulas are evaluated in this process.
+    """
+    self._recalc_workers = num_workers
+
   def load_empty(self):
     """
     Initialize an empty document, e.g. a newly-created one.
@@ -347,6 +464,146 @@ class Engine(object):
     """
     self._bring_all_up_to_date()
 
+  def register_lazy_table(self, table_id, row_count, load_func):
+    """
+    May be called instead of load_table() for a user table, to load its data only when it's first
+    needed: when a formula accesses it, when it's fetched, or when a user action may read or
+    change it. At that point, load_func() is called, and must return its actions.TableData.
+
+    Until then, the table is treated as clean stored data: its formulas are not computed, and
+    row_count is reported as its number of rows. Once loaded, the table behaves as if it had been
+    loaded with load_table() on open, including the recalculation of its formulas.
+    """
+    if not useractions.is_user_table(table_id):
+      raise ValueError("Only user tables may be loaded lazily: %s" % table_id)
+    self._lazy_tables[table_id] = LazyTable(row_count, load_func)
+    for col in self.tables[table_id].all_columns.values():
+      self.recompute_map.pop(col.node, None)
+
+  def get_formula_fingerprint(self):
+    """
+    Returns a string that identifies the schema and formulas of the document, along with the
+    version of the engine's formula support. Formula values computed by this engine may be
+    trusted on a later load of the document if its fingerprint is the same then.
+    """
+    text = "%s\n%s\n%s" % (FORMULA_FINGERPRINT_VERSION, sys.version_info[:2],
+                            self.gencode.get_full_text())
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+  def trust_formula_values(self, fingerprint):
+    """
+    May be called after loading all tables and before the 'Calculate' action, to skip the
+    recalculation of formulas whose loaded values are already correct. The fingerprint is the
+    result of get_formula_fingerprint() at the time the stored values were last calculated; if it
+    doesn't match the current one, nothing is trusted. Returns whether values were trusted.
+
+    Formulas using NOW(), TODAY() or REQUEST() are still recalculated, as are all formulas in
+    tables that may depend on them (see _get_table_sources). Private formula columns, whose values
+    aren't stored, are always calculated.
+
+    A trusted formula column has no dependencies recorded until it's first computed. So when a
+    table changes, all trusted columns in it and in tables that may depend on it get recalculated
+    in full (see _untrust_formula_values_for_action).
+    """
+    if fingerprint != self.get_formula_fingerprint():
+      return False
+
+    volatile_tables = set()
+    for table_id, schema_table in self.schema.items():
+      for col in schema_table.columns.values():
+        if col.isFormula and _VOLATILE_FUNCTIONS.intersection(_identifier_re.findall(col.formula)):
+          volatile_tables.add(table_id)
+    table_sources = self._get_table_sources()
+
+    for table_id, table in self.tables.items():
+      sources = table_sources.get(table_id, ())
+      if table_id in volatile_tables or not volatile_tables.isdisjoint(sources):
+        continue
+      for col_id in self.schema[table_id].columns:
+        col = table.get_column(col_id)
+        if col.is_formula() and not col.is_private() and col.node in self.recompute_map:
+          del self.recompute_map[col.node]
+          self._trusted_nodes.add(col.node)
+    return True
+
+  def _untrust_formula_values_for_action(self, action_name, table_id):
+    # Invalidates in full the trusted formula columns (see trust_formula_values) that the given
+    # doc action may affect: for a record action, those in table_id and in tables that may depend
+    # on it; for any other action, all of them.
+    if action_name in _RECORD_ACTIONS:
+      table_sources = self._get_table_sources()
+      nodes = [node for node in self._trusted_nodes
+               if node.table_id == table_id or table_id in table_sources.get(node.table_id, ())]
+    else:
+      nodes = list(self._trusted_nodes)
+    for node in nodes:
+      self._trusted_nodes.discard(node)
+      self.invalidate_column(self.tables[node.table_id].get_column(node.col_id))
+
+  def _load_lazy_table(self, table_id):
+    # Loads the data of the given table, if it was registered with register_lazy_table() and isn't
+    # loaded yet. Like load_table() on open, this invalidates its formula columns.
+    lazy_table = self._lazy_tables.pop(table_id, None)
+    if lazy_table is None:
+      return
+    log.info("Loading lazy table %s", table_id)
+    self.load_table(lazy_table.load_func())
+
+  def _load_lazy_tables(self, table_ids):
+    for table_id in table_ids:
+      self._load_lazy_table(table_id)
+
+  def _load_lazy_tables_for_action(self, action_name, table_id):
+    # Loads any lazy tables that the given user action or doc action may read or affect. For
+    # record actions on a user table, these are the table itself, and any tables whose formulas
+    # may depend on it. For record actions on a metadata table, it's all of them if the action
+    # has special handling for that table (e.g. to convert column values), and none otherwise.
+    # For any other actions (e.g. schema changes), it's all of them.
+    if action_name in _NO_LAZY_LOAD_ACTIONS:
+      return
+    if action_name in _RECORD_ACTIONS and table_id is not None:
+      if useractions.is_user_table(table_id):
+        table_sources = self._get_table_sources()
+        self._load_lazy_tables([t for t in list(self._lazy_tables)
+                                if t == table_id or table_id in table_sources.get(t, ())])
+        return
+      if not useractions.has_action_override(_RECORD_ACTIONS[action_name], table_id):
+        return
+    self._load_lazy_tables(list(self._lazy_tables))
+
+  def _get_table_sources(self):
+    # Returns a dict mapping each table_id to the set of other tables whose data its formulas may
+    # read, directly or indirectly. This is a conservative estimate based on the schema: formulas
+    # may read the tables they mention by name and the targets of references they may follow;
+    # summary tables read their source tables, and the other way around.
+    if self._table_sources is None:
+      direct = {table_id: set() for table_id in self.schema}
+      for table_id, schema_table in self.schema.items():
+        for col in schema_table.columns.values():
+          if col.formula:
+            direct[table_id].update(_identifier_re.findall(col.formula))
+          ref_table_id = usertypes.get_referenced_table_id(col.type)
+          if ref_table_id:
+            direct[table_id].add(ref_table_id)
+        source_table = self.tables[table_id]._summary_source_table
+        if source_table:
+          direct[table_id].add(source_table.table_id)
+          direct[source_table.table_id].add(table_id)
+
+      self._table_sources = {}
+      for table_id in direct:
+        # Find all tables reachable from table_id.
+        sources = set()
+        stack = [table_id]
+        while stack:
+          for source in direct[stack.pop()]:
+            if source in direct and source not in sources:
+              sources.add(source)
+              stack.append(source)
+        sources.discard(table_id)
+        self._table_sources[table_id] = sources
+    return self._table_sources
+
   def add_records(self, table_id, row_ids, column_values):
     """
     Helper to add records to the given table, with row_ids and column_values having the same
@@ -370,8 +627,9 @@ class Engine(object):
     for col_id, values in column_values.items():
       column = table.get_column(col_id)
       column.growto(growto_size)
-      for row_id, value in zip(row_ids, values):
-        column.set(row_id, value)
+      if isinstance(values, columnar.PackedValues) and column.load_packed(row_ids, values):
+        continue
+      column.set_many(row_ids, values)
 
     # Invalidate new records to cause the formula columns to get recomputed.
     self.invalidate_records(table_id, row_ids)
@@ -380,10 +638,72 @@ class Engine(object):
     """
     Returns TableData object representing all data in this table.
     """
+    self._load_lazy_table(table_id)
+    table = self.tables[table_id]
+    row_ids = self._fetch_row_ids(table, query)
+    column_values = {}
+    for col_id in self._fetch_col_ids(table, formulas, private):
+      c = table.get_column(col_id)
+      column_values[col_id] = [c.raw_get(r) for r in row_ids]
+
+    return actions.TableData(table_id, row_ids, column_values)
+
+  def fetch_table_chunk(self, table_id, formulas=True, private=False, query=None, col_ids=None,
+                        start_row_id=0, limit=FETCH_CHUNK_SIZE):
+    """
+    Returns a chunk of the data in this table, as a pair (table_data, next_row_id). The TableData
+    includes at most `limit` rows matching `query` (as for fetch_table), starting with the row ID
+    `start_row_id`. To fetch the next chunk, call again with `next_row_id` as the start_row_id;
+    it is None once there are no more rows. Since row IDs are stable, rows added or removed
+    between calls don't cause other rows to be skipped or repeated. A `limit` of None includes
+    all the remaining rows; otherwise it must be at least 1, so that each chunk makes progress.
+
+    If col_ids is given, only those columns are included, in addition to the row IDs. They must be
+    among the columns that would be included otherwise, i.e. not formula columns unless
+    `formulas` is set, and not private columns unless `private` is set.
+    """
+    if limit is not None and limit < 1:
+      raise ValueError("Invalid limit for fetch_table_chunk: %r" % (limit,))
+    self._load_lazy_table(table_id)
     table = self.tables[table_id]
+    allowed_col_ids = self._fetch_col_ids(table, formulas, private)
+    if col_ids is None:
+      col_ids = allowed_col_ids
+    else:
+      allowed_col_ids = set(allowed_col_ids)
+      for col_id in col_ids:
+        if col_id not in allowed_col_ids:
+          if not table.has_column(col_id) or column.is_virtual_column(col_id):
+            raise KeyError("Table %s has no column %s" % (table_id, col_id))
+          raise KeyError("Column %s of table %s can't be fetched with formulas=%s, private=%s" %
+                         (col_id, table_id, formulas, private))
+
+    # Fetch one extra row, to know where the next chunk starts.
+    row_ids = self._fetch_row_ids(table, query, start_row_id=start_row_id,
+                                  limit=None if limit is None else limit + 1)
+    next_row_id = row_ids.pop() if limit is not None and len(row_ids) > limit else None
     column_values = {}
+    for col_id in col_ids:
+      c = table.get_column(col_id)
+      column_values[col_id] = [c.raw_get(r) for r in row_ids]
+
+    return actions.TableData(table_id, row_ids, column_values), next_row_id
 
+  def fetch_table_columnar(self, table_id, formulas=True, query=None):
+    """
+    Same as fetch_table(), but returns the data in the packed columnar encoding described in
+    columnar.py.
+    """
+    self._load_lazy_table(table_id)
+    table = self.tables[table_id]
+    row_ids = self._fetch_row_ids(table, query)
+    return columnar.encode_table(table, row_ids, self._fetch_col_ids(table, formulas, False))
+
+  def _fetch_row_ids(self, table, query, start_row_id=0, limit=None):
+    # Returns the sorted list of row_ids of the table matching the query (if any) for fetch_table,
+    # starting with start_row_id, and limited to `limit` rows if given.
     query_cols = []
+    candidates = None
     if query:
       for col_id, values in query.items():
         col = table.get_column(col_id)
@@ -393,9 +713,25 @@ class Engine(object):
         except TypeError:
           # Values contains an unhashable value, leave it as a list.
           pass
+        else:
+          # If the column is indexed, only the rows in the index for the given values need checking.
+          indexed_rows = self._get_indexed_rows(table, col, values)
+          if indexed_rows is not None:
+            if candidates is None or len(indexed_rows) < len(candidates):
+              candidates = indexed_rows
         query_cols.append((col, values))
+
+    if candidates is None:
+      id_column = table.get_column('id')
+      candidates = (r for r in range(max(start_row_id, 1), id_column.size())
+                    if id_column.raw_get(r) > 0)
+    else:
+      candidates = sorted(r for r in candidates if r >= start_row_id)
+
     row_ids = []
-    for r in table.row_ids:
+    for r in candidates:
+      if limit is not None and len(row_ids) >= limit:
+        break
       for (c, values) in query_cols:
         try:
           if c.raw_get(r) not in values:
@@ -406,15 +742,35 @@ class Engine(object):
       else:
         # No break, i.e. all columns matched
         row_ids.append(r)
+    return row_ids
 
-    for c in table.all_columns.values():
-      # pylint: disable=too-many-boolean-expressions
-      if ((formulas or not c.is_formula())
-          and (private or not c.is_private())
-          and c.col_id != "id" and not column.is_virtual_column(c.col_id)):
-        column_values[c.col_id] = [c.raw_get(r) for r in row_ids]
+  def _get_indexed_rows(self, table, col, values):
+    # If there is an up-to-date lookup index on the given column (i.e. the LookupMapColumn
+    # created by lookups on just this column), returns the set of row_ids in it whose value is
+    # among the given set of values. Otherwise returns None.
+    #
+    # The index maps the values seen by formulas rather than raw values, so it's only used for
+    # column types where these are the same for values of the right type (for references, both
+    # are row IDs), and when all the values looked up are of the right type.
+    if col.type_obj.typename() not in _INDEXED_QUERY_TYPES:
+      return None
+    lookup_map = table._special_cols.get("#lookup#" + col.col_id)
+    if lookup_map is None or self.recompute_map.get(lookup_map.node):
+      return None
+    if not all(col.type_obj.is_right_type(v) for v in values):
+      return None
+    result = set()
+    for value in values:
+      result.update(lookup_map._do_fast_lookup((value,)))
+    return result
 
-    return actions.TableData(table_id, row_ids, column_values)
+  def _fetch_col_ids(self, table, formulas, private):
+    # Returns the list of col_ids of the table to include in the result of fetch_table.
+    # pylint: disable=no-self-use
+    return [c.col_id for c in table.all_columns.values()
+            if ((formulas or not c.is_formula())
+                and (private or not c.is_private())
+                and c.col_id != "id" and not column.is_virtual_column(c.col_id))]
 
   def fetch_table_schema(self):
     return self.gencode.get_user_text()
@@ -456,6 +812,7 @@ class Engine(object):
       if (not (gencode._is_special_table(c.tableId) or c.parentId.summarySourceTable) and
           column.is_visible_column(c.colId) and
           not c.type.startswith('Ref')):
+        self._load_lazy_table(c.tableId)
         table = self.tables[c.tableId]
         col = table.get_column(c.colId)
         matches = m.count_unique(col.raw_get(r) for r in itertools.islice(table.row_ids, 1000))
@@ -521,6 +878,9 @@ class Engine(object):
     # This is used whenever a formula accesses any part of any record. It's hot code, and
     # it's worth optimizing.
 
+    if self._lazy_tables and node[0] in self._lazy_tables:
+      self._load_lazy_table(node[0])
+
     if self._peeking:
       return
 
@@ -528,10 +888,8 @@ class Engine(object):
       # Add an edge to indicate that the node being computed depends on the node passed in.
       # Note that during evaluation, we only *add* dependencies. We *remove* them by clearing them
       # whenever ALL rows for a node are invalidated (on schema changes and reloads).
-      edge = (self._current_node, node, relation)
-      if edge not in self._recompute_edge_set:
-        self.dep_graph.add_edge(*edge)
-        self._recompute_edge_set.add(edge)
+      if self.dep_graph.add_edge(self._current_node, node, relation):
+        self._profiler.add_edge()
 
     # This check is not essential here, but is an optimization that saves cycles.
     if self.recompute_map.get(node) is None:
@@ -548,7 +906,6 @@ class Engine(object):
     self._recompute_done_map = {}
     self._locked_cells = set()
     self._is_node_exception_reported = set()
-    self._recompute_edge_set = set()
     self._cell_required_error = None
 
   def _post_update(self):
@@ -606,6 +963,7 @@ class Engine(object):
           # Need to schedule re-ordered evaluation
           assert node == e.requiring_node
           assert (not row_ids) or (e.requiring_row_id in row_ids)
+          self._profiler.order_error(node)
           # Put current work item back on stack, and don't dispose its locks
           work_items.append(WorkItem(node, row_ids, locks))
           locks = []
@@ -647,6 +1005,9 @@ class Engine(object):
     # deterministic (which is helpful for tests in particular).
     self._pre_update()
     try:
+      if self._recalc_workers > 1 and parallel_recalc.is_supported():
+        parallel_recalc.recompute_in_workers(self, self._recalc_workers)
+
       # Figure out remaining work to do, maintaining classic Grist ordering.
       work_items = self._make_sorted_work_items(self.recompute_map.keys())
       self._update_loop(work_items)
@@ -726,6 +1087,7 @@ class Engine(object):
     return result
 
   def get_formula_value(self, table_id, col_id, row_id, record_attributes=None):
+    self._load_lazy_table(table_id)
     table = self.tables[table_id]
     col = table.get_column(col_id)
     checkpoint = self._get_undo_checkpoint()
@@ -793,7 +1155,8 @@ class Engine(object):
 
     exclude = self._recompute_done_map[node]
     if dirty_rows == depend.ALL_ROWS:
-      dirty_rows = SortedSet(r for r in table.row_ids if r not in exclude)
+      dirty_rows = RowSet(table.row_ids)
+      dirty_rows.difference_update(exclude)
       self.recompute_map[node] = dirty_rows
 
     exempt = self._prevent_recompute_map.get(node, None)
@@ -819,8 +1182,19 @@ class Engine(object):
     cleaned = []    # this lists row_ids that can be removed from dirty_rows once we are no
                     # longer iterating on it.
     try:
+      eval_rows = dirty_rows
+      method = None
+      if allow_evaluation:
+        batch = self._get_batch_formula(table, col)
+        if batch:
+          changes = self._recompute_batch(table, col, batch, dirty_rows, exclude, cleaned)
+          # Only the rows that the batch evaluation didn't handle are left for the loop below.
+          eval_rows = [r for r in dirty_rows if r not in exclude]
+        else:
+          method = self._get_summary_aggregate(table, col)
+
       require_count = len(require_rows)
-      for i, row_id in enumerate(itertools.chain(require_rows, dirty_rows)):
+      for i, row_id in enumerate(itertools.chain(require_rows, eval_rows)):
         required = i < require_count or require_count == 0
         if require_count and row_id not in dirty_rows:
           # Nothing need be done for required rows that are already up to date.
@@ -849,7 +1223,8 @@ class Engine(object):
           # We figure out if we've hit a cycle here.  If so, we just let _recompute_on_cell
           # know, so it can set the cell value appropriately and do some other bookkeeping.
           cycle = required and (node, row_id) in self._locked_cells
-          value = self._recompute_one_cell(table, col, row_id, cycle=cycle, node=node)
+          value = self._recompute_one_cell(table, col, row_id, cycle=cycle, node=node,
+                                           method=method)
         except RequestingError:
           # The formula will be evaluated again soon when we have a response.
           save_value = False
@@ -906,6 +1281,123 @@ class Engine(object):
       if not self.recompute_map[node]:
         self.recompute_map.pop(node)
 
+  def _get_batch_formula(self, table, col):
+    """
+    Returns the (col_ids, func) pair from codebuilder.make_batch_formula() if the given column's
+    formula may be evaluated using _recompute_batch(), or None otherwise.
+    """
+    if not col.is_formula() or column.is_validation_column_name(col.col_id):
+      return None
+    schema_col = self.schema[table.table_id].columns.get(col.col_id)
+    if not schema_col:
+      return None
+    formula = schema_col.formula
+    if formula not in self._batch_formulas:
+      self._batch_formulas[formula] = codebuilder.make_batch_formula(formula)
+    batch = self._batch_formulas[formula]
+    if not batch:
+      return None
+
+    # All the input columns must exist and be up to date. The values of reference columns are
+    # Records, whose relations need the regular evaluation to be set up correctly.
+    for col_id in batch[0]:
+      in_col = table.all_columns.get(col_id)
+      if (in_col is None or isinstance(in_col, column.BaseReferenceColumn) or
+          in_col.node in self.recompute_map):
+        return None
+    return batch
+
+  def _get_summary_aggregate(self, table, col):
+    """
+    If the given column is a formula in a summary table like `SUM($group.Amount)` or `len($group)`
+    (see codebuilder.parse_summary_aggregate), returns a method to use instead of col.method,
+    which gets the result from an AggregateMapColumn in the source table, rather than by iterating
+    through the group. It falls back to col.method when the AggregateMapColumn can't produce the
+    result. For all other columns, returns None.
+    """
+    if not (col.is_formula() and table._summary_source_table and table._summary_simple):
+      return None
+    schema_cols = self.schema[table.table_id].columns
+    schema_col = schema_cols.get(col.col_id)
+    group_col = schema_cols.get('group')
+    if not (schema_col and group_col and group_col.formula == 'table.getSummarySourceGroup(rec)'):
+      return None
+    formula = schema_col.formula
+    if formula not in self._summary_aggregates:
+      self._summary_aggregates[formula] = codebuilder.parse_summary_aggregate(formula)
+    aggregate = self._summary_aggregates[formula]
+    if not aggregate:
+      return None
+
+    func_name, value_col_id = aggregate
+    source_table = table._summary_source_table
+    if value_col_id is not None and not source_table.has_column(value_col_id):
+      return None
+    group_col_id = table._summary_helper_col_id
+
+    def aggregate_method(rec, user_table):
+      # Like lookup maps, the AggregateMapColumn gets created when first used by a formula cell.
+      aggregate_map = source_table._get_aggregate_map(group_col_id, value_col_id)
+      result = aggregate_map.do_aggregate(rec, func_name)
+      if result is lookup.NO_AGGREGATE:
+        return col.method(rec, user_table)
+      return result
+    return aggregate_method
+
+  def _recompute_batch(self, table, col, batch, dirty_rows, exclude, cleaned):
+    """
+    Recomputes the dirty rows of a formula column whose formula only uses `$col` attributes of the
+    same record (see codebuilder.make_batch_formula). Such formulas are evaluated in one loop over
+    the values of their input columns, without the per-cell overhead of _recompute_one_cell(). Any
+    cell whose evaluation raises an exception is left for the per-cell evaluation, which produces
+    the error value. Processed rows are added to `exclude` and `cleaned`; returns the list of
+    changes (as in _changes_map), or None if there were none.
+    """
+    # Timing and profiling stats are collected per cell, so leave it to the per-cell evaluation
+    # when either is enabled.
+    if not (isinstance(self._timing, DummyTiming) and
+            isinstance(self._profiler, DummyProfiler)):
+      return None
+
+    node = col.node
+    col_ids, func = batch
+    in_cols = [table.get_column(col_id) for col_id in col_ids]
+    for in_col in in_cols:
+      # Creates the dependencies, the same as the first access to `$col` in a formula would.
+      self._use_node(in_col.node, table._identity_relation)
+
+    getters = [in_col.get_cell_value for in_col in in_cols]
+    row_ids = table.row_ids
+    tracer = self.formula_tracer
+    if tracer is _no_formula_tracer:
+      tracer = None
+    locked_cells = self._locked_cells
+    changes = None
+    for row_id in dirty_rows:
+      if row_id not in row_ids or row_id in exclude:
+        continue
+      try:
+        value = func(*[get(row_id) for get in getters])
+      except Exception:   # pylint: disable=broad-except
+        continue
+      if tracer:
+        tracer(col, table.Record(row_id, table._identity_relation))
+
+      value = col.convert(value)
+      previous = col.raw_get(row_id)
+      if not strict_equal(value, previous):
+        if not changes:
+          changes = self._changes_map.setdefault(node, [])
+        changes.append((row_id, previous, value))
+        col.set(row_id, value)
+
+      if locked_cells:
+        locked_cells.discard((node, row_id))
+      exclude.add(row_id)
+      cleaned.append(row_id)
+      self._recompute_done_counter += 1
+    return changes
+
   def _requesting(self, key, args):
     """
     Called by the REQUEST function. If we don't have a response already and we can't
@@ -943,13 +1435,15 @@ class Engine(object):
 
     raise RequestingError()
 
-  def _recompute_one_cell(self, table, col, row_id, cycle=False, node=None, record_attributes=None):
+  def _recompute_one_cell(self, table, col, row_id, cycle=False, node=None, record_attributes=None,
+                          method=None):
     """
     Recomputes an one formula cell and returns a value.
     The value can be:
       - the recomputed value in case there are no errors
       - exception
       - exception with details if flag include_details is set
+    If method is given, it's called instead of col.method to compute a formula cell.
     """
     self._current_row_id = row_id
 
@@ -968,7 +1462,7 @@ class Engine(object):
       assert not cycle
       record = AttributeRecorder(record, "rec", record_attributes)
     value = None
-    with self._timing.measure(col.node):
+    with self._timing.measure(col.node), self._profiler.measure(col.node):
       try:
         if cycle:
           raise depend.CircularRefError("Circular Reference")
@@ -978,7 +1472,7 @@ class Engine(object):
             result = col.method(record, table.user_table, value, self._user)
         else:
           with FakeStdStreams():
-            result = col.method(record, table.user_table)
+            result = (method or col.method)(record, table.user_table)
         if self._cell_required_error:
           raise self._cell_required_error  # pylint: disable=raising-bad-type
         self.formula_tracer(col, record)
@@ -1132,6 +1626,7 @@ class Engine(object):
       return
 
     self.gencode.make_module(self.schema)
+    self._table_sources = None
 
     # Re-populate self.tables, reusing existing tables whenever possible.
     old_tables = self.tables
@@ -1161,6 +1656,23 @@ class Engine(object):
       if table_id not in self.tables:
         self._update_table_model(table, None)
 
+    # In incremental mode, dependents of a column keep their dependencies when it's invalidated
+    # in full. That's valid only while their formulas are unchanged, so make sure that any formula
+    # not found in the formula cache starts from scratch. (Normally that's already the case, since
+    # a changed formula means a newly created column.)
+    if self.dep_graph.incremental:
+      for (table_id, col_id) in self.gencode.get_changed_formulas():
+        table = self.tables.get(table_id)
+        if table and table.has_column(col_id) and table.get_column(col_id).is_formula():
+          self.invalidate_column(table.get_column(col_id))
+
+    # Drop cached batch formulas for formulas that no longer exist, so the cache doesn't keep
+    # growing as formulas get modified or removed.
+    formulas = {schema_col.formula for schema_table in self.schema.values()
+                for schema_col in schema_table.columns.values()}
+    for formula in [f for f in self._batch_formulas if f not in formulas]:
+      del self._batch_formulas[formula]
+
     # Update docmodel with references to the updated metadata tables.
     self.docmodel.update_tables()
 
@@ -1171,6 +1683,14 @@ class Engine(object):
     # See the comment on _autocomplete_context in __init__.
     self._autocomplete_context = None
 
+  def set_incremental_invalidation(self, enabled):
+    """
+    Enables or disables the incremental mode of invalidation in the dependency graph, in which a
+    schema change (e.g. to a formula) doesn't cause a full recomputation of all dependent columns.
+    See depend.Graph.invalidate_deps() for details.
+    """
+    self.dep_graph.incremental = bool(enabled)
+
   def trigger_columns_changed(self):
     self._have_trigger_columns_changed = True
 
@@ -1232,10 +1752,7 @@ class Engine(object):
         if col_rec.recalcWhen == RecalcWhen.DEFAULT:
           for dc in col_rec.recalcDeps:
             in_node = depend.Node(table_id, dc.colId)
-            edge = depend.Edge(out_node, in_node, rel)
-            if edge not in self._recompute_edge_set:
-              self._recompute_edge_set.add(edge)
-              self.dep_graph.add_edge(*edge)
+            self.dep_graph.add_edge(out_node, in_node, rel)
 
 
   def delete_column(self, col_obj):
@@ -1289,7 +1806,9 @@ class Engine(object):
     result = {"total": 0}
     for table_rec in self.docmodel.tables.all:
       if useractions.is_user_table(table_rec.tableId):
-        count = self.tables[table_rec.tableId]._num_rows()
+        lazy_table = self._lazy_tables.get(table_rec.tableId)
+        count = (lazy_table.row_count if lazy_table else
+                 self.tables[table_rec.tableId]._num_rows())
         result[table_rec.id] = count
         result["total"] += count
     return result
@@ -1304,12 +1823,18 @@ class Engine(object):
     # everything, and only filter what we send.
 
     self.out_actions = action_obj.ActionGroup()
+    if user and self._lazy_tables:
+      # User attributes are records in user tables, which need to be loaded to look them up.
+      self._load_lazy_tables([value[0] for value in user.values()
+                              if isinstance(value, (list, tuple)) and len(value) == 2
+                              and value[0] in self._lazy_tables])
     self._user = User(user, self.tables) if user else None
 
     # These should usually be empty, but may be populated by the RespondToRequests action.
     self._request_responses = {}
     self._cached_request_keys = set()
 
+    self._profiler.start_actions(user_actions)
     checkpoint = self._get_undo_checkpoint()
     try:
       for user_action in user_actions:
@@ -1326,6 +1851,7 @@ class Engine(object):
           self.assert_schema_consistent()
 
     except Exception as e:
+      self._profiler.end_actions()
       # Save full exception info, so that we can rethrow accurately even if undo also fails.
       exc_info = sys.exc_info()
       # If we get an exception, we should revert all changes applied so far, to keep things
@@ -1352,6 +1878,7 @@ class Engine(object):
     # Apply any triggered record removals. If anything does get removed, recalculate what's needed.
     while self.docmodel.apply_auto_removes():
       self._bring_all_up_to_date()
+    self._profiler.end_actions()
 
     self.out_actions.flush_calc_changes()
     self.out_actions.check_sanity()
@@ -1374,6 +1901,9 @@ class Engine(object):
     A UserAction is a tuple whose first element is the name of the action.
     """
     log.debug("applying user_action %s", user_action)
+    if self._lazy_tables:
+      self._load_lazy_tables_for_action(user_action.__class__.__name__,
+                                        getattr(user_action, 'table_id', None))
     return getattr(self.user_actions, user_action.__class__.__name__)(*user_action)
 
   def apply_doc_action(self, doc_action):
@@ -1384,6 +1914,11 @@ class Engine(object):
     self._gone_columns = []
 
     action_name = doc_action.__class__.__name__
+    if self._lazy_tables:
+      self._load_lazy_tables_for_action(action_name, getattr(doc_action, 'table_id', None))
+    if self._trusted_nodes:
+      self._untrust_formula_values_for_action(action_name, getattr(doc_action, 'table_id', None))
+
     saved_schema = None
     if action_name in actions.schema_actions:
       self._schema_updated = True
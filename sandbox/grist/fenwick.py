@@ -0,0 +1,67 @@
+"""
+A Fenwick tree (also known as a binary indexed tree) over a list of numbers, to compute sums of
+prefixes of the list in O(log N) time, and to support changing values in O(log^2 N) time.
+
+Each node is always computed from its children in the same way as when the whole tree is built,
+so results depend only on the current values, and not on the history of changes. (Adjusting nodes
+by the difference between old and new values would be faster, but with floats, rounding errors
+would accumulate.)
+"""
+
+
+class FenwickTree(object):
+  def __init__(self, values=()):
+    self._values = list(values)
+    # Node i (1-based) holds the sum of values in positions (i - lowbit(i), i], where lowbit(i) is
+    # the lowest set bit of i. It's built by adding each node to its parent, in order.
+    self._tree = [0] + self._values
+    size = len(self._values)
+    for i in range(1, size + 1):
+      parent = i + (i & -i)
+      if parent <= size:
+        self._tree[parent] += self._tree[i]
+
+  def __len__(self):
+    return len(self._values)
+
+  def _compute_node(self, i):
+    # The children of node i are i - 1, i - 2, i - 4, etc, down to i - lowbit(i) / 2, which get
+    # added to it in increasing order, the same order as in __init__().
+    total = self._values[i - 1]
+    step = (i & -i) >> 1
+    while step:
+      total += self._tree[i - step]
+      step >>= 1
+    return total
+
+  def set(self, index, value):
+    """
+    Sets the value at the given 0-based index.
+    """
+    self._values[index] = value
+    i = index + 1
+    size = len(self._values)
+    while i <= size:
+      self._tree[i] = self._compute_node(i)
+      i += i & -i
+
+  def append(self, value):
+    self._values.append(value)
+    self._tree.append(0)
+    self._tree[-1] = self._compute_node(len(self._values))
+
+  def pop(self):
+    # No other node includes the last one, so it's enough to drop it.
+    self._tree.pop()
+    return self._values.pop()
+
+  def prefix_sum(self, count):
+    """
+    Returns the sum of the first `count` values.
+    """
+    total = 0
+    i = count
+    while i > 0:
+      total += self._tree[i]
+      i -= i & -i
+    return total
@@ -0,0 +1,75 @@
+"""
+Runs functions in forked copies of this process, for work that can be split into independent
+parts (see parallel_recalc.py, and imports/import_xls.py). Each worker sees a copy-on-write
+snapshot of the parent's memory, so arguments don't need to be serialized; results are pickled
+and sent back through a pipe.
+
+Forking isn't available on all platforms (e.g. in Pyodide); callers should check is_supported(),
+and do the work in the parent when it returns False. Forking may also fail (e.g. when the process
+limit is reached), in which case the worker's result is None, as if it had failed, and callers
+fall back to doing its work in the parent.
+"""
+import logging
+import os
+import pickle
+
+log = logging.getLogger(__name__)
+
+
+def is_supported():
+  return hasattr(os, 'fork')
+
+
+def start(func, *args):
+  """
+  Calls func(*args) in a forked worker process, and returns a handle to pass to get_result().
+  If the worker can't be started, the handle is None.
+  """
+  try:
+    read_fd, write_fd = os.pipe()
+  except OSError:
+    log.warning("forkworker: can't start %s", func.__name__, exc_info=True)
+    return None
+  try:
+    pid = os.fork()
+  except OSError:
+    log.warning("forkworker: can't start %s", func.__name__, exc_info=True)
+    os.close(read_fd)
+    os.close(write_fd)
+    return None
+  if pid != 0:
+    os.close(write_fd)
+    return pid, read_fd
+
+  # In the worker. Whatever happens, it must exit here, and not return to the caller.
+  try:
+    os.close(read_fd)
+    try:
+      data = pickle.dumps(func(*args), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+      log.warning("forkworker: %s failed", func.__name__, exc_info=True)
+      data = pickle.dumps(None)
+    with os.fdopen(write_fd, 'wb') as f:
+      f.write(data)
+  finally:
+    os._exit(0)   # pylint:disable=protected-access
+
+
+def get_result(handle):
+  """
+  Waits for the worker started by start(), and returns what its function returned, or None if
+  the worker couldn't be started, the function raised an exception, or the result couldn't be
+  read.
+  """
+  if handle is None:
+    return None
+  pid, read_fd = handle
+  try:
+    with os.fdopen(read_fd, 'rb') as f:
+      data = f.read()
+    return pickle.loads(data)
+  except Exception:
+    log.warning("forkworker: can't read worker result", exc_info=True)
+    return None
+  finally:
+    os.waitpid(pid, 0)
@@ -209,3 +209,80 @@ def CONTAINS(value, match_empty=_Contains.no_match_empty):
   return _Contains(value, match_empty)
 
 CONTAINS.__doc__ = _Contains.__doc__
+
+
+class _Unbounded(object):
+  """
+  Singleton sentinel value for a bound of a range used in lookups, to indicate there is no limit
+  on that side of the range.
+  """
+  def __repr__(self):
+    return "unbounded"
+
+
+class _Range(namedtuple("_Range", "lo hi include_lo include_hi")):
+  """
+  Marker for a range of values in lookups, created by BETWEEN, LT, LE, GT and GE. Each of `lo`
+  and `hi` may be `_Range.unbounded`.
+  """
+  unbounded = _Unbounded()
+
+
+def BETWEEN(lo, hi):
+  """
+  Use this marker with [UserTable.lookupRecords](#lookuprecords) to find records where a field is
+  between `lo` and `hi`, inclusive. The related functions `LT`, `LE`, `GT` and `GE` find records
+  where a field is, respectively, less than, less than or equal to, greater than, or greater than
+  or equal to a value.
+
+  For example:
+
+      Events.lookupRecords(Date=BETWEEN($Start, $End))
+      Transactions.lookupRecords(Account=$Account, Date=LE($Date))
+
+  The second example returns records in `Transactions` with the same `Account` as the current
+  record, and a `Date` on or before the current record's `Date`. It is much faster than filtering
+  in Python, as in `[r for r in Transactions.lookupRecords(Account=$Account) if r.Date <= $Date]`,
+  particularly since a change to `Transactions` only causes recalculation of records whose ranges
+  include the changed values.
+
+  Records where the field is empty never match a range. At most one field in a lookup may use a
+  range. Unless `order_by` is given, results are sorted by the field.
+  """
+  return _Range(lo, hi, True, True)
+
+def LT(value):
+  """
+  Use with [UserTable.lookupRecords](#lookuprecords) to find records where a field is less than
+  `value`. For example,
+  `Transactions.lookupRecords(Account=$Account, Date=LT($Date))`.
+  See [BETWEEN](#between).
+  """
+  return _Range(_Range.unbounded, value, False, False)
+
+def LE(value):
+  """
+  Use with [UserTable.lookupRecords](#lookuprecords) to find records where a field is less than or
+  equal to `value`. For example,
+  `Transactions.lookupRecords(Account=$Account, Date=LE($Date))`.
+  See [BETWEEN](#between).
+  """
+  return _Range(_Range.unbounded, value, False, True)
+
+def GT(value):
+  """
+  Use with [UserTable.lookupRecords](#lookuprecords) to find records where a field is greater than
+  `value`. For example,
+  `Transactions.lookupRecords(Account=$Account, Date=GT($Date))`.
+  See [BETWEEN](#between).
+  """
+  return _Range(value, _Range.unbounded, False, False)
+
+def GE(value):
+  """
+  Use with [UserTable.lookupRecords](#lookuprecords) to find records where a field is greater than
+  or equal to `value`. For example,
+  `Transactions.lookupRecords(Account=$Account, Date=GE($Date))`.
+  See [BETWEEN](#between).
+  """
+  return _Range(value, _Range.unbounded, True, False)
@@ -63,6 +63,28 @@ def RANK(rec, *, group_by=(), order_by, order="asc"):
   """
   return _sorted_lookup(rec, group_by=group_by, order_by=order_by)._find.rank(rec, order=order)
 
+def CUMSUM(rec, col_id, *, group_by=(), order_by):
+  """
+  Returns the running total of the column `col_id` up to and including this record, in the order
+  specified by `order_by`, and within the group specified by `group_by`. See
+  [`PREVIOUS`](#previous) for details of these parameters. As with `SUM`, non-numeric values are
+  ignored, and `True` counts as 1.
+
+  For example, this returns the balance of the current record's Account after this record, when
+  records are sorted by increasing Date:
+  ```python
+  CUMSUM(rec, "Amount", group_by="Account", order_by="Date")
+  ```
+
+  It's equivalent to `$Amount + (PREVIOUS(rec, ...).Balance or 0)` in a column named Balance, but
+  doesn't need to recalculate a chain of records one at a time, so is much faster to update when
+  records get added, removed, or reordered. If any record in the group has an error in `col_id`
+  or an `order_by` column, `CUMSUM` raises that error for all records of the group.
+  """
+  if isinstance(group_by, str):
+    group_by = (group_by,)
+  return rec._table.cumulative_sum(rec, col_id, group_by, order_by)
+
 
 def _sorted_lookup(rec, *, group_by, order_by):
   if isinstance(group_by, str):
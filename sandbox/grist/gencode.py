@@ -65,6 +65,7 @@ class GenCode:
   def __init__(self):
     self._formula_cache = {}
     self._new_formula_cache = {}
+    self._changed_formulas = set()
     self._full_builder = None
     self._user_builder = None
     self._usercode = None
@@ -184,16 +185,30 @@ class GenCode:
           filter_for_user=True))
 
     # Once all formulas are generated, replace the formula cache with the newly-populated version.
+    self._changed_formulas = {(table_id, col_id)
+                              for (table_id, col_id, formula) in self._new_formula_cache
+                              if (table_id, col_id, formula) not in self._formula_cache}
     self._formula_cache = self._new_formula_cache
     self._new_formula_cache = {}
     self._full_builder = textbuilder.Combiner(fullparts)
     self._user_builder = textbuilder.Combiner(userparts)
     self._usercode = exec_module_text(self._full_builder.get_text())
 
+  def get_changed_formulas(self):
+    """
+    Returns the set of (table_id, col_id) pairs whose formula text was not in the formula cache
+    on the last run of make_module(), i.e. formulas that are new or changed.
+    """
+    return self._changed_formulas
+
   def get_user_text(self):
     """Returns the text of the user-facing part of the generated code."""
     return self._user_builder.get_text()
 
+  def get_full_text(self):
+    """Returns the full text of the generated code, including formulas of metadata tables."""
+    return self._full_builder.get_text()
+
   @property
   def usercode(self):
     """Returns the generated usercode module."""
@@ -0,0 +1,150 @@
+"""
+Benchmarks of parsing imported files, using the files in imports/fixtures, to catch performance
+regressions in the import parsers and in parse_data. Results are printed as JSON in the same
+format as benchmark.py, and get saved and compared the same way:
+
+  python -m imports.benchmark --output before.json
+  ... (switch to another commit)
+  python -m imports.benchmark --compare before.json
+
+For each fixture, "parse" times parsing the whole file, as for an import. Since fixtures are
+small, "get_table_data" times the type detection and conversion of the file's rows repeated to
+`rows` rows (of the first sheet, for Excel files), which is where most time goes for large files.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+import openpyxl
+
+import benchmark
+import parse_data
+from imports import import_csv, import_xls
+
+log = logging.getLogger(__name__)
+
+# Bumped when the timed operations change, since results are only comparable for the same version.
+BENCHMARK_VERSION = 1
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Number of rows for the get_table_data operation, before scaling.
+DEFAULT_ROWS = 50000
+
+_parsers = {
+  ".csv": lambda path: import_csv.parse_file(path),
+  ".xlsx": lambda path: import_xls.parse_file(path, num_workers=0),
+}
+
+
+def list_fixtures():
+  """ Returns the names of fixture files that can be benchmarked, sorted. """
+  return sorted(name for name in os.listdir(FIXTURES_DIR)
+                if os.path.splitext(name)[1] in _parsers)
+
+
+def read_rows(path):
+  """ Returns the rows of the file at path (of its first sheet, for Excel), as lists of values. """
+  if path.endswith(".csv"):
+    with open(path, newline="") as f:
+      return [row for row in csv.reader(f)]
+  workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+  sheet = workbook.worksheets[0]
+  sheet.reset_dimensions()
+  return [list(row) for row in sheet.iter_rows(values_only=True)]
+
+
+def run_fixture(name, rows):
+  """
+  Runs the timed operations once for the named fixture. Returns a dict mapping operation names
+  to durations in seconds.
+  """
+  path = os.path.join(FIXTURES_DIR, name)
+  timings = OrderedDict()
+
+  start = time.perf_counter()
+  _parsers[os.path.splitext(name)[1]](path)
+  timings["parse"] = time.perf_counter() - start
+
+  file_rows = read_rows(path)
+  num_columns = max((len(row) for row in file_rows), default=0)
+  # Make fresh lists, since get_table_data pads rows in place.
+  many_rows = [list(row) for row in itertools.islice(itertools.cycle(file_rows), rows)]
+  start = time.perf_counter()
+  parse_data.get_table_data(many_rows, num_columns)
+  timings["get_table_data"] = time.perf_counter() - start
+  return timings
+
+
+def run_benchmarks(fixtures, repeat=3, scale=1.0):
+  """
+  Runs the given fixtures (a list of file names), each `repeat` times. Returns the results as a
+  JSON-serializable dict in the format of benchmark.run_benchmarks(), with a "scenario" per
+  fixture.
+  """
+  rows = max(int(DEFAULT_ROWS * scale), 1)
+  results = OrderedDict()
+  for name in fixtures:
+    best = OrderedDict()
+    for _ in range(repeat):
+      for op, duration in run_fixture(name, rows).items():
+        best[op] = min(duration, best.get(op, duration))
+    log.info("Fixture %s: %s", name, ", ".join("%s %.3fs" % item for item in best.items()))
+    results[name] = OrderedDict([("spec", {"rows": rows}), ("timings", best)])
+
+  return OrderedDict([
+    ("version", BENCHMARK_VERSION),
+    ("python", platform.python_version()),
+    ("repeat", repeat),
+    ("scenarios", results),
+  ])
+
+
+def main():
+  fixtures = list_fixtures()
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("fixtures", nargs="*",
+                      help="Fixtures to run, among: %s (default: all)" % ", ".join(fixtures))
+  parser.add_argument("--repeat", type=int, default=3, help="Runs of each fixture")
+  parser.add_argument("--scale", type=float, default=1.0,
+                      help="Multiplier for the number of rows for get_table_data")
+  parser.add_argument("--output", help="File to save results to, as JSON")
+  parser.add_argument("--compare", help="File with JSON results to compare against")
+  parser.add_argument("--threshold", type=float, default=1.25,
+                      help="Slowdown ratio reported as a regression by --compare")
+  args = parser.parse_args()
+  for name in args.fixtures:
+    if name not in fixtures:
+      parser.error("Unknown fixture %r" % name)
+
+  logging.basicConfig(level=logging.INFO, format="%(message)s")
+  # The parsers log at INFO level, which would skew timings.
+  for module in (import_csv, import_xls, parse_data):
+    logging.getLogger(module.__name__).setLevel(logging.WARNING)
+
+  results = run_benchmarks(args.fixtures or fixtures, repeat=args.repeat, scale=args.scale)
+  output = json.dumps(results, indent=2)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output + "\n")
+  print(output)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    rows, regressions = benchmark.compare_results(baseline, results, args.threshold)
+    for (name, op, before, after) in rows:
+      log.info("%-40s %-15s %8.3fs -> %8.3fs  (x%.2f)", name, op, before, after, after / before)
+    if regressions:
+      log.error("%d operation(s) slower than x%.2f", len(regressions), args.threshold)
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,25 @@
+import json
+import unittest
+
+import benchmark
+from imports import benchmark as import_benchmark
+
+
+class TestImportBenchmark(unittest.TestCase):
+  def test_run_and_compare(self):
+    # Run a couple of fixtures with few rows, to check that all operations work.
+    fixtures = ["test_excel.xlsx", "test_import_csv.csv"]
+    self.assertTrue(set(fixtures) <= set(import_benchmark.list_fixtures()))
+    results = import_benchmark.run_benchmarks(fixtures, repeat=1, scale=0.01)
+    results = json.loads(json.dumps(results))
+    self.assertEqual(list(results["scenarios"]), fixtures)
+    for result in results["scenarios"].values():
+      self.assertEqual(list(result["timings"]), ["parse", "get_table_data"])
+
+    rows, regressions = benchmark.compare_results(results, results, threshold=1.5)
+    self.assertEqual(len(rows), 4)
+    self.assertEqual(regressions, [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -3,6 +3,7 @@ Plugin for importing CSV files
 """
 import codecs
 import csv
+import itertools
 import logging
 
 import chardet
@@ -19,6 +20,12 @@ csv.field_size_limit(sys.maxsize)
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Number of rows used for guessing headers.
+HEADER_SAMPLE_ROWS = 100
+
+# Encoding gets detected from (whole lines in) at most this many bytes at the start of a file.
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+
 SCHEMA = [
           {
             'name': 'lineterminator',
@@ -145,11 +152,10 @@ def _parse_open_file(file_obj, parse_options=None):
     if value is not None:
       csv_options[key] = value
 
+  # Rows are read lazily: only a sample is kept for guessing headers, and the rest get converted
+  # into columns as they are read, so the parsed rows never all sit in memory at once.
   reader = csv.reader(file_obj, **csv_options)
-
-  rows = list(reader)
-  sample_len = 100
-  sample_rows = rows[:sample_len]
+  sample_rows = list(itertools.islice(reader, HEADER_SAMPLE_ROWS))
   data_offset, headers = import_utils.headers_guess(sample_rows)
 
   # Make sure all header values are strings.
@@ -174,7 +180,7 @@ def _parse_open_file(file_obj, parse_options=None):
     data_offset -= 1
     headers = [''] * len(headers)
 
-  rows = rows[data_offset:]
+  rows = itertools.chain(sample_rows[data_offset:], reader)
   num_rows = parse_options.get('NUM_ROWS', 0)
   table_data_with_types = parse_data.get_table_data(rows, len(headers), num_rows)
 
@@ -235,12 +241,15 @@ class CodecErrorsReplace(object):
 def detect_encoding(file_path):
   # Use line-by-line detection as suggested in
   # https://chardet.readthedocs.io/en/latest/usage.html#advanced-usage.
-  # Using a fixed-sized sample is worse as the sample may end mid-character.
+  # Using a fixed-sized sample is worse as the sample may end mid-character. For large files, only
+  # the lines in the first ENCODING_SAMPLE_BYTES are used.
   detector = chardet.UniversalDetector()
-  with codecs.open(file_path, "rb") as f:
-    for line in f.readlines():
+  with open(file_path, "rb") as f:
+    size = 0
+    for line in f:
       detector.feed(line)
-      if detector.done:
+      size += len(line)
+      if detector.done or size >= ENCODING_SAMPLE_BYTES:
         break
   detector.close()
   encoding = detector.result["encoding"]
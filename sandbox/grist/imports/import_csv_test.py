@@ -440,6 +440,19 @@ class TestImportCSV(unittest.TestCase):
     self._check_col(sheet, 0, "Name", "Text", [u'John Smith', u'Μαρία Παπαδοπούλου', u'Δημήτρης Johnson'])
     self._check_col(sheet, 2, "Επάγγελμα", "Text", [u'Γιατρός', u'Engineer', u'Δικηγόρος'])
 
+  def test_large_file(self):
+    # Rows beyond the samples get converted in chunks, and reading stops after NUM_ROWS rows.
+    content = "name,num\n" + "".join("n%d,%d\n" % (i, i) for i in range(25000))
+    file_obj = StringIO(content)
+    parsed_file = import_csv._parse_open_file(file_obj, parse_options={})[1][0]
+    self._check_col(parsed_file, 0, "name", "Text", ["n%d" % i for i in range(25000)])
+    self._check_col(parsed_file, 1, "num", "Text", [str(i) for i in range(25000)])
+
+    file_obj = StringIO(content)
+    parsed_file = import_csv._parse_open_file(file_obj, parse_options={"NUM_ROWS": 5})[1][0]
+    self._check_col(parsed_file, 0, "name", "Text", ["n0", "n1", "n2", "n3", "n4"])
+    self.assertLess(file_obj.tell(), len(content) // 2)
+
   def test_csv_encoding_errors_are_handled(self):
     # With ascii, we'll get many decoding errors, but parsing should still succeed.
     parse_options = {
@@ -40,6 +40,12 @@ Data could be structured with an object at the root as well in which
 case, the object is considered to represent a single row, and gets
 turned into a table with one row.
 
+Files in the JSON Lines format, with one value per line, are supported too, and each value is
+treated like an element of a list at the root. In a file with the .jsonl extension, that includes
+lines with arrays. In other files, a list at the root must be the only value. Records get parsed
+and flattened into tables one at a time, so that a large list doesn't need to be loaded into
+memory all at once.
+
 A column's type is defined by the type of its first value that is not
 None (ie: if another value with different type is stored in the same
 column, the column's type remains unchanged), 'Text' otherwise.
@@ -73,14 +79,13 @@ TODO:
 """
 import os
 import json
+import re
 from collections import OrderedDict, namedtuple
 from itertools import count, chain
 
 from imports import import_utils
 
 Ref = namedtuple('Ref', ['table_name', 'rowid'])
-Row = namedtuple('Row', ['values', 'parent', 'ref'])
-Col = namedtuple('Col', ['type', 'values'])
 
 GRIST_TYPES={
   int: "Numeric",
@@ -114,17 +119,19 @@ def parse_file(file_source, parse_options):
   if 'SCHEMA' not in parse_options:
     parse_options.update(DEFAULT_PARSE_OPTIONS)
   with open(path, 'r') as json_file:
-    data = json.loads(json_file.read())
-
-    return dumps(data, name, parse_options)
+    return _dumps_records(_iter_records(json_file, lines=(ext.lower() == '.jsonl')), name,
+                          parse_options)
 
 def dumps(data, name = "", parse_options = DEFAULT_PARSE_OPTIONS):
   " Serializes `data` to a jgrist formatted object. "
-  tables = Tables(parse_options)
   if not isinstance(data, list):
     # put simple record into a list
     data = [data]
-  for val in data:
+  return _dumps_records(data, name, parse_options)
+
+def _dumps_records(records, name, parse_options):
+  tables = Tables(parse_options)
+  for val in records:
     tables.add_row(name, val)
   return {
     'tables': tables.dumps(),
@@ -132,10 +139,101 @@ def dumps(data, name = "", parse_options = DEFAULT_PARSE_OPTIONS):
   }
 
 
+def _iter_records(json_file, lines=False, chunk_size=1024*1024):
+  """
+  Yields the records in json_file as they are parsed, without reading the whole file into memory
+  at once. For a top-level array, records are its elements, unless `lines` is set. Otherwise,
+  records are the top-level values, which is a single object for a regular JSON file, or one per
+  line for JSON Lines.
+  """
+  stream = _JsonStream(json_file, chunk_size)
+  if stream.peek() == '[' and not lines:
+    stream.advance()
+    if stream.peek() == ']':
+      stream.advance()
+    else:
+      while True:
+        yield stream.decode()
+        char = stream.peek()
+        stream.advance()
+        if char == ']':
+          break
+        if char != ',':
+          stream.fail("Expecting ',' delimiter")
+    if stream.peek():
+      stream.fail("Extra data")
+  else:
+    yield stream.decode()
+    while stream.peek():
+      yield stream.decode()
+
+
+class _JsonStream(object):
+  """
+  Decodes JSON values one at a time from a file, keeping in memory only a chunk of the file (or
+  as much as needed to hold one value).
+  """
+  _whitespace_re = re.compile(r'[ \t\n\r]*')
+  _number_chars_re = re.compile(r'[0-9.eE+-]*')
+
+  def __init__(self, json_file, chunk_size):
+    self._file = json_file
+    self._chunk_size = chunk_size
+    self._decoder = json.JSONDecoder()
+    self._buf = ''
+    self._pos = 0
+    self._eof = False
+
+  def peek(self):
+    " Skips whitespace, and returns the next character, or '' at the end of the file. "
+    while True:
+      self._pos = self._whitespace_re.match(self._buf, self._pos).end()
+      if self._pos < len(self._buf):
+        return self._buf[self._pos]
+      if not self._read(self._chunk_size):
+        return ''
+
+  def advance(self):
+    self._pos += 1
+
+  def decode(self):
+    " Skips whitespace, and returns the next value. "
+    self.peek()
+    while True:
+      try:
+        value, end = self._decoder.raw_decode(self._buf, self._pos)
+        # A number may be cut short by the end of the buffer, even if it seems to end earlier
+        # (e.g. at "." or "e"); other values end with a closing character.
+        if type(value) in (int, float):   # pylint:disable=unidiomatic-typecheck
+          end_of_number = self._number_chars_re.match(self._buf, end).end()
+        else:
+          end_of_number = end
+        if end_of_number < len(self._buf) or self._eof:
+          self._pos = end
+          return value
+      except json.JSONDecodeError:
+        if self._eof:
+          raise
+      # Read at least as much as is buffered, so that a large value takes few retries.
+      self._read(max(self._chunk_size, len(self._buf) - self._pos))
+
+  def fail(self, message):
+    raise json.JSONDecodeError(message, self._buf, self._pos)
+
+  def _read(self, size):
+    data = self._file.read(size)
+    if not data:
+      self._eof = True
+      return False
+    self._buf = self._buf[self._pos:] + data
+    self._pos = 0
+    return True
+
+
 class Tables(object):
   """
-  Tables maintains the list of tables indexed by their name. Each table
-  is a list of row. A row is a dictionary mapping columns id to a value.
+  Tables maintains the tables indexed by their name. Each table collects the values of its
+  columns as rows get added (see _Table).
   """
 
   def __init__(self, parse_options):
@@ -146,7 +244,7 @@ class Tables(object):
 
   def dumps(self):
     " Dumps tables in jgrist format "
-    return [_dump_table(name, rows) for name, rows in self._tables.items()]
+    return [table.dump(name) for name, table in self._tables.items()]
 
   def add_row(self, table, value, parent = None):
     """
@@ -157,23 +255,29 @@ class Tables(object):
     """
     row = None
     if self._is_included(table):
-      rows = self._tables.setdefault(table, [])
-      row = Row(OrderedDict(), parent, Ref(table, len(rows)+1))
-      rows.append(row)
+      table_obj = self._tables.get(table)
+      if table_obj is None:
+        table_obj = self._tables[table] = _Table(table)
+      row = table_obj.new_row(parent)
 
     # we need a dictionary to map values to the row's columns
     value = _dictify(value)
+    row_values = []
     for (k, val) in sorted(value.items()):
       if isinstance(val, dict):
         val = self.add_row(table + '_' + k, val)
         if row and val:
-          row.values[k] = val.ref
+          row_values.append((k, val))
       elif isinstance(val, list):
         for list_val in val:
           self.add_row(table + '_' + k, list_val, row)
       else:
         if row and self._is_included(table + '_' + k):
-          row.values[k] = val
+          row_values.append((k, val))
+
+    # Nested values only get added to other tables, so this row is still the last of its table.
+    if row:
+      table_obj.set_values(row_values)
     return row
 
 
@@ -185,6 +289,65 @@ class Tables(object):
     return is_included and not is_excluded
 
 
+class _Table(object):
+  """
+  Collects the rows of a table as columns of values, with Refs stored as row ids.
+  """
+  def __init__(self, name):
+    self._name = name
+    self._num_rows = 0
+    self._columns = {}        # Maps column id to its values, with None for missing ones.
+    self._col_types = {}      # Maps column id to the grist type of its first value.
+    self._last_rows = {}      # Maps column id to the index of the last row that has it.
+    self._parent = None       # The Ref to the parent of the first row that has one.
+    self._parent_rowids = []  # The row id of each row's parent, or None.
+
+  def new_row(self, parent):
+    """
+    Adds a row, with `parent` the Ref to the row containing it in another table, if any, and
+    returns a Ref to the new row. Its values get set with set_values().
+    """
+    if parent and not self._parent:
+      self._parent = parent
+    self._parent_rowids.append(parent.rowid if parent else None)
+    self._num_rows += 1
+    return Ref(self._name, self._num_rows)
+
+  def set_values(self, row_values):
+    " Sets values of the last row, from a list of (column id, value) pairs. "
+    index = self._num_rows - 1
+    for key, val in row_values:
+      col = self._columns.get(key)
+      if col is None:
+        col = self._columns[key] = []
+        self._col_types[key] = _grist_type(val)
+      col.extend([None] * (index - len(col)))
+      col.append(_dump_value(val))
+      self._last_rows[key] = index
+
+  def dump(self, name):
+    " Converts the collected rows into a jgrist table and set 'table_name' to name. "
+    # Columns are ordered as if collected from the last row to the first, and within a row,
+    # by id (which is how a row's values are added).
+    col_ids = sorted(self._columns, key=lambda key: (-self._last_rows[key], key))
+    col_types = [self._col_types[key] for key in col_ids]
+    table_data = []
+    for key in col_ids:
+      col = self._columns[key]
+      col.extend([None] * (self._num_rows - len(col)))
+      table_data.append(col)
+    if self._parent:
+      # adds a column to store ref to parent
+      col_ids.append(first_available_key(self._columns, self._parent.table_name))
+      col_types.append(_grist_type(self._parent))
+      table_data.append(self._parent_rowids)
+    return {
+      'column_metadata': [{'id': key, 'type': t} for (key, t) in zip(col_ids, col_types)],
+      'table_data': table_data,
+      'table_name': name
+    }
+
+
 def first_available_key(dictionary, name):
   """
   Returns the first of (name, name2, name3 ...) that is not a key of
@@ -204,38 +367,6 @@ def _dictify(value):
   return value if isinstance(value, dict) else {'': value}
 
 
-def _dump_table(name, rows):
-  "Converts a list of rows into a jgrist table and set 'table_name' to name."
-  columns = _transpose([r.values for r in rows])
-  # find ref to first parent
-  ref = next((r.parent.ref for r in rows if r.parent), None)
-  if ref:
-    # adds a column to store ref to parent
-    col_id = first_available_key(columns, ref.table_name)
-    columns[col_id] = Col(_grist_type(ref),
-                          [row.parent.ref if row.parent else None for row in rows])
-  return {
-    'column_metadata': [{'id': key, 'type': col.type} for (key, col) in columns.items()],
-    'table_data': [[_dump_value(val) for val in col.values] for col in columns.values()],
-    'table_name': name
-  }
-
-def _transpose(rows):
-  """
-  Transposes a collection of dictionary mapping key to values into a
-  dictionary mapping key to values. Values are encoded into a tuple
-  made of the grist_type of the first value that is not None and the
-  collection of values.
-  """
-  transpose = OrderedDict()
-  values = OrderedDict()
-  for row in reversed(rows):
-    values.update(row)
-  for key, val in values.items():
-    transpose[key] = Col(_grist_type(val), [row.get(key, None) for row in rows])
-  return transpose
-
-
 def _dump_value(value):
   " Serialize a value."
   if isinstance(value, Ref):
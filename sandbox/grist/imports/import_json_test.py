@@ -1,3 +1,7 @@
+import io
+import json
+import os
+import tempfile
 from unittest import TestCase
 from imports import import_json
 
@@ -195,6 +199,55 @@ class TestImportJSON(TestCase):
     self.assertEqual(import_json.first_available_key({'a': 1}, 'b'), 'b')
     self.assertEqual(import_json.first_available_key({'a': 1, 'a2': 1}, 'a'), 'a3')
 
+  def test_iter_records(self):
+    # Use a tiny chunk size, so that values get split across reads (e.g. "2.5" after "2").
+    def records(text, lines=False):
+      return list(import_json._iter_records(io.StringIO(text), lines=lines, chunk_size=2))
+
+    self.assertEqual(records('[{"a": 1, "b": [2.5, "x"]}, 1e3 , null]'),
+                     [{'a': 1, 'b': [2.5, 'x']}, 1000.0, None])
+    self.assertEqual(records(' [ ] '), [])
+    self.assertEqual(records('{"a": "text"}'), [{'a': 'text'}])
+    # JSON Lines: one value per line.
+    self.assertEqual(records('{"a": 1}\n{"a": 22.5}\n\n"x"\n'), [{'a': 1}, {'a': 22.5}, 'x'])
+    # In a .jsonl file, lines with arrays are records too; otherwise an array must be alone.
+    self.assertEqual(records('[1, 2]\n[3]\n{"a": 1}\n', lines=True), [[1, 2], [3], {'a': 1}])
+    self.assertEqual(records('[1, 2]\n', lines=True), [[1, 2]])
+    with self.assertRaisesRegex(json.JSONDecodeError, "Extra data"):
+      records('[1, 2]\n[3]\n')
+
+    for text in ['', '[1, 2', '[1 2]', '[1,]', '[1] 2', '{"a": 1} x', '1.5.3']:
+      with self.assertRaises(json.JSONDecodeError, msg=text):
+        records(text)
+
+  def test_parse_json_lines(self):
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+      f.write('{"a": 1, "b": {"c": "x"}}\n{"a": 4, "d": [true]}\n[5, 6]\n')
+    try:
+      file_source = {'path': f.name, 'origName': 'Lines.jsonl'}
+      tables = import_json.parse_file(file_source, {})['tables']
+    finally:
+      os.unlink(f.name)
+    self.assertEqual(tables, [{
+      'column_metadata': [
+        {'id': 'a', 'type': 'Numeric'}, {'id': 'b', 'type': 'Ref:Lines_b'}],
+      'table_data': [[1, 4, None], [1, None, None]],
+      'table_name': 'Lines'
+    }, {
+      'column_metadata': [{'id': 'c', 'type': 'Text'}],
+      'table_data': [['x']],
+      'table_name': 'Lines_b'
+    }, {
+      'column_metadata': [{'id': '', 'type': 'Bool'}, {'id': 'Lines', 'type': 'Ref:Lines'}],
+      'table_data': [[True], [2]],
+      'table_name': 'Lines_d'
+    }, {
+      # The array line is a record like any other, whose values go into a table of their own.
+      'column_metadata': [{'id': '', 'type': 'Numeric'}, {'id': 'Lines', 'type': 'Ref:Lines'}],
+      'table_data': [[5, 6], [3, 3]],
+      'table_name': 'Lines_'
+    }])
+
 
 def dump_tables(options):
   data = {
@@ -2,12 +2,16 @@
 This module reads a file path that is passed in using ActiveDoc.importFile()
 and returns a object formatted so that it can be used by grist for a bulk add records action
 """
+import itertools
 import logging
+import os
+import zipfile
 
 import openpyxl
 from openpyxl.utils.datetime import from_excel
 from openpyxl.worksheet import _reader    # pylint:disable=no-name-in-module
 
+import forkworker
 import parse_data
 from imports import import_utils
 
@@ -28,84 +32,55 @@ def new_from_excel(value, *args, **kwargs):
 _reader.from_excel = new_from_excel
 
 
+# Number of worker processes among which to divide the sheets of a workbook, if more than one.
+# Each worker parses whole sheets, so this only helps with workbooks of several large sheets.
+IMPORT_WORKERS = int(os.environ.get('GRIST_IMPORT_WORKERS') or 0)
+
+# Workbooks whose sheets take less than this many (uncompressed) bytes get parsed in one process.
+MIN_PARALLEL_BYTES = 10 * 1024 * 1024
+
+
 def import_file(file_source):
   path = import_utils.get_path(file_source)
   parse_options, tables = parse_file(path)
   return {"parseOptions": parse_options, "tables": tables}
 
 
-def parse_file(file_path):
+def parse_file(file_path, num_workers=None):
+  """
+  Parses the workbook at file_path. With num_workers greater than 1 (which defaults to
+  IMPORT_WORKERS), its sheets get parsed concurrently in forked worker processes.
+  """
+  if num_workers is None:
+    num_workers = IMPORT_WORKERS
   with open(file_path, "rb") as f:
-    return parse_open_file(f)
+    return parse_open_file(f, num_workers=num_workers, file_path=file_path)
 
 
-def parse_open_file(file_obj):
-  workbook = openpyxl.load_workbook(
-    file_obj,
-    read_only=True,
-    keep_vba=False,
-    data_only=True,
-    keep_links=False,
-  )
+def parse_open_file(file_obj, num_workers=0, file_path=None):
+  """
+  Parses the workbook in file_obj. Parsing in workers requires file_path, from which each worker
+  reads the workbook on its own.
+  """
+  workbook = _load_workbook(file_obj)
+  sheets = workbook.worksheets
 
+  tables = None
+  if num_workers > 1 and len(sheets) > 1 and file_path and forkworker.is_supported():
+    tables = _parse_in_workers(file_path, sheets, num_workers)
+  if tables is None:
+    tables = [None] * len(sheets)
+
+  # Parse in this process any sheets not parsed by workers.
   skipped_tables = 0
   export_list = []
-  # A table set is a collection of tables:
-  for sheet in workbook:
-    # openpyxl fails to read xlsx files with incorrect dimensions; we reset here as a precaution.
-    # See https://openpyxl.readthedocs.io/en/stable/optimized.html#worksheet-dimensions.
-    sheet.reset_dimensions()
-
-    table_name = sheet.title
-    rows = [
-      list(row)
-      for row in sheet.iter_rows(values_only=True)
-      # Exclude empty rows, i.e. rows with only empty values.
-      # `if not any(row)` would be slightly faster, but would count `0` as empty.
-      if not set(row) <= {None, ""}
-    ]
-    # Resetting dimensions via openpyxl causes rows to not be padded. Make sure
-    # sample rows are padded; get_table_data will handle padding the rest.
-    sample = _with_padding(rows[:1000])
-    data_offset, headers = import_utils.headers_guess(sample)
-    rows = rows[data_offset:]
-
-    # Make sure all header values are strings.
-    for i, header in enumerate(headers):
-      if header is None:
-        headers[i] = u''
-      elif not isinstance(header, str):
-        headers[i] = str(header)
-
-    log.debug("Guessed data_offset as %s", data_offset)
-    log.debug("Guessed headers as: %s", headers)
-
-    table_data_with_types = parse_data.get_table_data(rows, len(headers))
-
-    # Identify and remove empty columns, and populate separate metadata and data lists.
-    column_metadata = []
-    table_data = []
-    for col_data, header in zip(table_data_with_types, headers):
-      if not header and all(val == "" for val in col_data["data"]):
-        continue # empty column
-      data = col_data.pop("data")
-      col_data["id"] = header
-      column_metadata.append(col_data)
-      table_data.append(data)
-
-    if not table_data:
+  for i, sheet in enumerate(sheets):
+    table = tables[i] if tables[i] is not None else _parse_sheet(sheet)
+    if table:
+      export_list.append(table)
+    else:
       # Don't add tables with no columns.
       skipped_tables += 1
-      continue
-
-    log.info("Output table %r with %d columns", table_name, len(column_metadata))
-    for c in column_metadata:
-      log.debug("Output column %s", c)
-    export_list.append({
-      "table_name": table_name,
-      "column_metadata": column_metadata,
-      "table_data": table_data
-    })
 
   if not export_list:
     if skipped_tables:
@@ -115,6 +90,125 @@ def parse_open_file(file_obj):
   parse_options = {}
   return parse_options, export_list
 
+
+def _load_workbook(file_obj):
+  return openpyxl.load_workbook(
+    file_obj,
+    read_only=True,
+    keep_vba=False,
+    data_only=True,
+    keep_links=False,
+  )
+
+
+def _parse_sheet(sheet):
+  """
+  Returns the table for an openpyxl sheet, as an item of the export list, or {} if the sheet has
+  no columns.
+  """
+  # openpyxl fails to read xlsx files with incorrect dimensions; we reset here as a precaution.
+  # See https://openpyxl.readthedocs.io/en/stable/optimized.html#worksheet-dimensions.
+  sheet.reset_dimensions()
+
+  table_name = sheet.title
+  rows = (
+    list(row)
+    for row in sheet.iter_rows(values_only=True)
+    # Exclude empty rows, i.e. rows with only empty values.
+    # `if not any(row)` would count `0` as empty; counting in C is faster than making a set.
+    if row.count(None) + row.count("") < len(row)
+  )
+  # Resetting dimensions via openpyxl causes rows to not be padded. Make sure
+  # sample rows are padded; get_table_data will handle padding the rest. The rest of the rows
+  # are read as they get converted, rather than all kept in memory.
+  sample = _with_padding(list(itertools.islice(rows, parse_data.SAMPLE_ROWS)))
+  data_offset, headers = import_utils.headers_guess(sample)
+  rows = itertools.chain(sample[data_offset:], rows)
+
+  # Make sure all header values are strings.
+  for i, header in enumerate(headers):
+    if header is None:
+      headers[i] = u''
+    elif not isinstance(header, str):
+      headers[i] = str(header)
+
+  log.debug("Guessed data_offset as %s", data_offset)
+  log.debug("Guessed headers as: %s", headers)
+
+  table_data_with_types = parse_data.get_table_data(rows, len(headers))
+
+  # Identify and remove empty columns, and populate separate metadata and data lists.
+  column_metadata = []
+  table_data = []
+  for col_data, header in zip(table_data_with_types, headers):
+    if not header and all(val == "" for val in col_data["data"]):
+      continue # empty column
+    data = col_data.pop("data")
+    col_data["id"] = header
+    column_metadata.append(col_data)
+    table_data.append(data)
+
+  if not table_data:
+    return {}
+
+  log.info("Output table %r with %d columns", table_name, len(column_metadata))
+  for c in column_metadata:
+    log.debug("Output column %s", c)
+  return {
+    "table_name": table_name,
+    "column_metadata": column_metadata,
+    "table_data": table_data
+  }
+
+
+def _parse_in_workers(file_path, sheets, num_workers):
+  """
+  Parses sheets in up to num_workers forked processes. Returns a list with the result of
+  _parse_sheet() for each sheet, or None for sheets whose worker failed, or None instead of the
+  list if the workbook isn't worth dividing.
+  """
+  sizes = _get_sheet_sizes(file_path, sheets)
+  if sum(sizes) < MIN_PARALLEL_BYTES:
+    return None
+
+  # Give each sheet, biggest first, to the worker with the least work so far.
+  loads = [(0, i, []) for i in range(min(num_workers, len(sheets)))]
+  for size, index in sorted(((size, index) for index, size in enumerate(sizes)), reverse=True):
+    load, i, indices = min(loads)
+    loads[i] = (load + size, i, indices + [index])
+
+  workers = [(indices, forkworker.start(_parse_sheets_in_worker, file_path, indices))
+             for _, _, indices in loads]
+  tables = [None] * len(sheets)
+  for indices, worker in workers:
+    result = forkworker.get_result(worker)
+    if result is not None:
+      for index, table in zip(indices, result):
+        tables[index] = table
+  return tables
+
+
+def _parse_sheets_in_worker(file_path, indices):
+  # Runs in a worker: opens the workbook again, since the parent's open file (and its position)
+  # is shared with all workers.
+  with open(file_path, "rb") as f:
+    sheets = _load_workbook(f).worksheets
+    return [_parse_sheet(sheets[index]) for index in indices]
+
+
+def _get_sheet_sizes(file_path, sheets):
+  # The uncompressed size of each sheet's XML is a good estimate of the work to parse it.
+  # pylint:disable=protected-access
+  with zipfile.ZipFile(file_path) as archive:
+    sizes = []
+    for sheet in sheets:
+      try:
+        sizes.append(archive.getinfo(sheet._worksheet_path).file_size)
+      except (AttributeError, KeyError):
+        sizes.append(0)
+    return sizes
+
+
 def _with_padding(rows):
   if not rows:
     return []
@@ -53,6 +53,39 @@ class TestImportXLS(unittest.TestCase):
     self.assertEqual(parsed_file[1][1]["table_name"], u"Sheet2")
     self.assertEqual(parsed_file[1][1]["table_data"][0], ["a", "b", "c", "d"])
 
+  def test_parallel(self):
+    # Parsing sheets in workers gives the same results, in the same order.
+    serial = import_xls.parse_file(*_get_fixture('test_excel.xlsx'), num_workers=0)
+    orig_min_bytes = import_xls.MIN_PARALLEL_BYTES
+    import_xls.MIN_PARALLEL_BYTES = 0
+    try:
+      parallel = import_xls.parse_file(*_get_fixture('test_excel.xlsx'), num_workers=2)
+    finally:
+      import_xls.MIN_PARALLEL_BYTES = orig_min_bytes
+    self.assertEqual([t["table_name"] for t in parallel[1]], ["Sheet1", "Sheet2"])
+    self.assertEqual(parallel, serial)
+
+  def test_parallel_fork_failure(self):
+    # If a worker can't be forked, its sheets get parsed in the parent.
+    serial = import_xls.parse_file(*_get_fixture('test_excel.xlsx'), num_workers=0)
+    forks = []
+    orig_fork = os.fork
+    def fork():
+      forks.append(1)
+      if len(forks) > 1:
+        raise OSError(11, "Resource temporarily unavailable")
+      return orig_fork()
+    orig_min_bytes = import_xls.MIN_PARALLEL_BYTES
+    import_xls.MIN_PARALLEL_BYTES = 0
+    os.fork = fork
+    try:
+      parallel = import_xls.parse_file(*_get_fixture('test_excel.xlsx'), num_workers=2)
+    finally:
+      os.fork = orig_fork
+      import_xls.MIN_PARALLEL_BYTES = orig_min_bytes
+    self.assertEqual(len(forks), 2)
+    self.assertEqual(parallel, serial)
+
   def test_excel_types(self):
     parsed_file = import_xls.parse_file(*_get_fixture('test_excel_types.xlsx'))
     sheet = parsed_file[1][0]
@@ -38,22 +38,51 @@
 #         - a dependency between the caller [People.Rate] and unsorted lookup [Rate.#lookup#Email]
 #           using another _LookupRelation (which [Rate.#lookup#Email] keeps track of).
 #       - When it gets recalculated, which means that order of the lookup result has changed:
-#         - it clears the cached sorted version of the lookup result
+#         - it moves the changed rows within the sorted version of the lookup result
 #         - uses its _LookupRelations to invalidate affected callers.
-
+#
+# For lookups with a range, e.g. Rates.lookupRecords(Email=$Email, Date=LE($Date)), there is instead
+# a single helper column:
+#     [Rate.#lookup#Email#range:Date] (RangeLookupMapColumn)
+#       For each Email, this maintains a list of Rate row_ids sorted by Date, which it bisects to
+#       find the records in range. Its _RangeLookupRelations remember the range each caller looked
+#       up, so that a change to a Rate only invalidates callers whose ranges include its old or new
+#       Date.
+#
+# Summary tables use a similar helper for formulas like SUM($group.Amount) or len($group), whose
+# group is a lookup by the [Rate.#summary#Summary] helper column that links records to groups:
+#     [Rate.#lookup##summary#Summary#aggregate:Amount] (AggregateMapColumn)
+#       For each group, this maintains the count, sum, etc, of Amount values. When a record changes,
+#       it subtracts the record's old value from the totals of its old group, and adds the new value
+#       to the totals of its new group, then invalidates the summary cells of both groups. These
+#       cells get their values from the totals without iterating through the group.
+#
+# Running totals, as in CUMSUM(rec, "Amount", group_by="Email", order_by="Date"), use one more:
+#     [Rate.#lookup#Email#cumsum:Amount#Date] (CumulativeMapColumn)
+#       For each Email, this keeps the records sorted by Date, with a Fenwick tree of their Amounts
+#       in that order, which gives each running total in O(log N). Its _CumulativeRelations
+#       remember the position of each caller, so that a change to a Rate only invalidates callers
+#       at or after its old or new position within its group.
+
+import copy
+import datetime
 import itertools
 import logging
 from abc import abstractmethod
+from numbers import Number
+
+from sortedcontainers import SortedList
 
 import column
 import depend
+from fenwick import FenwickTree
 import records
 import relation
 from sort_key import make_sort_key
 import twowaymap
-from twowaymap import LookupSet
+from twowaymap import LookupSet, SortedRowIds
 import usertypes
-from functions.lookup import _Contains
+from functions.lookup import _Contains, _Range
 
 log = logging.getLogger(__name__)
 
@@ -136,23 +165,44 @@ class LookupMapColumn(NoValueColumn):
     row_ids, rel = self._do_lookup_with_sort(key, (), None)
     return row_ids, rel
 
+  def do_lookup_many(self, keys):
+    """
+    Looks up each of the given keys in the lookup map, and returns a list with the sorted list of
+    matching row_ids for each one. It's for lookups outside of formulas (e.g. by user actions), so
+    records no dependencies, and builds no Records or RecordSets.
+    """
+    # Outside of formulas, this just brings the lookup map up-to-date.
+    self._relation_tracker.use_map_from_current_node()
+    lookup_by_key = self._mapping.lookup_by_key
+    return [sorted(lookup_by_key(tuple(_extract(val) for val in key), ())) for key in keys]
+
   def _do_lookup_with_sort(self, key, sort_spec, sort_key):
     rel = self._relation_tracker.update_relation_from_current_node(key)
     row_id_set = self._do_fast_lookup(key)
-    row_ids = row_id_set.sorted_versions.get(sort_spec)
-    if row_ids is None:
-      row_ids = sorted(row_id_set, key=sort_key)
-      row_id_set.sorted_versions[sort_spec] = row_ids
-    return row_ids, rel
-
-  def _reset_sorted_versions(self, rec, sort_spec):
-    # For the lookup keys in rec, find the associated LookupSets, and clear the cached
-    # .sorted_versions entry for the given sort_spec. Used when only sort-by columns change.
+    sorted_row_ids = row_id_set.sorted_versions.get(sort_spec)
+    # The sort_key may change for the same sort_spec, e.g. when a sort column is renamed and back.
+    if (sorted_row_ids is None or not sorted_row_ids.valid or
+        sorted_row_ids.sort_key is not sort_key):
+      sorted_row_ids = SortedRowIds(row_id_set, sort_key)
+      # An empty row_id_set may be a default value not stored in the mapping, so not worth keeping.
+      if row_id_set:
+        row_id_set.sorted_versions[sort_spec] = sorted_row_ids
+    return sorted_row_ids.get_list(), rel
+
+  def _update_sorted_versions(self, rec, sort_spec, sort_key):
+    # For the lookup keys in rec, find the associated LookupSets, and move rec to its new place in
+    # the .sorted_versions entry for the given sort_spec. Used when only sort-by columns change.
     # Returns the set of affected keys.
     new_keys = set(self._mapping.get_new_keys_iter(rec))
     for key in new_keys:
       row_ids = self._mapping.lookup_by_key(key, default=LookupSet())
-      row_ids.sorted_versions.pop(sort_spec, None)
+      sorted_row_ids = row_ids.sorted_versions.get(sort_spec)
+      if sorted_row_ids is None:
+        continue
+      if sorted_row_ids.sort_key is sort_key:
+        sorted_row_ids.update(rec._row_id)
+      else:
+        row_ids.sorted_versions.pop(sort_spec)
     return new_keys
 
   def unset(self, row_id):
@@ -216,7 +266,8 @@ class SortedLookupMapColumn(NoValueColumn):
     for col_id in self._sort_col_ids:
       getattr(rec, col_id)
 
-    affected_keys = self._lookup_col._reset_sorted_versions(rec, self._sort_spec)
+    affected_keys = self._lookup_col._update_sorted_versions(rec, self._sort_spec,
+                                                             self._sort_key)
     self._relation_tracker.invalidate_affected_keys(affected_keys)
 
   def _get_keys(self, row_id):
@@ -225,6 +276,607 @@ class SortedLookupMapColumn(NoValueColumn):
 
 #----------------------------------------------------------------------
 
+class RangeLookupMapColumn(NoValueColumn):
+  """
+  A RangeLookupMapColumn supports lookups where some columns must equal the given key, and one
+  more column (the "range column") must be within a range, as created by functions.BETWEEN() and
+  similar. For each key, it keeps a sorted list of (value, row_id) entries of the range column.
+
+  It is independent of LookupMapColumn, and keeps its own _RangeLookupRelations, which remember
+  the range each referring row looked up. So a change to a looked-up record only invalidates the
+  referring rows whose ranges include its old or new value, rather than all those with its key.
+
+  Results are ordered by the range column unless a sort_spec is given, in which case the range
+  column also depends on the sort columns, and matching row_ids get sorted on each lookup.
+  """
+  def __init__(self, table, col_id, col_ids_tuple, range_col_id, sort_spec):
+    sort_col_ids = [(c[1:] if c.startswith('-') else c) for c in (sort_spec or ())]
+    for c in itertools.chain(col_ids_tuple, [range_col_id], sort_col_ids):
+      if not table.has_column(c):
+        raise KeyError("Table %s has no column %s" % (table.table_id, c))
+
+    col_info = column.ColInfo(usertypes.Any(), is_formula=True, method=self._recalc_rec_method)
+    super(RangeLookupMapColumn, self).__init__(table, col_id, col_info)
+    self._col_ids_tuple = col_ids_tuple
+    self._range_col_id = range_col_id
+    self._sort_spec = sort_spec
+    self._sort_col_ids = sort_col_ids
+    self._sort_key = make_sort_key(table, (range_col_id,) if sort_spec is None else sort_spec)
+
+    # Maps each key to a SortedList of (range_key(value), row_id) for the records with that key.
+    self._groups = {}
+    # Maps row_id to the (key, range_key(value)) entry for that row in self._groups. Rows with an
+    # empty value in the range column, or with an unhashable key, aren't included.
+    self._row_entries = {}
+
+    engine = table._engine
+    engine.invalidate_column(self)
+    self._relation_tracker = _RelationTracker(engine, self, relation_class=_RangeLookupRelation)
+
+  @property
+  def sort_key(self):
+    return self._sort_key
+
+  def _recalc_rec_method(self, rec, _table):
+    # Note that getattr() is what creates the correct dependencies, as well as ensures that the
+    # columns used are brought up-to-date (in case they are formula columns).
+    key = tuple(_extract(getattr(rec, col_id)) for col_id in self._col_ids_tuple)
+    value = _extract(getattr(rec, self._range_col_id))
+    for col_id in self._sort_col_ids:
+      getattr(rec, col_id)
+
+    row_id = rec._row_id
+    old_entry = self._row_entries.get(row_id)
+    new_entry = None if value is None else (key, range_key(value))
+    if new_entry == old_entry:
+      if not (self._sort_col_ids and old_entry):
+        return
+    else:
+      self._remove_entry(row_id)
+      new_entry = self._add_entry(row_id, new_entry)
+    self._relation_tracker.invalidate_affected_keys([e for e in (old_entry, new_entry) if e])
+
+  def _add_entry(self, row_id, entry):
+    # Adds the entry for row_id, returning it, or None if its key or value can't be indexed.
+    if entry is None:
+      return None
+    key, value_key = entry
+    try:
+      group = self._groups.get(key) or SortedList()
+      group.add((value_key, row_id))
+    except TypeError:
+      return None
+    self._groups[key] = group
+    self._row_entries[row_id] = entry
+    return entry
+
+  def _remove_entry(self, row_id):
+    entry = self._row_entries.pop(row_id, None)
+    if entry:
+      key, value_key = entry
+      group = self._groups[key]
+      group.remove((value_key, row_id))
+      if not group:
+        del self._groups[key]
+    return entry
+
+  def unset(self, row_id):
+    # This is called on record removal, and is necessary to deal with removed records.
+    entry = self._remove_entry(row_id)
+    if entry:
+      self._relation_tracker.invalidate_affected_keys([entry])
+
+  def _get_entry(self, row_id):
+    # For _RangeLookupRelation to know which callers are affected when the given row changes.
+    return self._row_entries.get(row_id)
+
+  def do_lookup(self, key, value_range):
+    """
+    Looks up the records with the given key, whose range column is within value_range (a
+    functions._Range, with bounds already converted to the column's type). Returns a tuple with
+    the list of matching row_ids (sorted), and the Relation object for those records, relating the
+    current frame to the returned records.
+    """
+    key = tuple(_extract(val) for val in key)
+    lo = None if value_range.lo is _Range.unbounded else range_key(_extract(value_range.lo))
+    hi = None if value_range.hi is _Range.unbounded else range_key(_extract(value_range.hi))
+    rel = self._relation_tracker.update_relation_from_current_node((key, lo, hi))
+
+    group = self._groups.get(key)
+    if not group:
+      return [], rel
+
+    # Entries are (value_key, row_id) pairs, so (value_key,) sorts before all entries with that
+    # value, and (value_key, _max_row_id) after them.
+    if lo is None:
+      start = 0
+    elif value_range.include_lo:
+      start = group.bisect_left((lo,))
+    else:
+      start = group.bisect_right((lo, _max_row_id))
+    if hi is None:
+      end = len(group)
+    elif value_range.include_hi:
+      end = group.bisect_right((hi, _max_row_id))
+    else:
+      end = group.bisect_left((hi,))
+
+    row_ids = [row_id for (_, row_id) in group.islice(start, end)]
+    if self._sort_spec is not None:
+      row_ids.sort(key=self._sort_key)
+    return row_ids, rel
+
+#----------------------------------------------------------------------
+
+# Returned by AggregateMapColumn.do_aggregate() when the result needs a full evaluation.
+NO_AGGREGATE = object()
+
+class AggregateMapColumn(NoValueColumn):
+  """
+  An AggregateMapColumn lives in the source table of a summary table, and maintains aggregates of
+  one column (or just the record counts, if value_col_id is None) for each group, i.e. for each
+  value of group_col_id, which is the summary helper column linking source records to groups.
+
+  It remembers the value it last saw for each record, so that when a record changes, it updates
+  the aggregates of its old and new groups in O(1) time (or O(log N) for MIN and MAX), and uses
+  _LookupRelations, keyed by group, to invalidate the summary cells that use them.
+
+  The results match those of the corresponding functions applied to `$group.Col`. When that can't
+  be guaranteed for a group (e.g. it has an error cell, or dates for MIN/MAX), do_aggregate()
+  returns NO_AGGREGATE, and the formula needs to be evaluated in full. Sums of floats are added
+  up in the same order as by the functions, when a group with floats changes.
+  """
+  def __init__(self, table, col_id, group_col_id, value_col_id):
+    for c in (group_col_id, value_col_id):
+      if c is not None and not table.has_column(c):
+        raise KeyError("Table %s has no column %s" % (table.table_id, c))
+
+    col_info = column.ColInfo(usertypes.Any(), is_formula=True, method=self._recalc_rec_method)
+    super(AggregateMapColumn, self).__init__(table, col_id, col_info)
+    self._group_col_id = group_col_id
+    self._value_col_id = value_col_id
+
+    # Maps each group to its _GroupAggregate.
+    self._groups = {}
+    # Maps row_id to the (group, value) pair included in the aggregates for that row.
+    self._row_entries = {}
+    # Whether to maintain sorted values for MIN and MAX; turned on by the first such call.
+    self._ordered = False
+
+    engine = table._engine
+    engine.invalidate_column(self)
+    self._relation_tracker = _RelationTracker(engine, self)
+
+  def _recalc_rec_method(self, rec, _table):
+    # Note that getattr() is what creates the correct dependencies, as well as ensures that the
+    # columns used are brought up-to-date (in case they are formula columns).
+    group = _extract(getattr(rec, self._group_col_id))
+    value = None
+    if self._value_col_id is not None:
+      try:
+        value = getattr(rec, self._value_col_id)
+      except Exception:   # pylint: disable=broad-except
+        # An error in any cell makes `$group.Col` raise it, which a full evaluation reproduces.
+        value = _error_value
+
+    row_id = rec._row_id
+    old_entry = self._row_entries.get(row_id)
+    if (old_entry and old_entry[0] == group and type(old_entry[1]) is type(value) and
+        old_entry[1] == value):
+      return
+    self._remove_entry(row_id)
+    self._add_entry(row_id, (group, value))
+    self._relation_tracker.invalidate_affected_keys(
+      {e[0] for e in (old_entry, (group, value)) if e})
+
+  def _add_entry(self, row_id, entry):
+    group, value = entry
+    agg = self._groups.get(group)
+    if agg is None:
+      agg = self._groups[group] = _GroupAggregate(self._ordered)
+    agg.add(row_id, value)
+    self._row_entries[row_id] = entry
+
+  def _remove_entry(self, row_id):
+    entry = self._row_entries.pop(row_id, None)
+    if entry:
+      group, value = entry
+      agg = self._groups[group]
+      agg.remove(row_id, value)
+      if not agg.rows:
+        del self._groups[group]
+    return entry
+
+  def unset(self, row_id):
+    # This is called on record removal, and is necessary to deal with removed records.
+    entry = self._remove_entry(row_id)
+    if entry:
+      self._relation_tracker.invalidate_affected_keys({entry[0]})
+
+  def _get_keys(self, row_id):
+    # For _LookupRelation to know which groups are affected when the given source row changes.
+    entry = self._row_entries.get(row_id)
+    return {entry[0]} if entry else set()
+
+  def _make_ordered(self):
+    self._ordered = True
+    for agg in self._groups.values():
+      agg.values = SortedList()
+    for row_id, (group, value) in self._row_entries.items():
+      if _is_exact_number(value):
+        self._groups[group].values.add((value, row_id))
+
+  def do_aggregate(self, group, func_name):
+    """
+    Returns the result of the function func_name ("len" or one of SUM, COUNT, AVERAGE, MIN, MAX)
+    for the given group, and creates a dependency of the current formula cell on it. Returns
+    NO_AGGREGATE if the result needs a full evaluation of the formula.
+    """
+    group = _extract(group)
+    self._relation_tracker.update_relation_from_current_node(group)
+    if func_name in ('MIN', 'MAX') and not self._ordered:
+      self._make_ordered()
+    return (self._groups.get(group) or _empty_aggregate).get(func_name)
+
+
+# Stands for the value of a record whose cell has an error.
+_error_value = object()
+
+def _is_exact_number(value):
+  # Whether value is a number that _GroupAggregate can sum exactly and sort. (Checking the type
+  # also excludes bools.)
+  # pylint: disable=unidiomatic-typecheck
+  if type(value) is int:
+    return True
+  return type(value) is float and -1e300 < value < 1e300
+
+
+class _GroupAggregate(object):
+  """
+  The aggregates of values in one group of an AggregateMapColumn. It keeps the counts of values
+  of different kinds, and the exact sum of ints and of floats with integer values.
+
+  Other sums of floats must match those of SUM() and AVERAGE(), which add up values in the order
+  of rows, and float addition depends on the order. For those, the running totals in row order are
+  kept, and a change to a row only drops those from its position on, to be added up again when
+  next needed. So adding or changing the last rows of a group, the usual case, takes O(log N).
+  """
+  __slots__ = ('rows', 'trues', 'numbers', 'floats', 'fractional', 'dates', 'inexact', 'errors',
+               'int_sum', 'int_abs_sum', 'summed', 'sum_order', 'running_sums', 'values')
+
+  def __init__(self, ordered):
+    self.rows = 0       # All rows in the group.
+    self.trues = 0      # Values of True, which SUM() counts as 1.
+    self.numbers = 0    # Numbers other than bools.
+    self.floats = 0     # Floats among the numbers.
+    self.fractional = 0 # Floats among the numbers that aren't integers, or aren't exact as ints.
+    self.dates = 0      # Dates and datetimes, which COUNT(), MIN() and MAX() include.
+    self.inexact = 0    # Numbers not included in the sums, e.g. NaN, infinity, or Decimal.
+    self.errors = 0     # Rows whose cell had an error.
+    self.int_sum = 0          # Sum of ints and of floats with integer values.
+    self.int_abs_sum = 0      # Sum of their absolute values.
+    self.summed = {}    # Maps row_id to the value, for the numbers and Trues that SUM() adds up.
+    # When float sums are needed, SortedList of the row_ids in summed, and the list of running
+    # (sum, average_sum) totals (see _get_float_sums) for its first rows.
+    self.sum_order = None
+    self.running_sums = None
+    # SortedList of (value, row_id) pairs for numbers in the sums, when MIN/MAX are needed.
+    self.values = SortedList() if ordered else None
+
+  def add(self, row_id, value):
+    self._update(row_id, value, 1)
+
+  def remove(self, row_id, value):
+    self._update(row_id, value, -1)
+
+  def _update(self, row_id, value, sign):
+    self.rows += sign
+    if _is_exact_number(value):
+      self.numbers += sign
+      self._update_summed(row_id, value, sign)
+      if self.values is not None:
+        if sign > 0:
+          self.values.add((value, row_id))
+        else:
+          self.values.remove((value, row_id))
+      # pylint: disable=unidiomatic-typecheck
+      if type(value) is float:
+        self.floats += sign
+        if value.is_integer() and abs(value) <= _MAX_EXACT_FLOAT_INT:
+          value = int(value)
+        else:
+          self.fractional += sign
+      if type(value) is int:
+        self.int_sum += sign * value
+        self.int_abs_sum += sign * abs(value)
+    elif isinstance(value, bool):
+      self.trues += sign * value
+      if value:
+        self._update_summed(row_id, value, sign)
+    elif isinstance(value, Number):
+      self.numbers += sign
+      self.inexact += sign
+    elif isinstance(value, datetime.date):
+      self.dates += sign
+    elif value is _error_value:
+      self.errors += sign
+
+  def _update_summed(self, row_id, value, sign):
+    order = self.sum_order
+    if sign > 0:
+      self.summed[row_id] = value
+      if order is not None:
+        order.add(row_id)
+        index = order.index(row_id)
+    else:
+      del self.summed[row_id]
+      if order is not None:
+        index = order.index(row_id)
+        del order[index]
+    if order is not None:
+      # Running totals from this row on no longer apply.
+      del self.running_sums[index:]
+
+  def get(self, func_name):
+    if self.errors:
+      return NO_AGGREGATE
+    if func_name == 'len':
+      return self.rows
+    if func_name == 'COUNT':
+      return self.numbers + self.dates
+    if self.inexact:
+      return NO_AGGREGATE
+    # Adding up integer values as floats is exact, in any order, while sums are small enough.
+    is_exact_as_float = (not self.fractional and
+                         self.int_abs_sum + self.trues <= _MAX_EXACT_FLOAT_INT)
+    if func_name == 'SUM':
+      if not self.floats:
+        return self.int_sum + self.trues
+      return float(self.int_sum + self.trues) if is_exact_as_float else self._get_float_sums()[0]
+    if func_name == 'AVERAGE':
+      # With no numbers, AVERAGE() raises an error, which a full evaluation produces.
+      if not self.numbers:
+        return NO_AGGREGATE
+      # AVERAGE() adds up values as floats, starting with 0.0.
+      if is_exact_as_float:
+        return self.int_sum / float(self.numbers)
+      return self._get_float_sums()[1] / self.numbers
+    if func_name in ('MIN', 'MAX'):
+      if self.dates:
+        return NO_AGGREGATE
+      if not self.numbers:
+        return 0
+      # Among equal values, min() and max() return the first one, i.e. the one with the lowest
+      # row_id, since that's the order of records in a group.
+      value = self.values[0][0] if func_name == 'MIN' else self.values[-1][0]
+      return self.values[self.values.bisect_left((value,))][0]
+    return NO_AGGREGATE
+
+  def _get_float_sums(self):
+    """
+    Returns the pair (sum, average_sum) of the sums that SUM() and AVERAGE() produce for the
+    group, which add up values in the order of records in the group, i.e. by row_id. SUM() starts
+    with the int 0 and includes Trues, while AVERAGE() starts with 0.0 and skips them.
+    """
+    if self.sum_order is None:
+      self.sum_order = SortedList(self.summed)
+      self.running_sums = []
+    running_sums = self.running_sums
+    start = len(running_sums)
+    if start < len(self.sum_order):
+      total, average_total = running_sums[-1] if running_sums else (0, 0.0)
+      summed = self.summed
+      for row_id in self.sum_order.islice(start):
+        value = summed[row_id]
+        total += value
+        if value is not True:
+          average_total += value
+        running_sums.append((total, average_total))
+    return running_sums[-1] if running_sums else (0, 0.0)
+
+_empty_aggregate = _GroupAggregate(False)
+
+# Ints up to this size in absolute value are represented exactly as floats.
+_MAX_EXACT_FLOAT_INT = 2**53
+
+#----------------------------------------------------------------------
+
+class CumulativeMapColumn(NoValueColumn):
+  """
+  A CumulativeMapColumn computes running totals of one column (the "value column") over the
+  records with the same key, in the order given by sort_spec, as needed by functions.CUMSUM().
+
+  For each key, it keeps a _CumulativeGroup with the records in sorted order, and a FenwickTree of
+  their values in that order. Its _CumulativeRelations remember the position each referring row
+  looked up, so a change to a record only invalidates the referring rows at or after its old or
+  new position, rather than all those with its key. Records aren't linked to their neighbors, so
+  a change in order doesn't cascade through the group as it would with PREVIOUS().
+
+  Values are summed as by SUM(). Sums of floats are done in a different order than a sum from the
+  start of the group, so may differ from it in the last digit.
+  """
+  def __init__(self, table, col_id, col_ids_tuple, value_col_id, sort_spec):
+    sort_col_ids = [(c[1:] if c.startswith('-') else c) for c in sort_spec]
+    for c in itertools.chain(col_ids_tuple, [value_col_id], sort_col_ids):
+      if not table.has_column(c):
+        raise KeyError("Table %s has no column %s" % (table.table_id, c))
+
+    col_info = column.ColInfo(usertypes.Any(), is_formula=True, method=self._recalc_rec_method)
+    super(CumulativeMapColumn, self).__init__(table, col_id, col_info)
+    self._col_ids_tuple = col_ids_tuple
+    self._value_col_id = value_col_id
+    self._sort_col_ids = sort_col_ids
+    self._sort_key = make_sort_key(table, sort_spec)
+
+    # Maps each key to the _CumulativeGroup of records with that key.
+    self._groups = {}
+    # Maps row_id to the (key, sort_key, value) entry for that row in self._groups. If the row has
+    # an error in the value column or a sort column, sort_key is None, and value is the error.
+    # Rows with an unhashable key aren't included.
+    self._row_entries = {}
+
+    engine = table._engine
+    engine.invalidate_column(self)
+    self._relation_tracker = _RelationTracker(engine, self, relation_class=_CumulativeRelation)
+
+  def _recalc_rec_method(self, rec, _table):
+    # Note that getattr() is what creates the correct dependencies, as well as ensures that the
+    # columns used are brought up-to-date (in case they are formula columns).
+    key = tuple(_extract(getattr(rec, col_id)) for col_id in self._col_ids_tuple)
+    error = None
+    for col_id in itertools.chain(self._sort_col_ids, [self._value_col_id]):
+      try:
+        value = getattr(rec, col_id)
+      except Exception as e:    # pylint: disable=broad-except
+        # Running totals of the group depend on this cell, so CUMSUM() raises this error for all
+        # records in the group. All columns still get accessed, to depend on all of them.
+        error = error or e
+
+    row_id = rec._row_id
+    if error:
+      new_entry = (key, None, error)
+    else:
+      new_entry = (key, self._sort_key(row_id), _cumulative_value(value))
+
+    old_entry = self._row_entries.get(row_id)
+    if (old_entry and old_entry[1] and new_entry[1] and old_entry[0] == key and
+        old_entry[1].values == new_entry[1].values):
+      # The position is unchanged, so only the running totals from this record on may change.
+      old_value, value = old_entry[2], new_entry[2]
+      if type(old_value) is type(value) and old_value == value:
+        return
+      self._groups[key].set_value(row_id, old_entry[1], value)
+      self._row_entries[row_id] = (key, old_entry[1], value)
+      self._relation_tracker.invalidate_affected_keys([old_entry[:2]])
+      return
+
+    self._remove_entry(row_id)
+    new_entry = self._add_entry(row_id, new_entry)
+    self._relation_tracker.invalidate_affected_keys([e[:2] for e in (old_entry, new_entry) if e])
+
+  def _add_entry(self, row_id, entry):
+    # Adds the entry for row_id, returning it, or None if its key can't be indexed.
+    key, sort_key, value = entry
+    try:
+      group = self._groups.get(key)
+    except TypeError:
+      return None
+    if group is None:
+      group = self._groups[key] = _CumulativeGroup()
+    group.add(row_id, sort_key, value)
+    self._row_entries[row_id] = entry
+    return entry
+
+  def _remove_entry(self, row_id):
+    entry = self._row_entries.pop(row_id, None)
+    if entry:
+      group = self._groups[entry[0]]
+      group.remove(row_id, entry[1])
+      if not group:
+        del self._groups[entry[0]]
+    return entry
+
+  def unset(self, row_id):
+    # This is called on record removal, and is necessary to deal with removed records.
+    entry = self._remove_entry(row_id)
+    if entry:
+      self._relation_tracker.invalidate_affected_keys([entry[:2]])
+
+  def _get_entry(self, row_id):
+    # For _CumulativeRelation to know which callers are affected when the given row changes.
+    entry = self._row_entries.get(row_id)
+    return entry and entry[:2]
+
+  def do_cumulative_sum(self, key, row_id):
+    """
+    Returns the sum of the value column over the records with the given key, up to and including
+    row_id in sorted order, and creates a dependency of the current formula cell on it.
+    """
+    key = tuple(_extract(val) for val in key)
+    rel, referring_row_id = self._relation_tracker.use_map_from_current_node()
+    # Like other lookups, this raises TypeError if the key is unhashable.
+    group = self._groups.get(key)
+    entry = self._row_entries.get(row_id)
+    if not (group and entry):
+      return 0
+    if rel:
+      rel._add_lookup(referring_row_id, entry[:2])
+    return group.prefix_sum(entry[1])
+
+
+def _cumulative_value(value):
+  # Converts a value as SUM() does: True counts as 1, and non-numeric values as 0.
+  if isinstance(value, bool):
+    return int(value)
+  return value if isinstance(value, (int, float)) else 0
+
+
+class _CumulativeGroup(object):
+  """
+  The records with one key in a CumulativeMapColumn: their sort keys in sorted order, and their
+  values. The FenwickTree of values in that order gets updated when a value changes or a record
+  is added or removed at the end, and is otherwise rebuilt on the next use, since inserting or
+  removing a record before others shifts the positions of all of them.
+  """
+  __slots__ = ('sort_keys', 'values', 'errors', 'tree')
+
+  def __init__(self):
+    self.sort_keys = SortedList()
+    self.values = {}                # Maps row_id to its value, for rows in sort_keys.
+    self.errors = {}                # Maps row_id to its error, for rows not in sort_keys.
+    self.tree = FenwickTree()       # Values in sorted order, or None if it needs a rebuild.
+
+  def __len__(self):
+    return len(self.sort_keys) + len(self.errors)
+
+  def add(self, row_id, sort_key, value):
+    if sort_key is None:
+      self.errors[row_id] = value
+      return
+    self.sort_keys.add(sort_key)
+    self.values[row_id] = value
+    if self.tree is not None:
+      if self.sort_keys[-1] is sort_key:
+        self.tree.append(value)
+      else:
+        self.tree = None
+
+  def remove(self, row_id, sort_key):
+    if sort_key is None:
+      del self.errors[row_id]
+      return
+    is_last = self.sort_keys[-1] is sort_key
+    self.sort_keys.remove(sort_key)
+    del self.values[row_id]
+    if self.tree is not None:
+      if is_last:
+        self.tree.pop()
+      else:
+        self.tree = None
+
+  def set_value(self, row_id, sort_key, value):
+    self.values[row_id] = value
+    if self.tree is not None:
+      self.tree.set(self.sort_keys.index(sort_key), value)
+
+  def prefix_sum(self, sort_key):
+    if self.errors:
+      # Raise the same error for all records, choosing it deterministically. Each cell gets its own
+      # copy, since raising an exception sets its traceback.
+      raise _copy_error(self.errors[min(self.errors)])
+    if self.tree is None:
+      self.tree = FenwickTree(self.values[k.row_id] for k in self.sort_keys)
+    return self.tree.prefix_sum(self.sort_keys.bisect_right(sort_key))
+
+def _copy_error(error):
+  try:
+    return copy.copy(error).with_traceback(None)
+  except Exception:   # pylint: disable=broad-except
+    # Some exceptions can't be recreated from their args; those get raised as they are.
+    return error.with_traceback(None)
+
+#----------------------------------------------------------------------
+
 class BaseLookupMapping(object):
   def __init__(self, col_ids_tuple):
     self._col_ids_tuple = col_ids_tuple
@@ -361,17 +1013,22 @@ class ContainsLookupMapping(BaseLookupMapping):
 class _RelationTracker(object):
   """
   Helper used by (Sorted)LookupMapColumn to keep track of the _LookupRelations between referring
-  nodes and that column.
+  nodes and that column. RangeLookupMapColumn and CumulativeMapColumn use it with
+  _RangeLookupRelation and _CumulativeRelation instead.
   """
-  def __init__(self, engine, lookup_map):
+  def __init__(self, engine, lookup_map, relation_class=None):
     self._engine = engine
     self._lookup_map = lookup_map
+    self._relation_class = relation_class or _LookupRelation
 
     # Map of referring Node to _LookupRelation. Different tables may do lookups using a
     # (Sorted)LookupMapColumn, and that creates a dependency from other Nodes to us, with a
     # relation between referring rows and the lookup keys. This map stores these relations.
     self._lookup_relations = {}
 
+    # Interns the keys looked up in this map, for all of its _LookupRelations to share.
+    self.key_interner = twowaymap.KeyInterner()
+
   def update_relation_from_current_node(self, key):
     """
     Looks up key in the lookup map and returns a tuple with two elements: the list of matching
@@ -390,19 +1047,41 @@ class _RelationTracker(object):
     engine._use_node(self._lookup_map.node, rel)
     return rel
 
+  def use_map_from_current_node(self):
+    """
+    Like update_relation_from_current_node(), but leaves it to the caller to record the lookup,
+    for when it depends on the state of the lookup map, which this brings up-to-date. Returns a
+    tuple of the Relation (None if there is no current formula), and the referring row_id.
+    """
+    engine = self._engine
+    rel = self._get_relation(engine._current_node) if engine._is_current_node_formula else None
+    # Bringing the lookup map up-to-date may evaluate other cells, so remember the current row.
+    referring_row_id = engine._current_row_id
+    engine._use_node(self._lookup_map.node, rel)
+    return rel, referring_row_id
+
   def invalidate_affected_keys(self, affected_keys):
     # For each known relation, figure out which referring rows are affected, and invalidate them.
     # The engine will notice that there have been more invalidations, and recompute things again.
     for rel in self._lookup_relations.values():
       rel.invalidate_affected_keys(affected_keys, self._engine)
 
+  def memory_size(self):
+    """
+    Returns the approximate number of bytes used to remember which keys referring rows looked up.
+    Only _LookupRelations measure their storage; other relations count as 0.
+    """
+    return self.key_interner.memory_size() + sum(
+      rel.memory_size() for rel in self._lookup_relations.values()
+      if isinstance(rel, _LookupRelation))
+
   def _get_relation(self, referring_node):
     """
     Helper which returns an existing or new _LookupRelation object for the given referring Node.
     """
     rel = self._lookup_relations.get(referring_node)
     if not rel:
-      rel = _LookupRelation(self._lookup_map, self, referring_node)
+      rel = self._relation_class(self._lookup_map, self, referring_node)
       self._lookup_relations[referring_node] = rel
     return rel
 
@@ -429,8 +1108,9 @@ class _LookupRelation(relation.Relation):
     self._referring_node = referring_node
 
     # Maps referring rows to keys, where multiple rows may map to the same key AND one row may
-    # map to multiple keys (if a formula does multiple lookup calls).
-    self._row_key_map = twowaymap.TwoWayMap(left=set, right=set)
+    # map to multiple keys (if a formula does multiple lookup calls). Usually it's one key per row,
+    # which RowKeyMap stores compactly, with keys interned per lookup map.
+    self._row_key_map = twowaymap.RowKeyMap(relation_tracker.key_interner)
 
     # This is for an optimization. We may invalidate the same key many times (including O(N)
     # times), which will lead to invalidating the same O(N) records over and over, resulting in
@@ -452,6 +1132,14 @@ class _LookupRelation(relation.Relation):
       set().union(*[self._lookup_map._get_keys(r) for r in target_row_ids])
     )
 
+  def get_all_affected_rows(self):
+    # Every referring row that did a lookup is in self._row_key_map, including those that found
+    # no matching records.
+    return self._row_key_map.left_all()
+
+  def memory_size(self):
+    return self._row_key_map.memory_size()
+
   def invalidate_affected_keys(self, affected_keys, engine):
     affected_rows = self.get_affected_rows_by_keys(affected_keys - self._invalidated_keys_cache)
     if affected_rows:
@@ -509,6 +1197,335 @@ class _LookupRelation(relation.Relation):
     self._invalidated_keys_cache.clear()
 
 
+class _RangeLookupRelation(relation.Relation):
+  """
+  _RangeLookupRelation maps rows of a table doing range lookups to the lookups they did, each as
+  a (key, lo, hi) tuple, where lo and hi are range_key() values or None for unbounded sides. It's
+  created and owned by a RangeLookupMapColumn.
+
+  To find the referring rows affected by a change to a looked-up record with a given key and
+  value, lookups are kept per key in sorted lists: those bounded only above are sorted by `hi`, so
+  the affected ones (with hi >= value) are a suffix; those bounded only below are sorted by `lo`,
+  so the affected ones are a prefix. Lookups bounded on both sides are sorted by `lo`, and the
+  prefix with lo <= value gets filtered by hi. Inclusivity of bounds is ignored here, which may
+  only cause extra recalculations of rows whose bounds equal a changed value.
+  """
+
+  def __init__(self, lookup_map, relation_tracker, referring_node):
+    super(_RangeLookupRelation, self).__init__(referring_node.table_id, lookup_map.table_id)
+    self._lookup_map = lookup_map
+    self._relation_tracker = relation_tracker
+    self._referring_node = referring_node
+
+    # Maps referring rows to the list of lookups they did.
+    self._row_lookups = {}
+    # Maps keys to _KeyRanges, with the ranges looked up for that key.
+    self._key_ranges = {}
+
+  def __str__(self):
+    return "_RangeLookupRelation(%s->%s)" % (self._referring_node, self.target_table)
+
+  def get_affected_rows(self, target_row_ids):
+    if target_row_ids == depend.ALL_ROWS:
+      return depend.ALL_ROWS
+    entries = (self._lookup_map._get_entry(r) for r in target_row_ids)
+    return self.get_affected_rows_by_keys([e for e in entries if e])
+
+  def get_all_affected_rows(self):
+    return set(self._row_lookups)
+
+  def invalidate_affected_keys(self, affected_entries, engine):
+    affected_rows = self.get_affected_rows_by_keys(affected_entries, use_cache=True)
+    if affected_rows:
+      node = self._referring_node
+      engine.invalidate_records(node.table_id, affected_rows, col_ids=(node.col_id,))
+
+  def get_affected_rows_by_keys(self, entries, use_cache=False):
+    """
+    Returns the set of referring rows whose lookups include any of the given (key, value_key)
+    entries of looked-up records. With use_cache, skips rows known to be invalidated already.
+    """
+    affected_rows = set()
+    for key, value_key in entries:
+      ranges = self._key_ranges.get(key)
+      if ranges:
+        try:
+          ranges.add_affected_rows(value_key, affected_rows, use_cache)
+        except TypeError:
+          # The value can't be compared with the bounds, so consider all rows affected.
+          affected_rows.update(self._row_lookups)
+    return affected_rows
+
+  def _add_lookup(self, referring_row_id, lookup):
+    """
+    Helper used by RangeLookupMapColumn to store the fact that the given (key, lo, hi) lookup was
+    done in the process of computing the given referring_row_id.
+    """
+    key = lookup[0]
+    ranges = self._key_ranges.get(key)
+    if ranges is None:
+      ranges = self._key_ranges[key] = _KeyRanges()
+    self._row_lookups.setdefault(referring_row_id, []).append(lookup)
+    ranges.add(referring_row_id, lookup[1], lookup[2])
+
+  def reset_rows(self, referring_rows):
+    """
+    Called when starting to compute a formula, so that mappings for the given referring_rows can
+    be cleared as they are about to be rebuilt.
+    """
+    if referring_rows == depend.ALL_ROWS:
+      self._row_lookups.clear()
+      self._key_ranges.clear()
+      return
+    for row_id in referring_rows:
+      for (key, lo, hi) in self._row_lookups.pop(row_id, ()):
+        ranges = self._key_ranges[key]
+        ranges.remove(row_id, lo, hi)
+        if not ranges:
+          del self._key_ranges[key]
+
+  def reset_all(self):
+    """
+    Called when the dependency using this relation is reset, and this relation is no longer used.
+    """
+    self.reset_rows(depend.ALL_ROWS)
+    self._relation_tracker._delete_relation(self._referring_node)
+
+
+class _KeyRanges(object):
+  """
+  The ranges looked up for one key by the rows of a _RangeLookupRelation. See its docstring.
+  """
+  __slots__ = ('below', 'above', 'between', 'unordered', 'below_done', 'above_done')
+
+  def __init__(self):
+    self.below = SortedList()       # (hi, row_id) for lookups with only an upper bound.
+    self.above = SortedList()       # (lo, row_id) for lookups with only a lower bound.
+    self.between = SortedList()     # (lo, hi, row_id) for lookups with both bounds.
+    self.unordered = []             # row_ids whose bounds can't be compared with others.
+
+    # The smallest value for which rows in `below`, and the largest for which rows in `above`, got
+    # invalidated, since all those rows are invalidated for values beyond these too. Like
+    # _LookupRelation._invalidated_keys_cache, it's reset on any change.
+    self.below_done = None
+    self.above_done = None
+
+  def __len__(self):
+    return len(self.below) + len(self.above) + len(self.between) + len(self.unordered)
+
+  def _get_item(self, row_id, lo, hi):
+    if lo is None:
+      return self.below, (hi, row_id)
+    elif hi is None:
+      return self.above, (lo, row_id)
+    else:
+      return self.between, (lo, hi, row_id)
+
+  def add(self, row_id, lo, hi):
+    self.below_done = self.above_done = None
+    sorted_list, item = self._get_item(row_id, lo, hi)
+    try:
+      sorted_list.add(item)
+    except TypeError:
+      self.unordered.append(row_id)
+
+  def remove(self, row_id, lo, hi):
+    self.below_done = self.above_done = None
+    sorted_list, item = self._get_item(row_id, lo, hi)
+    try:
+      sorted_list.remove(item)
+    except (TypeError, ValueError):
+      self.unordered.remove(row_id)
+
+  def add_affected_rows(self, value_key, affected_rows, use_cache):
+    affected_rows.update(self.unordered)
+    if not (use_cache and self.below_done is not None and self.below_done <= value_key):
+      affected_rows.update(r for (_, r) in self.below.irange((value_key,)))
+      if use_cache:
+        self.below_done = value_key
+    if not (use_cache and self.above_done is not None and self.above_done >= value_key):
+      affected_rows.update(r for (_, r) in self.above.irange(None, (value_key, _max_row_id)))
+      if use_cache:
+        self.above_done = value_key
+    for (_, hi, r) in self.between.irange(None, (value_key, _max_range_key)):
+      if hi >= value_key:
+        affected_rows.add(r)
+
+
+class _CumulativeRelation(relation.Relation):
+  """
+  _CumulativeRelation maps rows of a table using CUMSUM() to the (key, sort_key) positions of the
+  records whose running totals they looked up, where sort_key is None for records with errors.
+  It's created and owned by a CumulativeMapColumn.
+
+  A change to a record at some position affects the running totals at and after that position in
+  its group, so positions looked up are kept per key in a sorted list, and the affected referring
+  rows are a suffix of it.
+  """
+
+  def __init__(self, lookup_map, relation_tracker, referring_node):
+    super(_CumulativeRelation, self).__init__(referring_node.table_id, lookup_map.table_id)
+    self._lookup_map = lookup_map
+    self._relation_tracker = relation_tracker
+    self._referring_node = referring_node
+
+    # Maps referring rows to the list of positions they looked up.
+    self._row_lookups = {}
+    # Maps keys to _KeyPositions, with the positions looked up for that key.
+    self._key_positions = {}
+
+  def __str__(self):
+    return "_CumulativeRelation(%s->%s)" % (self._referring_node, self.target_table)
+
+  def get_affected_rows(self, target_row_ids):
+    if target_row_ids == depend.ALL_ROWS:
+      return depend.ALL_ROWS
+    entries = (self._lookup_map._get_entry(r) for r in target_row_ids)
+    return self.get_affected_rows_by_keys([e for e in entries if e])
+
+  def get_all_affected_rows(self):
+    return set(self._row_lookups)
+
+  def invalidate_affected_keys(self, affected_entries, engine):
+    affected_rows = self.get_affected_rows_by_keys(affected_entries, use_cache=True)
+    if affected_rows:
+      node = self._referring_node
+      engine.invalidate_records(node.table_id, affected_rows, col_ids=(node.col_id,))
+
+  def get_affected_rows_by_keys(self, entries, use_cache=False):
+    """
+    Returns the set of referring rows whose running totals include any of the given
+    (key, sort_key) positions of changed records. With use_cache, skips rows known to be
+    invalidated already.
+    """
+    affected_rows = set()
+    for key, sort_key in entries:
+      positions = self._key_positions.get(key)
+      if positions:
+        positions.add_affected_rows(sort_key, affected_rows, use_cache)
+    return affected_rows
+
+  def _add_lookup(self, referring_row_id, lookup):
+    """
+    Helper used by CumulativeMapColumn to store the fact that the running total at the given
+    (key, sort_key) position was looked up in the process of computing referring_row_id.
+    """
+    key, sort_key = lookup
+    positions = self._key_positions.get(key)
+    if positions is None:
+      positions = self._key_positions[key] = _KeyPositions()
+    self._row_lookups.setdefault(referring_row_id, []).append(lookup)
+    positions.add(referring_row_id, sort_key)
+
+  def reset_rows(self, referring_rows):
+    """
+    Called when starting to compute a formula, so that mappings for the given referring_rows can
+    be cleared as they are about to be rebuilt.
+    """
+    if referring_rows == depend.ALL_ROWS:
+      self._row_lookups.clear()
+      self._key_positions.clear()
+      return
+    for row_id in referring_rows:
+      for (key, sort_key) in self._row_lookups.pop(row_id, ()):
+        positions = self._key_positions[key]
+        positions.remove(row_id, sort_key)
+        if not positions:
+          del self._key_positions[key]
+
+  def reset_all(self):
+    """
+    Called when the dependency using this relation is reset, and this relation is no longer used.
+    """
+    self.reset_rows(depend.ALL_ROWS)
+    self._relation_tracker._delete_relation(self._referring_node)
+
+
+class _KeyPositions(object):
+  """
+  The positions looked up for one key by the rows of a _CumulativeRelation. See its docstring.
+  """
+  __slots__ = ('sorted', 'unordered', 'done')
+
+  def __init__(self):
+    self.sorted = SortedList()      # _Position objects for positions of records without errors.
+    self.unordered = []             # row_ids that looked up records with errors.
+
+    # The smallest sort_key for which rows in `sorted` got invalidated (or _all_positions if all
+    # of them), since all rows after it are invalidated too. Like
+    # _LookupRelation._invalidated_keys_cache, it's reset on any change.
+    self.done = None
+
+  def __len__(self):
+    return len(self.sorted) + len(self.unordered)
+
+  def add(self, row_id, sort_key):
+    self.done = None
+    if sort_key is None:
+      self.unordered.append(row_id)
+    else:
+      self.sorted.add(_Position(sort_key, row_id))
+
+  def remove(self, row_id, sort_key):
+    self.done = None
+    if sort_key is None:
+      self.unordered.remove(row_id)
+    else:
+      self.sorted.remove(_Position(sort_key, row_id))
+
+  def add_affected_rows(self, sort_key, affected_rows, use_cache):
+    affected_rows.update(self.unordered)
+    done = self.done if use_cache else None
+    if done is _all_positions or (done is not None and sort_key is not None and
+                                  not sort_key < done):
+      return
+    if sort_key is None:
+      affected_rows.update(p.row_id for p in self.sorted)
+    else:
+      affected_rows.update(p.row_id for p in self.sorted.irange(_Position(sort_key, -_max_row_id)))
+    if use_cache:
+      self.done = _all_positions if sort_key is None else sort_key
+
+_all_positions = object()
+
+
+class _Position(object):
+  """
+  A position looked up by a referring row, ordered by sort_key, then by the referring row_id.
+  SortKeys of the same record compare as equal even if they are different objects.
+  """
+  __slots__ = ('sort_key', 'row_id')
+
+  def __init__(self, sort_key, row_id):
+    self.sort_key = sort_key
+    self.row_id = row_id
+
+  def __lt__(self, other):
+    if self.sort_key < other.sort_key:
+      return True
+    return not other.sort_key < self.sort_key and self.row_id < other.row_id
+
+  def __eq__(self, other):
+    return not (self < other or other < self)
+
+
+def range_key(value):
+  """
+  Returns a key for ordering values in range lookups. Values of different types are ordered as in
+  sort_key.make_sort_key(): None first, then numbers, then other types by type name.
+  """
+  if value is None:
+    return (0, "", 0)
+  if isinstance(value, Number):
+    return (1, "", value)
+  return (2, type(value).__name__, value)
+
+# Larger than any row_id, for bisecting lists of (value_key, row_id) pairs.
+_max_row_id = float('inf')
+# Larger than any value returned by range_key().
+_max_range_key = (3,)
+
+
 def extract_column_id(c):
   if isinstance(c, _Contains):
     return c.value
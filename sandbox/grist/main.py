@@ -16,6 +16,7 @@ import marshal
 import functools
 
 import actions
+import columnar
 import engine
 import formula_prompt
 import migrations
@@ -50,6 +51,13 @@ def table_data_from_db(table_name, table_data_repr):
   return actions.TableData(table_name, id_col,
                            actions.decode_bulk_values(table_data_parsed, _decode_db_value))
 
+def table_data_from_columnar(table_name, table_data_repr):
+  # Decodes table data in the packed columnar encoding (see columnar.py), marshalled into bytes.
+  table_data = columnar.decode_table(marshal.loads(table_data_repr))
+  if table_data.table_id != table_name:
+    raise ValueError("Columnar data for table %s given for %s" % (table_data.table_id, table_name))
+  return table_data
+
 def _decode_db_value(value):
   # Decode database values received from SQLite's allMarshal() call. These are encoded by
   # marshalling certain types and storing as BLOBs (received in Python as binary strings, as
@@ -92,6 +100,18 @@ def run(sandbox):
   def fetch_table(table_id, formulas=True, query=None):
     return actions.get_action_repr(eng.fetch_table(table_id, formulas=formulas, query=query))
 
+  @export
+  def fetch_table_chunk(table_id, formulas=True, query=None, col_ids=None, start_row_id=0,
+                        limit=engine.FETCH_CHUNK_SIZE):
+    table_data, next_row_id = eng.fetch_table_chunk(table_id, formulas=formulas, query=query,
+                                                    col_ids=col_ids, start_row_id=start_row_id,
+                                                    limit=limit)
+    return {"tableData": actions.get_action_repr(table_data), "nextRowId": next_row_id}
+
+  @export
+  def fetch_table_columnar(table_id, formulas=True, query=None):
+    return eng.fetch_table_columnar(table_id, formulas=formulas, query=query)
+
   @export
   def fetch_table_schema():
     return eng.fetch_table_schema()
@@ -118,10 +138,36 @@ def run(sandbox):
   def load_table(table_name, table_data):
     return eng.load_table(load_and_record_table_data(table_name, table_data))
 
+  @export
+  def load_table_columnar(table_name, table_data_repr):
+    table_data = table_data_from_columnar(table_name, table_data_repr)
+    eng.record_table_stats(table_data, table_data_repr)
+    return eng.load_table(table_data)
+
+  @export
+  def load_table_lazily(table_name, row_count):
+    # Instead of receiving the table's data now, ask for it when it's first needed.
+    def load_func():
+      return load_and_record_table_data(table_name,
+                                        sandbox.call_external("fetch_table_data", table_name))
+    eng.register_lazy_table(table_name, row_count, load_func)
+
+  @export
+  def get_formula_fingerprint():
+    return eng.get_formula_fingerprint()
+
+  @export
+  def trust_formula_values(fingerprint):
+    return eng.trust_formula_values(fingerprint)
+
   @export
   def get_table_stats():
     return eng.get_table_stats()
 
+  @export
+  def set_incremental_invalidation(enabled):
+    eng.set_incremental_invalidation(enabled)
+
   @export
   def create_migrations(all_tables, metadata_only=False):
     doc_actions = migrations.create_migrations(
@@ -172,6 +218,22 @@ def run(sandbox):
   def get_timings():
     return eng._timing.get(False)
 
+  @export
+  def start_profiling():
+    eng.start_profiling()
+
+  @export
+  def stop_profiling():
+    return eng.stop_profiling()
+
+  @export
+  def get_profile():
+    return eng.get_profile()
+
+  @export
+  def set_recalc_workers(num_workers):
+    eng.set_recalc_workers(num_workers)
+
   # Echo input for testing
   @export
   def test_echo(msg):
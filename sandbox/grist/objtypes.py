@@ -287,6 +287,18 @@ class RaisedException(object):
       self._fill_from_error(self.has_user_input(), include_details)
       error.__traceback__ = None
 
+  def __getstate__(self):
+    # NO_INPUT is checked by identity, so can't be pickled as is (e.g. to pass values between
+    # processes in parallel_recalc.py).
+    state = self.__dict__.copy()
+    if not self.has_user_input():
+      del state['user_input']
+    return state
+
+  def __setstate__(self, state):
+    self.user_input = RaisedException.NO_INPUT
+    self.__dict__.update(state)
+
   def encode_args(self):
     if self._encoded_error is not None:
       return self._encoded_error
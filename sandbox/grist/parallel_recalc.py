@@ -0,0 +1,255 @@
+"""
+Opt-in evaluation of formulas in forked worker processes (see Engine.set_recalc_workers()).
+
+Before the usual update loop, dirty formula columns of user tables are grouped into connected
+components, using the dependency edges already known between them, and the components are
+divided among worker processes. Each worker is a fork of the sandbox, so it sees a copy-on-write
+snapshot of all data, and evaluates its components with the usual update loop. It sends back the
+cells it changed, the rows it computed, and the dependency edges it used, and the parent applies
+them as if it had done the work itself.
+
+A worker only returns results that can be replayed this way. It gives up, leaving all of its work
+to the parent, if evaluation:
+  - computes a column that isn't eligible (e.g. a lookup map, or a metadata formula),
+  - depends on something through a relation other than identity, reference, or a composition of
+    those (e.g. a lookup, whose relation keeps state that the parent wouldn't see),
+  - produces actions or requests, or needs a lazy table.
+Loading a lazy table would call back into Node over the channel the worker shares with the parent
+and the other workers, so in a worker it fails instead, and the parent loads it when it redoes the
+work.
+Formulas that mention REQUEST or lookupOrAddDerived are never sent to workers. If two workers end
+up computing the same column (via a dependency not known in advance), the results of the later one
+are dropped. Whatever is left is evaluated by the parent in the usual way, so the results are the
+same as without workers.
+
+Forking isn't available on all platforms (e.g. in Pyodide); there, everything is evaluated in the
+parent.
+"""
+import re
+from collections import namedtuple
+
+import depend
+import forkworker
+import relation
+from rowset import RowSet
+from objtypes import strict_equal
+
+# Functions with side effects, which must only be evaluated in the parent process.
+_PINNED_FUNCTIONS = frozenset(['REQUEST', 'lookupOrAddDerived'])
+_identifier_re = re.compile(r'\b[A-Za-z_]\w*\b')
+
+# Forking isn't worth it for fewer dirty cells than this.
+MIN_PARALLEL_CELLS = 1000
+
+# What a worker sends back: `done` maps nodes to lists of row_ids computed, `changes` maps nodes
+# to lists of (row_id, value) pairs for changed cells, and `edges` is a list of dependency edges
+# used, with relations encoded by _encode_relation().
+WorkerResult = namedtuple('WorkerResult', ('done', 'changes', 'edges'))
+
+
+def is_supported():
+  return forkworker.is_supported()
+
+
+def recompute_in_workers(engine, num_workers):
+  """
+  Evaluates what it can of engine.recompute_map in up to num_workers forked processes, and applies
+  the results to the engine. Returns the number of cells computed by workers.
+  """
+  components = _get_components(engine)
+  if len(components) < 2 or sum(size for size, _ in components) < MIN_PARALLEL_CELLS:
+    return 0
+
+  workers = [forkworker.start(_evaluate, engine, nodes)
+             for nodes in _assign(components, num_workers)]
+
+  count = 0
+  merged_nodes = set()
+  for worker in workers:
+    result = forkworker.get_result(worker)
+    if result is None or not merged_nodes.isdisjoint(result.done):
+      continue
+    merged_nodes.update(result.done)
+    count += _apply_result(engine, result)
+  return count
+
+
+def _is_eligible(engine, node):
+  if node.table_id.startswith('_grist_') or node.col_id.startswith('#'):
+    return False
+  schema_col = engine.schema.get(node.table_id, None)
+  schema_col = schema_col and schema_col.columns.get(node.col_id)
+  return bool(schema_col and schema_col.isFormula and
+              _PINNED_FUNCTIONS.isdisjoint(_identifier_re.findall(schema_col.formula)))
+
+
+def _count_rows(engine, node):
+  # For a whole column, the max row_id is a good enough estimate of the number of rows.
+  rows = engine.recompute_map[node]
+  return engine.tables[node.table_id].row_ids.max() if rows == depend.ALL_ROWS else len(rows)
+
+
+def _get_components(engine):
+  """
+  Returns a list of (size, nodes) pairs, one for each group of dirty eligible nodes connected via
+  known dependencies, where size is the number of dirty cells. Groups that depend directly on a
+  dirty node that isn't eligible are left out.
+  """
+  dirty = set(engine.recompute_map)
+  parent = {node: node for node in dirty if _is_eligible(engine, node)}
+  pinned = set()
+
+  def find(node):
+    while parent[node] != node:
+      parent[node] = parent[parent[node]]
+      node = parent[node]
+    return node
+
+  for node in parent:
+    for in_node in engine.dep_graph.get_in_nodes(node):
+      if in_node in parent:
+        parent[find(in_node)] = find(node)
+      elif in_node in dirty:
+        pinned.add(node)
+
+  groups = {}
+  for node in parent:
+    groups.setdefault(find(node), []).append(node)
+  pinned_roots = {find(node) for node in pinned}
+
+  components = []
+  for root, nodes in groups.items():
+    if root not in pinned_roots:
+      nodes.sort()
+      components.append((sum(_count_rows(engine, node) for node in nodes), nodes))
+  components.sort(key=lambda c: c[1][0])
+  return components
+
+
+def _assign(components, num_workers):
+  """
+  Divides components among at most num_workers workers, biggest first, each to the worker with
+  the least work so far. Returns a list of lists of nodes, one for each worker with any work.
+  """
+  loads = [(0, i, []) for i in range(min(num_workers, len(components)))]
+  for size, nodes in sorted(components, key=lambda c: -c[0]):
+    load, i, worker_nodes = min(loads)
+    loads[i] = (load + size, i, worker_nodes + nodes)
+  return [sorted(worker_nodes) for _, _, worker_nodes in loads]
+
+
+def _action_counts(out_actions):
+  return (len(out_actions.stored), len(out_actions.direct), len(out_actions.calc),
+          len(out_actions.requests))
+
+
+def _evaluate(engine, nodes):
+  """
+  Runs in a worker: evaluates the given nodes, and returns a WorkerResult, or None if the results
+  can't be applied in the parent.
+  """
+  # pylint:disable=protected-access
+  engine._changes_map.clear()
+  done_before = {node: set(rows) for node, rows in engine._recompute_done_map.items()}
+  engine.dep_graph.used_edges = set()
+  for table_id, lazy_table in list(engine._lazy_tables.items()):
+    engine._lazy_tables[table_id] = lazy_table._replace(load_func=_refuse_lazy_load)
+  lazy_tables_before = set(engine._lazy_tables)
+  action_counts_before = _action_counts(engine.out_actions)
+
+  engine._update_loop(engine._make_sorted_work_items(nodes), ignore_other_changes=True)
+
+  if (_action_counts(engine.out_actions) != action_counts_before or
+      set(engine._lazy_tables) != lazy_tables_before):
+    return None
+
+  done = {}
+  for node, rows in engine._recompute_done_map.items():
+    new_rows = rows.difference(done_before.get(node, ()))
+    if new_rows:
+      if not _is_eligible(engine, node):
+        return None
+      done[node] = sorted(new_rows)
+
+  # Check all edges used, not only new ones: a known edge through e.g. a lookup relation means
+  # the worker's lookups updated state in the relation, which the parent wouldn't see.
+  edges = []
+  for out_node, in_node, rel in engine.dep_graph.used_edges:
+    encoded = _encode_relation(engine, rel)
+    if encoded is None:
+      return None
+    edges.append((out_node, in_node, encoded))
+
+  changes = {node: [(row_id, value) for (row_id, _, value) in node_changes]
+             for node, node_changes in engine._changes_map.items()}
+  return WorkerResult(done, changes, edges)
+
+
+def _refuse_lazy_load():
+  raise RuntimeError("Lazy tables can't be loaded in a recalc worker")
+
+
+def _apply_result(engine, result):
+  # pylint:disable=protected-access
+  count = 0
+  for node, rows in sorted(result.done.items()):
+    if node not in engine._recompute_done_map:
+      engine.dep_graph.reset_dependencies(node, rows)
+      engine._recompute_done_map[node] = set()
+    engine._recompute_done_map[node].update(rows)
+
+    dirty_rows = engine.recompute_map.get(node)
+    if dirty_rows is not None:
+      if dirty_rows == depend.ALL_ROWS:
+        dirty_rows = engine.recompute_map[node] = RowSet(engine.tables[node.table_id].row_ids)
+      dirty_rows.difference_update(rows)
+      if not dirty_rows:
+        engine.recompute_map.pop(node)
+    count += len(rows)
+
+  for out_node, in_node, rel in result.edges:
+    engine.dep_graph.add_edge(out_node, in_node, _decode_relation(engine, rel))
+
+  for node, node_changes in sorted(result.changes.items()):
+    col = engine.tables[node.table_id].get_column(node.col_id)
+    for row_id, value in node_changes:
+      previous = col.raw_get(row_id)
+      if not strict_equal(value, previous):
+        engine._changes_map.setdefault(node, []).append((row_id, previous, value))
+        col.set(row_id, value)
+  return count
+
+
+def _encode_relation(engine, rel):
+  """
+  Returns a picklable description of a relation that the parent can turn back into the same
+  relation object, or None if the relation isn't one that can be shared this way.
+  """
+  # pylint:disable=protected-access,unidiomatic-typecheck
+  table = engine.tables.get(rel.referring_table)
+  if table is None:
+    return None
+  if type(rel) is relation.IdentityRelation:
+    if table._identity_relation is rel:
+      return ('identity', rel.referring_table)
+  elif type(rel) is relation.ReferenceRelation:
+    col = table.all_columns.get(rel._ref_col_id)
+    if getattr(col, '_relation', None) is rel:
+      return ('reference', rel.referring_table, rel._ref_col_id)
+  elif type(rel) is relation.ComposedRelation:
+    source = _encode_relation(engine, rel.source_relation)
+    target = _encode_relation(engine, rel.target_relation)
+    if source and target:
+      return ('compose', source, target)
+  return None
+
+
+def _decode_relation(engine, encoded):
+  # pylint:disable=protected-access
+  kind = encoded[0]
+  if kind == 'identity':
+    return engine.tables[encoded[1]]._identity_relation
+  elif kind == 'reference':
+    return engine.tables[encoded[1]].all_columns[encoded[2]]._relation
+  else:
+    return _decode_relation(engine, encoded[1]).compose(_decode_relation(engine, encoded[2]))
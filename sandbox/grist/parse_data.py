@@ -2,12 +2,13 @@
 This module implements a way to detect and convert types that's better than messytables (at least
 in some relevant cases).
 
-It has a simple interface: get_table_data(row_set) which returns a list of columns, each a
-dictionary with "type" and "data" fields, where "type" is a Grist type string, and data is a list
-of values. All "data" lists will have the same length.
+It has a simple interface: get_table_data(rows, num_columns) which returns a list of columns,
+each a dictionary with "type" and "data" fields, where "type" is a Grist type string, and data is
+a list of values. All "data" lists will have the same length.
 """
 
 import datetime
+import itertools
 import logging
 import re
 import moment # TODO grist internal libraries might not be available to plugins in the future.
@@ -15,17 +16,25 @@ import moment # TODO grist internal libraries might not be available to plugins
 log = logging.getLogger(__name__)
 log.setLevel(logging.WARNING)
 
+# Number of rows used for guessing the basic type of each column.
+SAMPLE_ROWS = 1000
+
+# Number of rows converted at a time, after the sample.
+CHUNK_ROWS = 10000
+
 
 # Typecheck using type(value) instead of isinstance(value, some_type) makes parsing 25% faster
 # pylint:disable=unidiomatic-typecheck
 
 
 # Our approach to type detection is different from that of messytables.
-# We first go through each cell in a sample of rows, checking if it's one of the basic
-# types, and keep a count of successes for each. We use the counts to decide the basic types (e.g.
-# numeric vs text). Then we go through the full data set converting to the chosen basic type.
-# During this process, we keep counts of suitable Grist types to consider (e.g. Int vs Numeric).
-# We use those counts to produce the selected Grist type at the end.
+# We first go through each cell in a sample of rows, counting the types of values, which tell us
+# which of the basic types each cell could be converted to. We use the counts to decide the basic
+# types (e.g. numeric vs text). Then we go through the full data set converting to the chosen
+# basic type, looking up how to convert each value by its type. Counting is a separate pass, since
+# the type must be chosen before any value gets converted; it only covers the sample (and stops
+# early for columns that can only be text), so it's a small part of the time for all but tiny
+# files.
 
 # Previously string values were used here for type guessing and were parsed to typed values.
 # That process now happens elsewhere, and this module only handles the case
@@ -34,6 +43,10 @@ log.setLevel(logging.WARNING)
 
 
 class BaseConverter(object):
+  # Maps types of values that convert() accepts to a function to convert them, or to None if
+  # they are kept as they are. Values of other types fail to convert, except in AnyConverter.
+  conversions = {}
+
   @classmethod
   def test(cls, value):
     try:
@@ -61,6 +74,7 @@ numeric_types = (int, float, complex, type(None))
 
 class NumericConverter(BaseConverter):
   """Handles the Grist Numeric type"""
+  conversions = {int: None, float: None, complex: None, type(None): None, bool: int}
 
   @classmethod
   def convert(cls, value):
@@ -77,6 +91,7 @@ class NumericConverter(BaseConverter):
 
 class BooleanConverter(BaseConverter):
   """Handles the Grist Bool type"""
+  conversions = {bool: None}
 
   @classmethod
   def convert(cls, value):
@@ -91,6 +106,7 @@ class BooleanConverter(BaseConverter):
 
 class SimpleDateTimeConverter(BaseConverter):
   """Handles Date and DateTime values which are already instances of datetime.datetime."""
+  conversions = {datetime.datetime: None, type(None): None}
 
   @classmethod
   def convert(cls, value):
@@ -117,6 +133,8 @@ class AnyConverter(BaseConverter):
   Fallback converter that converts everything to strings.
   Type guessing and parsing of the strings will happen elsewhere.
   """
+  conversions = {str: None, type(None): lambda value: u'', int: str}
+
   @classmethod
   def convert(cls, value):
     if value is None:
@@ -133,52 +151,80 @@ class ColumnDetector(object):
   ColumnDetector accepts calls to `add_value()`, and keeps track of successful conversions to
   different basic types. At the end `get_converter()` method returns the class of the most
   suitable converter.
+
+  Since a converter succeeds for exactly the types in its `conversions`, only the number of
+  values of each type gets counted. If max_values is given (the most values that may get added),
+  is_decided() tells when so many values can't be converted to any basic type that the result
+  will be AnyConverter, so that no more values need to be added.
   """
   # Converters are listed in the order of preference, which is only used if two converters succeed
   # on the same exact number of values. Text is always a fallback.
   converters = [SimpleDateTimeConverter, BooleanConverter, NumericConverter]
 
+  # Types that at least one of the converters accepts.
+  _convertible_types = frozenset(t for conv in converters for t in conv.conversions)
+
   # If this many non-junk values or more can't be converted, fall back to text.
   _text_threshold = 0.10
 
   # Junk values: these aren't counted when deciding whether to fall back to text.
   _junk_re = re.compile(r'^\s*(|-+|\?+|n/?a)\s*$', re.I)
 
-  def __init__(self):
-    self._counts = [0] * len(self.converters)
+  def __init__(self, max_values=None):
+    self._type_counts = {}
     self._count_nonjunk = 0
     self._count_total = 0
-    self._data = []
+    self._count_unconvertible = 0
+    self._max_unconvertible = (max_values * self._text_threshold
+                               if max_values is not None else float('inf'))
 
   def add_value(self, value):
     self._count_total += 1
-    if value is None or (type(value) in (str,) and self._junk_re.match(value)):
+    value_type = type(value)
+    if value is None or (value_type is str and self._junk_re.match(value)):
       return
 
-    self._data.append(value)
-
     self._count_nonjunk += 1
-    for i, conv in enumerate(self.converters):
-      if conv.test(value):
-        self._counts[i] += 1
+    self._type_counts[value_type] = self._type_counts.get(value_type, 0) + 1
+    if value_type not in self._convertible_types:
+      self._count_unconvertible += 1
+
+  def is_decided(self):
+    # Each converter fails for at least the unconvertible values, and can fail for at most
+    # _text_threshold of all values, which is at most _text_threshold of max_values.
+    return self._count_unconvertible > self._max_unconvertible
 
   def get_converter(self):
+    if self.is_decided():
+      return AnyConverter
+    counts = [sum(n for t, n in self._type_counts.items() if t in conv.conversions)
+              for conv in self.converters]
     # We find the max by count, and secondarily by minimum index in the converters list.
-    count, neg_index = max((c, -i) for (i, c) in enumerate(self._counts))
+    count, neg_index = max((c, -i) for (i, c) in enumerate(counts))
     if count > 0 and count >= self._count_nonjunk * (1 - self._text_threshold):
       return self.converters[-neg_index]
     return AnyConverter
 
 
 def _guess_basic_types(rows, num_columns):
-  column_detectors = [ColumnDetector() for i in range(num_columns)]
-  for row in rows:
-    for cell, detector in zip(row, column_detectors):
-      detector.add_value(cell)
+  column_detectors = [ColumnDetector(len(rows)) for i in range(num_columns)]
+  # Pairs of (index, detector) for columns whose type isn't decided yet.
+  undecided = list(enumerate(column_detectors))
+  for num, row in enumerate(rows):
+    if num % 100 == 99:
+      undecided = [(i, d) for (i, d) in undecided if not d.is_decided()]
+      if not undecided:
+        break
+    row_len = len(row)
+    for i, detector in undecided:
+      if i < row_len:
+        detector.add_value(row[i])
 
   return [detector.get_converter() for detector in column_detectors]
 
 
+_UNKNOWN = object()
+
 class ColumnConverter(object):
   """
   ColumnConverter converts and collects values using the passed-in converter object. At the end
@@ -186,9 +232,8 @@ class ColumnConverter(object):
   """
   def __init__(self, converter):
     self._converter = converter
-    self._all_col_values = []     # Initially this has None's for converted values
-    self._converted_values = []   # A list of all converted values
-    self._converted_indices = []  # Indices of the converted values into self._all_col_values
+    self._values = []             # Converted values, and strings for values that failed to convert
+    self._failed_indices = []     # Indices into self._values of values that failed to convert
 
   def convert_and_add(self, value):
     # For some reason, we get 'str' type rather than 'unicode' for empty strings.
@@ -201,39 +246,80 @@ class ColumnConverter(object):
       value = int(value)
 
     try:
-      conv = self._converter.convert(value)
-      self._converted_values.append(conv)
-      self._converted_indices.append(len(self._all_col_values))
-      self._all_col_values.append(None)
+      self._values.append(self._converter.convert(value))
     except Exception:
-      self._all_col_values.append(str(value))
+      self._failed_indices.append(len(self._values))
+      self._values.append(str(value))
+
+  def convert_and_add_many(self, values):
+    """
+    Same as calling convert_and_add() for each value, but values whose type is in the converter's
+    `conversions` get converted without going through convert().
+    """
+    conversions = self._converter.conversions
+    append = self._values.append
+    for value in values:
+      value_type = type(value)
+      if value_type is float and value.is_integer():
+        value = int(value)
+        value_type = int
+      conversion = conversions.get(value_type, _UNKNOWN)
+      if conversion is None:
+        append(value)
+      elif conversion is _UNKNOWN:
+        self.convert_and_add(value)
+      else:
+        append(conversion(value))
 
   def get_grist_column(self):
     """
     Returns a dictionary {"type": grist_type, "data": grist_value_array}.
     """
-    grist_type, grist_values = self._converter.get_grist_column(self._converted_values)
-    for i, v in zip(self._converted_indices, grist_values):
-      self._all_col_values[i] = v
-    return {"type": grist_type, "data": self._all_col_values}
+    values = self._values
+    if not self._failed_indices:
+      grist_type, values = self._converter.get_grist_column(values)
+      return {"type": grist_type, "data": values}
 
+    failed = set(self._failed_indices)
+    converted_indices = [i for i in range(len(values)) if i not in failed]
+    grist_type, grist_values = self._converter.get_grist_column(
+      [values[i] for i in converted_indices])
+    for i, v in zip(converted_indices, grist_values):
+      values[i] = v
+    return {"type": grist_type, "data": values}
 
-def get_table_data(rows, num_columns, num_rows=0):
-  converters = _guess_basic_types(rows[:1000], num_columns)
-  col_converters = [ColumnConverter(c) for c in converters]
-  for num, row in enumerate(rows):
-    if num_rows and num == num_rows:
-      break
 
-    if num % 10000 == 0:
-      log.info("Processing row %d", num)
+def get_table_data(rows, num_columns, num_rows=0):
+  """
+  Returns a list of columns as described in the module docstring. Rows may be any iterable, e.g.
+  a csv.reader; only a sample of them is kept in memory for guessing types, and the rest are
+  converted in chunks as they are read.
 
-    # Make sure we have a value for every column.
-    missing_values = len(converters) - len(row)
-    if missing_values > 0:
-      row.extend([""] * missing_values)
+  If num_rows is set, only that many rows are included. Types are still guessed from the full
+  sample, even when it has more rows than that.
+  """
+  rows = iter(rows)
+  sample = list(itertools.islice(rows, SAMPLE_ROWS))
+  converters = _guess_basic_types(sample, num_columns)
+  col_converters = [ColumnConverter(c) for c in converters]
 
-    for cell, conv in zip(row, col_converters):
-      conv.convert_and_add(cell)
+  if num_rows:
+    rows = itertools.islice(rows, max(num_rows - len(sample), 0))
+    del sample[num_rows:]
+
+  num = 0
+  chunk = sample
+  while chunk:
+    log.info("Processing row %d", num)
+    for row in chunk:
+      # Make sure we have a value for every column.
+      missing_values = num_columns - len(row)
+      if missing_values > 0:
+        row.extend([""] * missing_values)
+
+    for values, conv in zip(zip(*chunk), col_converters):
+      conv.convert_and_add_many(values)
+    num += len(chunk)
+    chunk = list(itertools.islice(rows, CHUNK_ROWS))
 
   return [conv.get_grist_column() for conv in col_converters]
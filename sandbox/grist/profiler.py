@@ -0,0 +1,166 @@
+"""
+Per-formula profiling of the data engine, to find out which formulas make a document slow.
+
+While enabled (see Engine.start_profiling()), the Profiler collects for each formula column:
+  - count: the number of cell evaluations.
+  - selfTime: the time spent evaluating its cells, excluding nested evaluations of other cells.
+  - totalTime: the time spent evaluating its cells, including nested evaluations.
+  - orderErrors: the number of times its evaluation got interrupted by an OrderError, to compute
+    a cell it needed first (see Engine._update_loop).
+  - edges: the number of new dependency edges its evaluation added via Engine._use_node (edges
+    already in the graph from earlier evaluations don't count).
+  - lookups: the number of lookupRecords/lookupOne calls its evaluation made.
+
+It also records, for each call to apply_user_actions, the user actions applied and the number of
+cells recomputed in each column as a result.
+
+When profiling is off, the engine uses DummyProfiler, which adds minimal overhead.
+"""
+import contextlib
+import time
+
+
+class Profiler(object):
+  # The number of most recent apply_user_actions calls to keep stats for.
+  MAX_ACTIONS = 100
+
+  def __init__(self):
+    self._columns = {}
+    self._actions = []
+    # The stack of [node, nested_time] for the cells being evaluated.
+    self._stack = []
+    # Cell counts per node for the user actions currently being applied, or None.
+    self._action_cells = None
+    self._action_names = None
+    self._action_start = 0
+
+  def _get_stats(self, node):
+    stats = self._columns.get(node)
+    if not stats:
+      stats = self._columns[node] = ColumnStats()
+    return stats
+
+  @contextlib.contextmanager
+  def measure(self, node):
+    """
+    Measures the evaluation of one cell of the given node.
+    """
+    entry = [node, 0]
+    self._stack.append(entry)
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start
+      self._stack.pop()
+      if self._stack:
+        self._stack[-1][1] += elapsed
+      stats = self._get_stats(node)
+      stats.count += 1
+      stats.total_time += elapsed
+      stats.self_time += elapsed - entry[1]
+      if self._action_cells is not None:
+        self._action_cells[node] = self._action_cells.get(node, 0) + 1
+
+  def order_error(self, node):
+    """
+    Notes that evaluating the given node was interrupted to compute another cell first.
+    """
+    self._get_stats(node).order_errors += 1
+
+  def add_edge(self):
+    """
+    Notes that the cell being evaluated added a dependency edge.
+    """
+    if self._stack:
+      self._get_stats(self._stack[-1][0]).edges += 1
+
+  def lookup(self):
+    """
+    Notes that the cell being evaluated performed a lookup.
+    """
+    if self._stack:
+      self._get_stats(self._stack[-1][0]).lookups += 1
+
+  def start_actions(self, user_actions):
+    self._action_cells = {}
+    self._action_start = time.perf_counter()
+    self._action_names = [[type(a).__name__, getattr(a, 'table_id', None)] for a in user_actions]
+
+  def end_actions(self):
+    if self._action_cells is None:
+      return
+    self._actions.append({
+      "actions": self._action_names,
+      "time": time.perf_counter() - self._action_start,
+      "cells": sum(self._action_cells.values()),
+      "columns": [{"tableId": node[0], "colId": node[1], "count": count}
+                  for node, count in sorted(self._action_cells.items())],
+    })
+    del self._actions[:-self.MAX_ACTIONS]
+    self._action_cells = None
+
+  def get(self, clear=True):
+    """
+    Returns the collected stats as a JSON-like structure, with "columns" sorted by decreasing
+    self time, and "actions" in the order they were applied.
+    """
+    columns = []
+    for node, stats in sorted(self._columns.items(), key=lambda item: -item[1].self_time):
+      columns.append({
+        "tableId": node[0], "colId": node[1],
+        "count": stats.count, "selfTime": stats.self_time, "totalTime": stats.total_time,
+        "orderErrors": stats.order_errors, "edges": stats.edges, "lookups": stats.lookups,
+        "lookupsPerCell": stats.lookups / stats.count if stats.count else 0,
+      })
+    result = {"columns": columns, "actions": list(self._actions)}
+    if clear:
+      self.clear()
+    return result
+
+  def clear(self):
+    self._columns.clear()
+    del self._actions[:]
+
+
+# An implementation that adds minimal overhead.
+class DummyProfiler(object):
+  # pylint: disable=no-self-use,unused-argument
+  # A nullcontext can be reused, and entered any number of times, so one instance serves all cells.
+  _null_context = contextlib.nullcontext()
+
+  def measure(self, node):
+    return self._null_context
+
+  def order_error(self, node):
+    pass
+
+  def add_edge(self):
+    pass
+
+  def lookup(self):
+    pass
+
+  def start_actions(self, user_actions):
+    pass
+
+  def end_actions(self):
+    pass
+
+  def get(self, clear=True):
+    return {"columns": [], "actions": []}
+
+  def clear(self):
+    pass
+
+
+class ColumnStats(object):
+  __slots__ = ('count', 'self_time', 'total_time', 'order_errors', 'edges', 'lookups')
+
+  def __init__(self):
+    self.count = 0
+    self.self_time = 0
+    self.total_time = 0
+    self.order_errors = 0
+    self.edges = 0
+    self.lookups = 0
@@ -24,6 +24,8 @@ are then turned into DocActions to be communicated and applied (both in memory a
 
 The interface offered by this class is a single `prepare_inserts()` function, which takes a sorted
 list and a list of keys, and returns the adjustments to existing records and to the new keys.
+A `SortedKeyView` allows passing in a list that's sorted by a transformation of the keys (as the
+sorted index of a PositionColumn is), without copying it.
 
 Note that we rely heavily here on availability of a sorted container, for which we use the
 sortedcontainers module from here:
@@ -105,6 +107,28 @@ def prepare_inserts(sortedlist, keys):
   return worklist.get_adjustments(), ungroup_func(worklist.get_insertions())
 
 
+class SortedKeyView(object):
+  """
+  Presents a SortedListWithKey, whose sort key is wrap_key(key(item)) for some function wrap_key
+  that preserves order (e.g. column.SafeSortKey), as a list sorted by key(item), for use with
+  prepare_inserts(). It makes no copy, so preparing inserts costs O(log N) per key to insert
+  rather than O(N log N) to build a new list. Only the methods used in this module are supported.
+  """
+  def __init__(self, sortedlist, key, wrap_key):
+    self._sortedlist = sortedlist
+    self._key = key
+    self._wrap_key = wrap_key
+
+  def __len__(self):
+    return len(self._sortedlist)
+
+  def __getitem__(self, index):
+    return self._sortedlist[index]
+
+  def bisect_key_left(self, key):
+    return self._sortedlist.bisect_key_left(self._wrap_key(key))
+
+
 def _group_insertions(sortedlist, keys):
   """
   Given a list of keys to insert into sortedlist, returns the pair:
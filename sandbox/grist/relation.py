@@ -10,6 +10,7 @@ Relations can be determined by a foreign key or another form of lookup, and they
 
 """
 import depend
+import twowaymap
 
 class Relation(object):
   """
@@ -28,6 +29,14 @@ class Relation(object):
     """
     raise NotImplementedError()
 
+  def get_all_affected_rows(self):
+    """
+    Returns the output rows affected by a change to all input rows, as a `set`, or ALL_ROWS if
+    they aren't known. It's used in incremental mode of depend.Graph.invalidate_deps(). Relations
+    that keep track of their referring rows can return just those.
+    """
+    return self.get_affected_rows(depend.ALL_ROWS)
+
   def reset_all(self):
     """
     Called when the dependency using this relation is reset, and this relation is no longer used.
@@ -95,6 +104,12 @@ class ComposedRelation(Relation):
     return self.source_relation.get_affected_rows(
       self.target_relation.get_affected_rows(input_rows))
 
+  def get_all_affected_rows(self):
+    target_rows = self.target_relation.get_all_affected_rows()
+    if target_rows == depend.ALL_ROWS:
+      return self.source_relation.get_all_affected_rows()
+    return self.source_relation.get_affected_rows(target_rows)
+
   def reset_rows(self, referring_rows):
     # In the example from the doc-string, this says that certain Students are being recomputed, so
     # no longer refer to any Schools. It doesn't say anything about Schools' dependence on
@@ -111,7 +126,7 @@ class ReferenceRelation(Relation):
   """
   def __init__(self, referring_table, target_table, ref_col_id):
     super(ReferenceRelation, self).__init__(referring_table, target_table)
-    self.inverse_map = {}     # maps target rows to sets of referring rows
+    self._inverse_index = twowaymap.InverseIndex()    # maps target rows to referring rows
     self._ref_col_id = ref_col_id
 
   def __str__(self):
@@ -122,16 +137,35 @@ class ReferenceRelation(Relation):
     # so we need to take the union of all of those sets.
     if input_rows == depend.ALL_ROWS:
       return depend.ALL_ROWS
-    affected_rows = set()
-    for target_row_id in input_rows:
-      affected_rows.update(self.inverse_map.get(target_row_id, ()))
-    return affected_rows
+    return self._inverse_index.lookup_many(input_rows)
+
+  def get_referring_rows(self, target_row_id):
+    """
+    Returns a sorted sequence of the rows referring to the given target row.
+    """
+    return self._inverse_index.lookup(target_row_id)
 
   def add_reference(self, referring_row_id, target_row_id):
-    self.inverse_map.setdefault(target_row_id, set()).add(referring_row_id)
+    self._inverse_index.add(referring_row_id, target_row_id)
+
+  def add_references(self, pairs):
+    """
+    Adds references for the given (referring_row_id, target_row_id) pairs.
+    """
+    self._inverse_index.add_many(pairs)
 
   def remove_reference(self, referring_row_id, target_row_id):
-    self.inverse_map[target_row_id].discard(referring_row_id)
+    self._inverse_index.remove(referring_row_id, target_row_id)
+
+  def reset_references(self, pairs):
+    """
+    Replaces all references with the given (referring_row_id, target_row_id) pairs, which is much
+    faster than adding them one at a time.
+    """
+    self._inverse_index.reset(pairs)
 
   def clear(self):
-    self.inverse_map.clear()
+    self._inverse_index.clear()
+
+  def memory_size(self):
+    return self._inverse_index.memory_size()
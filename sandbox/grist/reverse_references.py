@@ -33,7 +33,7 @@ def get_reverse_adjustments(row_ids, old_values, new_values, value_iterator, rel
     # Get the value stored in that column by using our own relation object (which should store
     # correct values - the same that are stored in that reverse column). `reverse_value` is the
     # value in that reverse cell
-    reverse_value = relation.get_affected_rows((target_row_id,))
+    reverse_value = set(relation.get_referring_rows(target_row_id))
 
     # Now make the adjustments using calculated deltas
     for source_row_id in updates.removals:
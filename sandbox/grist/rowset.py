@@ -0,0 +1,258 @@
+"""
+RowSet is a set of row_ids stored as sorted, non-overlapping ranges. It's used for the sets of
+dirty rows in Engine.recompute_map (see depend.Graph.invalidate_deps), which often cover long
+stretches of consecutive row_ids, e.g. after adding many records. Such a set takes a couple of
+integers in a RowSet, rather than an entry per row as in a set or SortedSet.
+
+Like SortedSet, a RowSet iterates in sorted order. Adding or removing a few runs of row_ids uses
+binary search; combining with many runs (e.g. with another RowSet) merges the ranges in one linear
+pass.
+
+Scattered row_ids (e.g. the rows referring to some records, as returned by a ReferenceRelation)
+make for many short ranges, where inserting a range at a time gets slow. So a RowSet with many
+ranges averaging only a few rows each keeps its row_ids in a SortedSet instead, until a larger
+range of rows gets added to it.
+"""
+from bisect import bisect_left, bisect_right
+import heapq
+import itertools
+
+from sortedcontainers import SortedSet
+
+# Combining with up to this many runs, or with fewer than 1/_BISECT_RATIO of the runs in the set,
+# adds or removes one run at a time instead of merging all ranges in one pass.
+_MAX_RUNS_TO_BISECT = 8
+_BISECT_RATIO = 64
+
+# A RowSet with more ranges than this, whose ranges average fewer than _MIN_AVG_RUN_LENGTH rows,
+# keeps its row_ids in a SortedSet instead.
+_MAX_SCATTERED_RUNS = 1000
+_MIN_AVG_RUN_LENGTH = 4
+
+
+def _get_runs(row_ids):
+  """
+  Returns a list of (start, end) pairs of half-open ranges covering the given row_ids, sorted and
+  without overlaps.
+  """
+  if isinstance(row_ids, RowSet):
+    return row_ids.ranges()
+  if isinstance(row_ids, range) and row_ids.step == 1:
+    return [(row_ids.start, row_ids.stop)] if row_ids else []
+  return _get_sorted_runs(row_ids if isinstance(row_ids, SortedSet) else sorted(set(row_ids)))
+
+
+def _get_sorted_runs(row_ids):
+  # Same as _get_runs(), for distinct row_ids in sorted order.
+  runs = []
+  start = end = None
+  for row_id in row_ids:
+    if row_id != end:
+      if start is not None:
+        runs.append((start, end))
+      start = row_id
+    end = row_id + 1
+  if start is not None:
+    runs.append((start, end))
+  return runs
+
+
+def _is_ranges(row_ids):
+  # Whether row_ids is stored as ranges, so that it may have many rows in few runs.
+  # pylint:disable=protected-access
+  return ((isinstance(row_ids, RowSet) and row_ids._rows is None) or
+          (isinstance(row_ids, range) and row_ids.step == 1))
+
+
+class RowSet(object):
+  """
+  A mutable set of integer row_ids, supporting the parts of the SortedSet interface used for dirty
+  rows: len(), iteration in sorted order, `in`, update(), difference_update() (also as `-=`), and
+  `-`. Arguments may be RowSets or any iterables of row_ids.
+  """
+  __slots__ = ('_starts', '_ends', '_len', '_rows')
+
+  def __init__(self, row_ids=()):
+    # Row_ids in the set are those in range(_starts[i], _ends[i]) for each i. Ranges are sorted,
+    # and never overlap or touch. For scattered row_ids, _rows is instead a SortedSet of them, and
+    # the lists of ranges are empty.
+    self._starts = []
+    self._ends = []
+    self._len = 0
+    self._rows = None
+    self.update(row_ids)
+
+  def __len__(self):
+    return self._len if self._rows is None else len(self._rows)
+
+  def __iter__(self):
+    if self._rows is not None:
+      return iter(self._rows)
+    return itertools.chain.from_iterable(map(range, self._starts, self._ends))
+
+  def __contains__(self, row_id):
+    if self._rows is not None:
+      return row_id in self._rows
+    i = bisect_right(self._starts, row_id) - 1
+    return i >= 0 and row_id < self._ends[i]
+
+  def __eq__(self, other):
+    if not isinstance(other, RowSet):
+      return NotImplemented
+    return self.ranges() == other.ranges()
+
+  __hash__ = None
+
+  def __repr__(self):
+    return "RowSet(%s)" % ", ".join(
+      str(start) if end == start + 1 else "%d-%d" % (start, end - 1)
+      for start, end in self.ranges())
+
+  def ranges(self):
+    """
+    Returns a list of (start, end) pairs of the half-open ranges that make up this set.
+    """
+    if self._rows is not None:
+      return _get_sorted_runs(self._rows)
+    return list(zip(self._starts, self._ends))
+
+  def copy(self):
+    result = RowSet()
+    result._starts = self._starts[:]
+    result._ends = self._ends[:]
+    result._len = self._len
+    result._rows = None if self._rows is None else self._rows.copy()
+    return result
+
+  def update(self, row_ids):
+    """
+    Adds the given row_ids to the set.
+    """
+    if self._rows is not None:
+      if not (_is_ranges(row_ids) and len(row_ids) > len(self._rows)):
+        self._rows.update(row_ids)
+        return
+      # Adding more rows than the set has, in ranges, may make it worth storing as ranges again.
+      self._set_runs(_get_sorted_runs(self._rows))
+
+    runs = _get_runs(row_ids)
+    if len(runs) <= max(_MAX_RUNS_TO_BISECT, len(self._starts) // _BISECT_RATIO):
+      for start, end in runs:
+        self._add_range(start, end)
+    else:
+      self._set_runs(_union(self.ranges(), runs))
+    self._check_scattered()
+
+  def difference_update(self, row_ids):
+    """
+    Removes the given row_ids from the set, ignoring any that aren't in it.
+    """
+    if not len(self):
+      return
+    if self._rows is not None:
+      rows = self._rows
+      if _is_ranges(row_ids):
+        for start, end in _get_runs(row_ids):
+          del rows[rows.bisect_left(start):rows.bisect_left(end)]
+      else:
+        rows.difference_update(row_ids)
+      if not rows:
+        self._set_runs([])
+      return
+
+    runs = _get_runs(row_ids)
+    if len(runs) <= max(_MAX_RUNS_TO_BISECT, len(self._starts) // _BISECT_RATIO):
+      for start, end in runs:
+        self._remove_range(start, end)
+    else:
+      self._set_runs(_difference(self.ranges(), runs))
+    self._check_scattered()
+
+  def __isub__(self, row_ids):
+    self.difference_update(row_ids)
+    return self
+
+  def __sub__(self, row_ids):
+    result = self.copy()
+    result.difference_update(row_ids)
+    return result
+
+  def _set_runs(self, runs):
+    self._starts = [start for start, _ in runs]
+    self._ends = [end for _, end in runs]
+    self._len = sum(end - start for start, end in runs)
+    self._rows = None
+
+  def _check_scattered(self):
+    # Switches to keeping row_ids in a SortedSet if there are many ranges of only a few rows.
+    num_runs = len(self._starts)
+    if num_runs > _MAX_SCATTERED_RUNS and self._len < num_runs * _MIN_AVG_RUN_LENGTH:
+      self._rows = SortedSet(iter(self))
+      self._starts = []
+      self._ends = []
+      self._len = 0
+
+  def _add_range(self, start, end):
+    starts, ends = self._starts, self._ends
+    # Ranges i through j-1 overlap or touch [start, end), and get merged with it.
+    i = bisect_left(ends, start)
+    j = bisect_right(starts, end)
+    if i < j:
+      removed = sum(ends[k] - starts[k] for k in range(i, j))
+      start = min(start, starts[i])
+      end = max(end, ends[j - 1])
+      starts[i:j] = [start]
+      ends[i:j] = [end]
+      self._len += end - start - removed
+    else:
+      starts.insert(i, start)
+      ends.insert(i, end)
+      self._len += end - start
+
+  def _remove_range(self, start, end):
+    starts, ends = self._starts, self._ends
+    # Ranges i through j-1 overlap [start, end); what's left of them is outside of it.
+    i = bisect_right(ends, start)
+    j = bisect_left(starts, end)
+    if i >= j:
+      return
+    removed = sum(ends[k] - starts[k] for k in range(i, j))
+    new_starts, new_ends = [], []
+    if starts[i] < start:
+      new_starts.append(starts[i])
+      new_ends.append(start)
+    if ends[j - 1] > end:
+      new_starts.append(end)
+      new_ends.append(ends[j - 1])
+    starts[i:j] = new_starts
+    ends[i:j] = new_ends
+    self._len -= removed - sum(e - s for s, e in zip(new_starts, new_ends))
+
+
+def _union(runs1, runs2):
+  result = []
+  for start, end in heapq.merge(runs1, runs2):
+    if result and start <= result[-1][1]:
+      if end > result[-1][1]:
+        result[-1] = (result[-1][0], end)
+    else:
+      result.append((start, end))
+  return result
+
+
+def _difference(runs1, runs2):
+  result = []
+  j = 0
+  for start, end in runs1:
+    # Skip the ranges to remove that end before this one starts.
+    while j < len(runs2) and runs2[j][1] <= start:
+      j += 1
+    k = j
+    while k < len(runs2) and runs2[k][0] < end:
+      if runs2[k][0] > start:
+        result.append((start, runs2[k][0]))
+      start = max(start, runs2[k][1])
+      k += 1
+    if start < end:
+      result.append((start, end))
+  return result
@@ -522,12 +522,23 @@ class Table(object):
     maintaining a lookup index to make such lookups fast.
     """
     # The tuple of keys used determines the LookupMap we need.
+    has_order = 'sort_by' in kwargs or 'order_by' in kwargs
     sort_by = kwargs.pop('sort_by', None)
     order_by = kwargs.pop('order_by', 'id')   # For backward compatibility
     key = []
     col_ids = []
+    range_col_id = value_range = None
     for col_id in sorted(kwargs):
       value = kwargs[col_id]
+      if isinstance(value, lookup._Range):
+        if range_col_id:
+          raise ValueError("At most one field may be looked up by range, got %s and %s" %
+                           (range_col_id, col_id))
+        col = self.get_column(col_id)
+        range_col_id = col_id
+        value_range = value._replace(lo=_convert_bound(col, value.lo),
+                                     hi=_convert_bound(col, value.hi))
+        continue
       if isinstance(value, lookup._Contains):
         # While users should use CONTAINS on lookup values,
         # the marker is moved to col_id so that the LookupMapColumn knows how to
@@ -543,6 +554,17 @@ class Table(object):
     col_ids = tuple(col_ids)
     key = tuple(key)
 
+    if range_col_id:
+      # Without an explicit order, results of a range lookup are sorted by the range column.
+      sort_spec = make_sort_spec(order_by, sort_by, self.has_column('manualSort')) if has_order \
+          else None
+      range_map = self._get_range_lookup_map(col_ids, range_col_id, sort_spec)
+      self._engine._profiler.lookup()
+      row_ids, rel = range_map.do_lookup(key, value_range)
+      group_by = {k: v for k, v in kwargs.items() if k != range_col_id}
+      return self.RecordSet(row_ids, rel, group_by=group_by, sort_by=sort_by,
+          sort_key=range_map.sort_key)
+
     lookup_map = self._get_lookup_map(col_ids)
     sort_spec = make_sort_spec(order_by, sort_by, self.has_column('manualSort'))
     if sort_spec:
@@ -550,6 +572,7 @@ class Table(object):
     else:
       sorted_lookup_map = lookup_map
 
+    self._engine._profiler.lookup()
     row_ids, rel = sorted_lookup_map.do_lookup(key)
     return self.RecordSet(row_ids, rel, group_by=kwargs, sort_by=sort_by,
         sort_key=sorted_lookup_map.sort_key)
@@ -557,6 +580,36 @@ class Table(object):
   def lookup_one_record(self, **kwargs):
     return self.lookup_records(**kwargs).get_one()
 
+  def lookup_row_ids_many(self, col_values, count):
+    """
+    Like lookup_records() called `count` times, with column=value arguments given by col_values,
+    which maps col_ids to lists of values. Returns a list of the lists of matching row_ids, sorted
+    by row_id. The lookup map is found or created once, and all keys are converted and looked up
+    in one pass, which is much faster for many lookups (e.g. in BulkAddOrUpdateRecord). Only plain
+    values are supported (not CONTAINS or ranges), and no dependencies are created.
+    """
+    col_ids = tuple(sorted(col_values))
+    value_lists = []
+    for col_id in col_ids:
+      col = self.get_column(col_id)
+      value_lists.append([col._convert_raw_value(col.convert(value))
+                          for value in col_values[col_id]])
+    lookup_map = self._get_lookup_map(col_ids)
+    keys = zip(*value_lists) if col_ids else itertools.repeat((), count)
+    return lookup_map.do_lookup_many(keys)
+
+  def cumulative_sum(self, rec, value_col_id, group_by, order_by):
+    """
+    Returns the sum of value_col_id over the records with the same values as rec in the group_by
+    columns, up to and including rec when sorted by order_by. It creates the necessary
+    dependencies, and maintains an index to make such running totals fast.
+    """
+    key = tuple(getattr(rec, c) for c in group_by)
+    sort_spec = make_sort_spec(order_by, None, self.has_column('manualSort'))
+    cumulative_map = self._get_cumulative_map(tuple(group_by), value_col_id, sort_spec)
+    self._engine._profiler.lookup()
+    return cumulative_map.do_cumulative_sum(key, rec._row_id)
+
   def _get_lookup_map(self, col_ids_tuple):
     """
     Helper which returns the LookupMapColumn for the given combination of lookup columns. A
@@ -586,6 +639,48 @@ class Table(object):
       self._add_special_col(helper_col)
     return helper_col
 
+  def _get_range_lookup_map(self, col_ids_tuple, range_col_id, sort_spec):
+    """
+    Helper which returns the RangeLookupMapColumn for lookups by the given equality columns and
+    range column, with results sorted by sort_spec (or by the range column if sort_spec is None).
+    """
+    if any(isinstance(c, lookup._Contains) for c in col_ids_tuple):
+      raise ValueError("CONTAINS can't be combined with a range in lookups")
+    map_col_id = "#lookup#%s#range:%s" % (":".join(col_ids_tuple), range_col_id)
+    if sort_spec is not None:
+      map_col_id += "#" + ":".join(sort_spec)
+    rmap = self._special_cols.get(map_col_id)
+    if not rmap:
+      rmap = lookup.RangeLookupMapColumn(self, map_col_id, col_ids_tuple,
+                                         range_col_id, sort_spec)
+      self._add_special_col(rmap)
+    return rmap
+
+  def _get_cumulative_map(self, col_ids_tuple, value_col_id, sort_spec):
+    """
+    Helper which returns the CumulativeMapColumn for running totals of value_col_id, over groups
+    of records with the same values in col_ids_tuple, sorted by sort_spec.
+    """
+    map_col_id = "#lookup#%s#cumsum:%s#%s" % (":".join(col_ids_tuple), value_col_id,
+                                              ":".join(sort_spec))
+    cmap = self._special_cols.get(map_col_id)
+    if not cmap:
+      cmap = lookup.CumulativeMapColumn(self, map_col_id, col_ids_tuple, value_col_id, sort_spec)
+      self._add_special_col(cmap)
+    return cmap
+
+  def _get_aggregate_map(self, group_col_id, value_col_id):
+    """
+    Helper which returns the AggregateMapColumn maintaining aggregates of value_col_id (or just
+    record counts if it's None) for each group of the summary helper column group_col_id.
+    """
+    map_col_id = "#lookup#%s#aggregate:%s" % (group_col_id, value_col_id or "")
+    amap = self._special_cols.get(map_col_id)
+    if not amap:
+      amap = lookup.AggregateMapColumn(self, map_col_id, group_col_id, value_col_id)
+      self._add_special_col(amap)
+    return amap
+
   def delete_column(self, col_obj):
     assert col_obj.table_id == self.table_id
     self._special_cols.pop(col_obj.col_id, None)
@@ -761,6 +856,12 @@ class Table(object):
       delattr(self.RecordSet, col_id)
 
 
+def _convert_bound(col, value):
+  # Converts a bound of a range used in lookups like other lookup values, leaving unbounded as is.
+  if value is lookup._Range.unbounded:
+    return value
+  return col._convert_raw_value(col.convert(value))
+
 def make_sort_spec(order_by, sort_by, has_manual_sort):
   # Note that rowId is always an automatic fallback.
   if sort_by:
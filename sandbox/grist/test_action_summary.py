@@ -0,0 +1,45 @@
+import unittest
+
+import actions
+from action_summary import ActionSummary, ColumnDelta
+
+class TestActionSummary(unittest.TestCase):
+  def test_column_delta(self):
+    delta = ColumnDelta()
+    delta.add_changes([(3, 1, 2), (1, 'a', 'a'), (2, 1.5, float('nan'))])
+    # Repeated changes keep the first 'before' value, and the last 'after' value.
+    delta.add_changes([(3, 2, 1), (1, 'a', 'b'), (4, True, 1), (5, float('nan'), float('nan')),
+                       (6, 1, 1.0), (7, [1], [1])])
+    self.assertEqual(len(delta), 9)
+    row_ids, before, after = delta.get_changed()
+    self.assertEqual(row_ids, [1, 2, 4])
+    self.assertEqual(before, ['a', 1.5, True])
+    self.assertEqual(after[0::2], ['b', 1])
+    self.assertNotEqual(after[1], after[1])
+
+  def test_column_delta_size(self):
+    # Repeated changes to the same rows get combined, so the delta doesn't keep growing.
+    delta = ColumnDelta()
+    num_rows = 1500
+    for i in range(5):
+      delta.add_changes((r, i, i + 1) for r in range(1, num_rows + 1))
+      self.assertLessEqual(len(delta), 2 * num_rows)
+    self.assertEqual(len(delta), num_rows)
+    row_ids, before, after = delta.get_changed()
+    self.assertEqual(row_ids, list(range(1, num_rows + 1)))
+    self.assertEqual((set(before), set(after)), ({0}, {5}))
+
+  def test_actions(self):
+    summary = ActionSummary()
+    summary.add_changes('Table1', 'A', [(1, 10, 11), (2, 20, 20), (3, 30, 31), (4, None, 41)])
+    summary.add_records('Table1', [4])
+    summary.remove_records('Table1', [3])
+    stored, undo = [], []
+    summary.convert_deltas_to_actions(stored, undo)
+    # Row 3 is gone, so only gets restored on undo, and row 4 is new, so isn't part of undo.
+    self.assertEqual(stored, [actions.BulkUpdateRecord('Table1', [1, 4], {'A': [11, 41]})])
+    self.assertEqual(undo, [actions.UpdateRecord('Table1', 3, {'A': 30}),
+                            actions.UpdateRecord('Table1', 1, {'A': 10})])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,127 @@
+import objtypes
+import testutil
+import test_engine
+
+
+class TestBatchFormulas(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Items", [
+        [1, "Price",    "Numeric",  False, "", "", ""],
+        [2, "Qty",      "Int",      False, "", "", ""],
+        [3, "Total",    "Numeric",  True,  "$Price * $Qty", "", ""],
+        [4, "PerUnit",  "Numeric",  True,  "$Total / $Qty", "", ""],
+        [5, "Big",      "Bool",     True,  "$Total > 10 and $Qty > 1", "", ""],
+        [6, "Name",     "Text",     True,  "rec.Qty and 'x' * $Qty", "", ""],
+      ]]
+    ],
+    "DATA": {
+      "Items": [
+        ["id", "Price", "Qty"],
+        [1,    1.5,     4],
+        [2,    20,      1],
+        [3,    2,       0],
+        [4,    "n/a",   2],
+      ]
+    }
+  })
+
+  def setUp(self):
+    super(TestBatchFormulas, self).setUp()
+    # Count the cells evaluated one at a time, to check which formulas use batch evaluation. Cells
+    # that only got as far as raising OrderError (to be evaluated later) aren't counted.
+    self.one_cell_counts = {}
+    orig_recompute_one_cell = self.engine._recompute_one_cell
+    def recompute_one_cell(table, col, row_id, **kwargs):
+      value = orig_recompute_one_cell(table, col, row_id, **kwargs)
+      if table.table_id == "Items" and not col.col_id.startswith("#"):
+        self.one_cell_counts[col.col_id] = self.one_cell_counts.get(col.col_id, 0) + 1
+      return value
+    self.engine._recompute_one_cell = recompute_one_cell
+
+  def test_batch_evaluation(self):
+    self.load_sample(self.sample)
+    div_error = objtypes.RaisedException(ZeroDivisionError())
+    type_error = objtypes.RaisedException(TypeError())
+    self.assertTableData("Items", cols="subset", data=[
+      ["id", "Total", "PerUnit", "Big", "Name"],
+      [1,    6.0,     1.5,       False, "xxxx"],
+      [2,    20.0,    20.0,      False, "x"],
+      [3,    0.0,     div_error, False, "0"],
+      [4,    type_error, type_error, type_error, "xx"],
+    ])
+
+    # Only the cells that raised errors were evaluated individually (as was "Name", whose formula
+    # uses `rec`), but formula_tracer still sees all evaluated cells.
+    self.assertEqual(self.one_cell_counts, {"PerUnit": 2, "Total": 1, "Big": 1, "Name": 4})
+    self.assertEqual(self.call_counts["Items"],
+                     {"#lookup#": 4, "Total": 4, "PerUnit": 4, "Big": 4, "Name": 4})
+
+    # Dependencies on the input columns get created, so updates propagate as usual.
+    self.one_cell_counts.clear()
+    self.call_counts.clear()
+    self.update_records("Items", ["id", "Price", "Qty"], [
+      [2, 20, 2],
+      [4, 5, 3],
+    ])
+    self.assertTableData("Items", cols="subset", data=[
+      ["id", "Total", "PerUnit", "Big", "Name"],
+      [1,    6.0,     1.5,       False, "xxxx"],
+      [2,    40.0,    20.0,      True,  "xx"],
+      [3,    0.0,     div_error, False, "0"],
+      [4,    15.0,    5.0,       True,  "xxx"],
+    ])
+    self.assertEqual(self.one_cell_counts, {"Name": 2})
+    self.assertEqual(self.call_counts["Items"], {"Total": 2, "PerUnit": 2, "Big": 2, "Name": 2})
+
+  def test_formula_changes(self):
+    self.load_sample(self.sample)
+
+    # Changing a formula to one that isn't row-local switches to the usual evaluation.
+    self.one_cell_counts.clear()
+    self.modify_column("Items", "Total", formula="$Price * $Qty if $id < 3 else max($Qty, 5)")
+    self.assertTableData("Items", cols="subset", data=[
+      ["id", "Total", "PerUnit"],
+      [1,    6.0,     1.5],
+      [2,    20.0,    20.0],
+      [3,    5.0,     objtypes.RaisedException(ZeroDivisionError())],
+      [4,    5.0,     2.5],
+    ])
+    self.assertEqual(self.one_cell_counts["Total"], 4)
+    self.assertEqual(self.one_cell_counts["PerUnit"], 1)
+
+    # A formula that refers to a missing column gets evaluated per cell, and reports the error.
+    self.one_cell_counts.clear()
+    self.modify_column("Items", "Total", formula="$Price * $Missing")
+    self.assertTableData("Items", cols="subset", data=[
+      ["id", "Total"],
+      [1,    objtypes.RaisedException(AttributeError())],
+      [2,    objtypes.RaisedException(AttributeError())],
+      [3,    objtypes.RaisedException(AttributeError())],
+      [4,    objtypes.RaisedException(AttributeError())],
+    ])
+    self.assertEqual(self.one_cell_counts["Total"], 4)
+
+    # Adding the missing column fixes it, and the batch evaluation takes over.
+    self.one_cell_counts.clear()
+    self.add_column("Items", "Missing", type="Numeric", isFormula=True, formula="2")
+    self.assertTableData("Items", cols="subset", data=[
+      ["id", "Total"],
+      [1,    3.0],
+      [2,    40.0],
+      [3,    4.0],
+      [4,    objtypes.RaisedException(TypeError())],
+    ])
+    self.assertEqual(self.one_cell_counts["Total"], 1)
+
+  def test_cache_cleanup(self):
+    # Cached batch formulas get dropped when their formulas get modified or removed.
+    self.load_sample(self.sample)
+    self.assertIn("$Price * $Qty", self.engine._batch_formulas)
+    for i in range(5):
+      self.modify_column("Items", "Total", formula="$Price * $Qty + %d" % i)
+    self.assertNotIn("$Price * $Qty", self.engine._batch_formulas)
+    self.assertEqual(sorted(f for f in self.engine._batch_formulas if f.startswith("$Price")),
+                     ["$Price * $Qty + 4"])
+    self.remove_column("Items", "PerUnit")
+    self.assertNotIn("$Total / $Qty", self.engine._batch_formulas)
@@ -0,0 +1,42 @@
+import json
+import unittest
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+  def test_make_doc(self):
+    spec = benchmark.DocSpec(rows=10, formulas=2, lookup_keys=3, summary=False, ref_chain=2)
+    sample = benchmark.make_doc(spec)
+    self.assertEqual(list(sample["DATA"]), ["Chain1", "Chain2", "Data", "Groups"])
+    self.assertEqual(sample["DATA"]["Data"].row_ids, list(range(1, 11)))
+    columns = sample["SCHEMA"]["_grist_Tables_column"].columns
+    self.assertEqual(
+      [f for (c, f) in zip(columns["colId"], columns["formula"]) if f],
+      ["$Key + $Value * 1", "$F0 + $Value * 2", "$Ref.Next.Name",
+       "len(Data.lookupRecords(Key=$Key))", "SUM(Data.lookupRecords(Key=$Key).Value)"])
+
+  def test_run_and_compare(self):
+    # Run all scenarios on tiny documents, to check that all operations work.
+    results = benchmark.run_benchmarks(benchmark.SCENARIOS, repeat=1, scale=0.001)
+    results = json.loads(json.dumps(results))
+    self.assertEqual(list(results["scenarios"]), list(benchmark.SCENARIOS))
+    for name, result in results["scenarios"].items():
+      operations = benchmark.OPERATIONS
+      if not benchmark.SCENARIOS[name].ref_chain:
+        operations = operations[:-1]
+      self.assertEqual(tuple(result["timings"]), operations)
+
+    slower = json.loads(json.dumps(results))
+    slower["scenarios"]["data"]["timings"]["calculate"] *= 2
+    rows, regressions = benchmark.compare_results(results, slower, threshold=1.5)
+    self.assertEqual(len(rows), sum(len(r["timings"]) for r in results["scenarios"].values()))
+    self.assertEqual([r[:2] for r in regressions], [("data", "calculate")])
+
+    slower["version"] = -1
+    with self.assertRaisesRegex(ValueError, "Can't compare"):
+      benchmark.compare_results(results, slower, threshold=1.5)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -209,6 +209,48 @@ return rec
       ),
     )
 
+  def test_make_batch_formula(self):
+    def cols(formula):
+      batch = codebuilder.make_batch_formula(formula)
+      return batch and batch[0]
+
+    col_ids, func = codebuilder.make_batch_formula("$Price * $Qty")
+    self.assertEqual(col_ids, ("Price", "Qty"))
+    self.assertEqual(func(1.5, 4), 6.0)
+
+    col_ids, func = codebuilder.make_batch_formula("  $A if $A > 0 else -$B # $C")
+    self.assertEqual(col_ids, ("A", "B"))
+    self.assertEqual(func(2, 3), 2)
+    self.assertEqual(func(-2, 3), -3)
+    self.assertEqual(cols("($A + 1) / 2 == $B and not $C or None"), ("A", "B", "C"))
+    self.assertEqual(cols("'x' + $A"), ("A",))
+
+    # Anything beyond attributes of the same record, constants, and operators is not supported.
+    self.assertIsNone(cols("$A.B * 2"))
+    self.assertIsNone(cols("ROUND($A)"))
+    self.assertIsNone(cols("rec.A"))
+    self.assertIsNone(cols("$A[0]"))
+    self.assertIsNone(cols("[$A]"))
+    self.assertIsNone(cols("x = $A\nreturn x"))
+    self.assertIsNone(cols("$A + DOLLARB"))
+    self.assertIsNone(cols("'$B' + $A"))
+    self.assertIsNone(cols("$A +"))
+    self.assertIsNone(cols(""))
+
+  def test_parse_summary_aggregate(self):
+    parse = codebuilder.parse_summary_aggregate
+    self.assertEqual(parse("len($group)"), ("len", None))
+    self.assertEqual(parse("SUM($group.Amount)"), ("SUM", "Amount"))
+    self.assertEqual(parse("  AVERAGE( $group.Amount )  # avg"), ("AVERAGE", "Amount"))
+    self.assertIsNone(parse("MAX(rec.group.Date)"))
+    self.assertIsNone(parse("SUM($group.Amount) + 1"))
+    self.assertIsNone(parse("SUM($group.Amount, 1)"))
+    self.assertIsNone(parse("SUM($other.Amount)"))
+    self.assertIsNone(parse("MEDIAN($group.Amount)"))
+    self.assertIsNone(parse("len($group.Amount)"))
+    self.assertIsNone(parse("SUM($group.Amount.x)"))
+    self.assertIsNone(parse("return SUM($group.Amount)"))
+
   def test_wrap_logical(self):
     self.assertEqual(make_body("IF($foo, $bar, $baz)"),
         "return IF(rec.foo, lambda: (rec.bar), lambda: (rec.baz))")
@@ -0,0 +1,157 @@
+import logging
+import unittest
+
+import column
+import column_storage
+import objtypes
+import testutil
+import test_engine
+
+log = logging.getLogger(__name__)
+
+
+class TestTypedColumnData(unittest.TestCase):
+  def test_float_data(self):
+    data = column_storage.make_float_data([1.5, None, "foo", 2.0])
+    self.assertEqual(len(data), 4)
+    self.assertEqual(list(data), [1.5, None, "foo", 2.0])
+
+    # Overwriting values in either direction keeps the side-table in sync.
+    data[1] = 3.0
+    data[3] = "bar"
+    data[2] = None
+    self.assertEqual(list(data), [1.5, 3.0, None, "bar"])
+
+    # Types are preserved exactly: ints and bools are not floats, so are stored as they are.
+    data[0] = 5
+    data[1] = True
+    self.assertIs(type(data[0]), int)
+    self.assertIs(data[1], True)
+
+    with self.assertRaises(IndexError):
+      data[4]     # pylint: disable=pointless-statement
+    with self.assertRaises(IndexError):
+      data[4] = 1.0
+
+    data.growto(6, 0.0)
+    self.assertEqual(list(data)[4:], [0.0, 0.0])
+    data.growto(8, None)
+    self.assertEqual(list(data)[6:], [None, None])
+    data.growto(3, None)    # No-op, since it never shrinks.
+    self.assertEqual(len(data), 8)
+
+  def test_bool_and_int_data(self):
+    data = column_storage.make_bool_data([True, False, None, 1])
+    self.assertEqual([(type(v), v) for v in data],
+                     [(bool, True), (bool, False), (type(None), None), (int, 1)])
+
+    data = column_storage.make_int_data([0, 17, -(1<<31), 1<<31, True, 1.0])
+    self.assertEqual([(type(v), v) for v in data],
+                     [(int, 0), (int, 17), (int, -(1<<31)), (int, 1<<31), (bool, True),
+                      (float, 1.0)])
+
+  def test_copy(self):
+    data = column_storage.make_float_data([1.0, "x", None])
+    copy = data.copy()
+    self.assertTrue(data.is_compatible(copy))
+    self.assertFalse(data.is_compatible(column_storage.make_int_data()))
+    self.assertFalse(data.is_compatible([1.0]))
+    copy[0] = "y"
+    copy[1] = 2.0
+    self.assertEqual(list(data), [1.0, "x", None])
+    self.assertEqual(list(copy), ["y", 2.0, None])
+
+
+class TestColumnStorage(test_engine.EngineTestCase):
+  def test_column_values(self):
+    # Check that columns using typed storage behave the same as list-backed ones, including
+    # values of wrong types, and after operations that copy column data (renames).
+    self.load_sample(testutil.parse_test_sample({
+      "SCHEMA": [
+        [1, "Table1", [
+          [1, "Num", "Numeric", False, "", "", ""],
+          [2, "Int", "Int", False, "", "", ""],
+          [3, "Flag", "Bool", False, "", "", ""],
+          [4, "Day", "Date", False, "", "", ""],
+          [5, "Calc", "Numeric", True, "$Num / $Int", "", ""],
+        ]]
+      ],
+      "DATA": {
+        "Table1": [
+          ["id", "Num", "Int", "Flag", "Day"],
+          [1,    1.5,   2,     True,   86400],
+          [2,    "x",   0,     0,      None],
+          [4,    None,  None,  "y",    "z"],
+        ]
+      }
+    }))
+    table = self.engine.tables["Table1"]
+    for col_id in ("id", "Num", "Int", "Flag", "Day", "Calc"):
+      self.assertIsInstance(table.get_column(col_id), column.TypedArrayColumn)
+
+    expected = [
+      ["id", "Num", "Int", "Flag", "Day", "Calc"],
+      [1,    1.5,   2,     True,   86400.0, 0.75],
+      [2,    "x",   0,     False,  None,  objtypes.RaisedException(TypeError())],
+      [4,    None,  None,  "y",    "z",   objtypes.RaisedException(TypeError())],
+    ]
+    self.assertTableData("Table1", data=expected)
+    self.assertEqual(table.get_column("Num").raw_get(3), 0.0)
+    self.assertEqual(table.get_column("Num").raw_get(100), 0.0)
+    self.assertEqual(list(table.row_ids), [1, 2, 4])
+
+    self.apply_user_action(["RenameColumn", "Table1", "Num", "Num2"])
+    self.apply_user_action(["RenameTable", "Table1", "Table2"])
+    expected[0] = ["id", "Num2", "Int", "Flag", "Day", "Calc"]
+    self.assertTableData("Table2", data=expected)
+
+    self.update_record("Table2", 2, Num2=3, Int=3)
+    self.assertTableData("Table2", cols="subset", rows="subset", data=[
+      ["id", "Num2", "Int", "Calc"],
+      [2,    3.0,    3,     1.0],
+    ])
+
+  def test_memory_usage(self):
+    # Report the memory used per column type, and check that typed storage is actually compact.
+    num_rows = 10000
+    col_types = ["Numeric", "Int", "Bool", "Date", "DateTime:UTC", "Text", "Any"]
+    self.load_sample(testutil.parse_test_sample({
+      "SCHEMA": [
+        [1, "Table1", [
+          [i + 1, "c%d" % i, col_type, False, "", "", ""] for i, col_type in enumerate(col_types)
+        ]]
+      ],
+      "DATA": {}
+    }))
+    values = {
+      "Numeric": lambda r: r * 1.5,
+      "Int": lambda r: r,
+      "Bool": lambda r: r % 2 == 0,
+      "Date": lambda r: r * 86400.0,
+      "DateTime:UTC": lambda r: r * 3600.0,
+      "Text": lambda r: "row %d" % r,
+      "Any": lambda r: r * 1.5,
+    }
+    self.add_records("Table1", ["c%d" % i for i in range(len(col_types))],
+                     [[values[t](r) for t in col_types] for r in range(num_rows)])
+
+    table = self.engine.tables["Table1"]
+    usage = {"id": table.get_column("id").get_memory_usage() / num_rows}
+    for i, col_type in enumerate(col_types):
+      usage[col_type] = table.get_column("c%d" % i).get_memory_usage() / num_rows
+
+    log.info("Memory per cell by column type (%d rows):\n%s", num_rows,
+             "\n".join("  %-14s %6.1f bytes" % item for item in sorted(usage.items())))
+
+    # A list of boxed floats costs over 30 bytes per cell (as for the "Any" column here).
+    self.assertGreater(usage["Any"], 30)
+    self.assertLess(usage["Numeric"], 10)
+    self.assertLess(usage["Date"], 10)
+    self.assertLess(usage["DateTime:UTC"], 10)
+    self.assertLess(usage["Int"], 6)
+    self.assertLess(usage["id"], 6)
+    self.assertLess(usage["Bool"], 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,133 @@
+import array
+import marshal
+import sys
+
+import actions
+import column
+import columnar
+import objtypes
+import testutil
+import test_engine
+
+
+class TestColumnar(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Table1", [
+        [1, "Num",    "Numeric",  False, "", "", ""],
+        [2, "Int",    "Int",      False, "", "", ""],
+        [3, "Flag",   "Bool",     False, "", "", ""],
+        [4, "Day",    "Date",     False, "", "", ""],
+        [5, "Name",   "Text",     False, "", "", ""],
+        [6, "Tags",   "ChoiceList", False, "", "", ""],
+        [7, "Ref",    "Ref:Table1", False, "", "", ""],
+        [8, "Calc",   "Numeric",  True,  "$Num / $Int", "", ""],
+        [9, "Pos",    "PositionNumber", False, "", "", ""],
+      ]]
+    ],
+    "DATA": {
+      "Table1": [
+        ["id", "Num", "Int", "Flag", "Day",  "Name", "Tags",       "Ref", "Pos"],
+        [1,    1.5,   2,     True,   86400,  "foo",  ["a"],        2,     1.0],
+        [2,    "x",   0,     False,  None,   "bar",  None,         0,     3.0],
+        [3,    None,  None,  "y",    "z",    "foo",  ["a", "b"],   1,     2.0],
+        [4,    -2.0,  7,     False,  0,      17,     None,         3,     0.5],
+      ]
+    }
+  })
+
+  def _roundtrip(self, table_id, **kwargs):
+    # Encode and decode data the way it would be transferred, i.e. through marshal.
+    encoded = self.engine.fetch_table_columnar(table_id, **kwargs)
+    return columnar.decode_table(marshal.loads(marshal.dumps(encoded, 2)))
+
+  def test_encode(self):
+    self.load_sample(self.sample)
+    encoded = self.engine.fetch_table_columnar("Table1")
+    self.assertEqual(encoded["format"], columnar.FORMAT)
+    self.assertEqual(encoded["row_ids"].tolist(), [1, 2, 3, 4])
+    self.assertEqual({c: enc["kind"] for c, enc in encoded["columns"].items()}, {
+      "Num": "f64", "Int": "i32", "Flag": "bool", "Day": "f64", "Name": "text", "Tags": "list",
+      "Ref": "list", "Calc": "f64", "Pos": "f64",
+    })
+
+    # For contiguous row_ids, typed columns are sent as slices of the arrays that store them.
+    num = encoded["columns"]["Num"]
+    self.assertIsInstance(num["data"], array.array)
+    self.assertEqual(num["data"].tolist()[0], 1.5)
+    self.assertEqual(num["other_pos"].tolist(), [1, 2])
+    self.assertEqual(num["other_values"], ["x", None])
+    name = encoded["columns"]["Name"]
+    self.assertEqual(name["strings"], ["foo", "bar"])
+    self.assertEqual(name["codes"].tolist(), [0, 1, 0, -1])
+    self.assertEqual(name["other_values"], [17])
+    self.assertEqual(encoded["columns"]["Calc"]["other_pos"].tolist(), [1, 2])
+    self.assertEqual(encoded["columns"]["Calc"]["other_values"], [['E', 'TypeError']] * 2)
+    self.assertEqual(encoded["columns"]["Tags"]["values"],
+                     [["L", "a"], None, ["L", "a", "b"], None])
+
+    # The result doesn't change with the table, and doesn't prevent it from growing.
+    self.add_record("Table1", Num=4.5)
+    self.update_record("Table1", 1, Num=2.5)
+    self.assertEqual(num["data"].tolist()[0], 1.5)
+    self.assertEqual(len(num["data"]), 4)
+
+    # Non-contiguous rows, and queries, get copied.
+    self.remove_record("Table1", 2)
+    encoded = self.engine.fetch_table_columnar("Table1", query={"Int": [2, 7]})
+    self.assertEqual(encoded["row_ids"].tolist(), [1, 4])
+    self.assertIsInstance(encoded["columns"]["Num"]["data"], array.array)
+    self.assertEqual(encoded["columns"]["Num"]["data"].tolist(), [2.5, -2.0])
+    self.assertEqual(encoded["columns"]["Day"]["other_pos"].tolist(), [])
+
+  def test_roundtrip(self):
+    self.load_sample(self.sample)
+    expected = self.engine.fetch_table("Table1")
+    for query in (None, {"Flag": [False]}):
+      table_data = self._roundtrip("Table1", query=query)
+      self.assertEqual(actions.get_action_repr(table_data),
+                       actions.get_action_repr(self.engine.fetch_table("Table1", query=query)))
+
+    # Load the data back, as a document would get loaded. Typed columns get loaded in bulk.
+    table_data = self._roundtrip("Table1", formulas=False)
+    self.assertIsInstance(table_data.columns["Num"], columnar.PackedValues)
+    self.engine.load_table(table_data)
+    self.apply_user_action(['Calculate'])
+    self.assertEqual(actions.get_action_repr(self.engine.fetch_table("Table1")),
+                     actions.get_action_repr(expected))
+    table = self.engine.tables["Table1"]
+    self.assertIsInstance(table.get_column("Num"), column.TypedArrayColumn)
+    self.assertEqual(table.get_column("Day").get_cell_value(1),
+                     objtypes.decode_object(['d', 86400]))
+    self.assertEqual(list(table.get_column("Pos")._sorted_rows), [4, 1, 3, 2])
+
+    # The loaded data can be updated normally.
+    self.update_record("Table1", 2, Num=4, Int=2, Pos=0.25)
+    self.assertTableData("Table1", cols="subset", rows="subset", data=[
+      ["id", "Num", "Int", "Calc"],
+      [2,    4.0,   2,     2.0],
+    ])
+    self.assertEqual(list(table.get_column("Pos")._sorted_rows), [2, 4, 1, 3])
+
+  def test_load_other_byteorder(self):
+    self.load_sample(self.sample)
+    encoded = self.engine.fetch_table_columnar("Table1", formulas=False)
+    expected = actions.get_action_repr(self.engine.fetch_table("Table1", formulas=False))
+
+    # Simulate data produced on a machine with the other byte order.
+    def swap(buf):
+      swapped = array.array(buf.typecode, buf)
+      swapped.byteswap()
+      return swapped.tobytes()
+
+    encoded["byteorder"] = "big" if sys.byteorder == "little" else "little"
+    encoded["row_ids"] = swap(encoded["row_ids"])
+    for enc in encoded["columns"].values():
+      for key in ("data", "codes", "other_pos"):
+        if key in enc:
+          enc[key] = swap(enc[key])
+    table_data = columnar.decode_table(encoded)
+    self.assertEqual(actions.get_action_repr(table_data), expected)
+
+    with self.assertRaisesRegex(ValueError, "Unsupported columnar format"):
+      columnar.decode_table(dict(encoded, format="foo"))
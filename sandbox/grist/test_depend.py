@@ -1,3 +1,7 @@
+import unittest
+
+import depend
+import relation
 import testutil
 import test_engine
 
@@ -42,3 +46,161 @@ class TestDependencies(test_engine.EngineTestCase):
       [3,    3,       16],
       [3200, 3200,    5121610],
     ])
+
+
+class TestIncrementalInvalidation(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Source", [
+        [1, "Key",        "Int",         False, "", "", ""],
+        [2, "Value",      "Numeric",     True, "$Key * 10", "", ""],
+      ]],
+      [2, "Target", [
+        [11, "Key",       "Int",         False, "", "", ""],
+        [12, "Use",       "Bool",        False, "", "", ""],
+        [13, "Found",     "Any",         True,
+         "Source.lookupOne(Key=$Key).Value if $Use else None", "", ""],
+        [14, "Plus",      "Any",         True, "($Found or 0) + 1", "", ""],
+        [15, "Other",     "Any",         True, "$Key * 2", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Source": [
+        ["id", "Key"],
+        [1,    1],
+        [2,    2],
+        [3,    3],
+      ],
+      "Target": [
+        ["id", "Key", "Use"],
+        [1,    1,     True],
+        [2,    2,     False],
+        [3,    3,     False],
+        [4,    3,     True],
+      ],
+    }
+  })
+
+  def _modify_formula(self, incremental):
+    self.load_sample(self.sample)
+    self.engine.set_incremental_invalidation(incremental)
+    self.assertTableData("Target", cols="subset", data=[
+      ["id", "Found", "Plus", "Other"],
+      [1,    10,      11,     2],
+      [2,    None,    1,      4],
+      [3,    None,    1,      6],
+      [4,    30,      31,     6],
+    ])
+
+    self.call_counts.clear()
+    self.modify_column("Source", "Value", formula="$Key * 100")
+    self.assertTableData("Target", cols="subset", data=[
+      ["id", "Found", "Plus", "Other"],
+      [1,    100,     101,    2],
+      [2,    None,    1,      4],
+      [3,    None,    1,      6],
+      [4,    300,     301,    6],
+    ])
+
+    # Changing the formula back and forth keeps giving correct results.
+    self.modify_column("Source", "Value", formula="$Key * 10")
+    self.update_record("Source", 3, Key=4)
+    self.assertTableData("Target", cols="subset", data=[
+      ["id", "Found", "Plus"],
+      [1,    10.0,    11.0],
+      [2,    None,    1],
+      [3,    None,    1],
+      [4,    0.0,     1.0],
+    ])
+
+  def test_classic_invalidation(self):
+    # By default, a changed formula causes all dependent columns to get recomputed in full.
+    self._modify_formula(incremental=False)
+
+  def test_incremental_invalidation(self):
+    self._modify_formula(incremental=True)
+
+  def test_call_counts(self):
+    # Only the rows that actually looked up the changed column get recomputed in incremental mode.
+    for incremental, expected in [(False, 4), (True, 2)]:
+      self.load_sample(self.sample)
+      self.engine.set_incremental_invalidation(incremental)
+      self.call_counts.clear()
+      self.modify_column("Source", "Value", formula="$Key * 100")
+      self.assertEqual(self.call_counts, {
+        "Source": {"Value": 3},
+        "Target": {"Found": expected, "Plus": expected},
+      })
+
+  def test_changed_dependent_formula(self):
+    # A dependent whose own formula changes (while reached incrementally) starts from scratch.
+    self.load_sample(self.sample)
+    self.engine.set_incremental_invalidation(True)
+    self.apply_user_action(["BulkUpdateRecord", "_grist_Tables_column", [2, 13], {
+      "formula": ["$Key * 100", "Source.lookupOne(Key=$Key).Value"],
+    }])
+    self.assertTableData("Target", cols="subset", data=[
+      ["id", "Found", "Plus"],
+      [1,    100,     101],
+      [2,    200,     201],
+      [3,    300,     301],
+      [4,    300,     301],
+    ])
+    self.update_record("Source", 2, Key=5)
+    self.assertTableData("Target", cols="subset", data=[
+      ["id", "Found", "Plus"],
+      [1,    100.0,   101.0],
+      [2,    0.0,     1.0],
+      [3,    300.0,   301.0],
+      [4,    300.0,   301.0],
+    ])
+
+
+class TestGraph(unittest.TestCase):
+  def test_edges(self):
+    graph = depend.Graph()
+    a, b, c = depend.Node("T", "A"), depend.Node("T", "B"), depend.Node("U", "C")
+    ident = relation.IdentityRelation("T")
+    ref = relation.ReferenceRelation("T", "U", "Ref")
+
+    self.assertTrue(graph.add_edge(a, b, ident))
+    self.assertTrue(graph.add_edge(a, c, ref))
+    self.assertTrue(graph.add_edge(b, c, ref))
+    self.assertFalse(graph.add_edge(a, b, ident))
+    self.assertEqual(sorted(graph.iter_edges(), key=str), [
+      depend.Edge(a, b, ident), depend.Edge(a, c, ref), depend.Edge(b, c, ref)])
+    self.assertEqual(graph.get_in_nodes(a), {b, c})
+    stats = graph.get_stats()
+    self.assertEqual((stats["nodes"], stats["edges"], stats["relations"]), (3, 3, 2))
+
+    # Invalidation follows the edges through their relations.
+    ref.add_reference(7, 70)
+    recompute_map = {}
+    graph.invalidate_deps(c, [70], recompute_map, include_self=False)
+    self.assertEqual({node: list(rows) for node, rows in recompute_map.items()}, {a: [7], b: [7]})
+
+    # Removing edges releases relations no longer used, and a node with dependents stays.
+    self.assertFalse(graph.remove_node_if_unused(b))
+    graph.clear_dependencies(b)
+    self.assertEqual(graph.get_stats()["edges"], 2)
+    graph.clear_dependencies(a)
+    self.assertEqual(list(graph.iter_edges()), [])
+    self.assertEqual(graph.get_stats()["relations"], 0)
+    self.assertTrue(graph.remove_node_if_unused(b))
+
+    # Nodes without edges are released too.
+    self.assertEqual(graph.get_stats()["nodes"], 0)
+
+    # Ids of released relations and nodes get reused.
+    ident2 = relation.IdentityRelation("U")
+    self.assertTrue(graph.add_edge(c, b, ident2))
+    self.assertEqual(list(graph.iter_edges()), [depend.Edge(c, b, ident2)])
+    self.assertEqual(graph.get_in_nodes(c), {b})
+    self.assertEqual(graph.get_stats()["nodes"], 2)
+    self.assertEqual(len(graph._nodes), 3)    # pylint:disable=protected-access
+
+    # A node that depends on itself is released once its dependencies are cleared.
+    self.assertTrue(graph.add_edge(a, a, ident))
+    graph.clear_dependencies(a)
+    self.assertEqual(graph.get_in_nodes(a), set())
+    self.assertEqual(graph.get_stats()["nodes"], 2)
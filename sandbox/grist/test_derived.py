@@ -77,7 +77,8 @@ class TestDerived(test_engine.EngineTestCase):
         actions.BulkUpdateRecord("Orders", [1,2], {'amount': [14, 14]}),
         actions.BulkUpdateRecord("Orders_summary_year", [1,2], {'amount': [14, 29]})
       ],
-      "calls": {"Orders_summary_year": {"amount": 2}}
+      "calls": {"Orders_summary_year": {"amount": 2},
+                "Orders": {"#lookup##summary#Orders_summary_year#aggregate:amount": 2}}
     })
 
     # Changing a record from one product to another should cause the two affected lines to change.
@@ -91,7 +92,9 @@ class TestDerived(test_engine.EngineTestCase):
       ],
       "calls": {"Orders_summary_year": {"group": 2, "amount": 2, "count": 2},
                 "Orders": {"#lookup##summary#Orders_summary_year": 1,
-                           "#summary#Orders_summary_year": 1}}
+                           "#summary#Orders_summary_year": 1,
+                           "#lookup##summary#Orders_summary_year#aggregate:": 1,
+                           "#lookup##summary#Orders_summary_year#aggregate:amount": 1}}
     })
 
     self.assertPartialData("Orders_summary_year", ["id", "year", "count", "amount", "group" ], [
@@ -116,7 +119,9 @@ class TestDerived(test_engine.EngineTestCase):
           '#lookup#year': 1, "group": 2, "amount": 2, "count": 2, "#lookup#": 1
         },
         "Orders": {"#lookup##summary#Orders_summary_year": 1,
-                   "#summary#Orders_summary_year": 1}}
+                   "#summary#Orders_summary_year": 1,
+                   "#lookup##summary#Orders_summary_year#aggregate:": 1,
+                   "#lookup##summary#Orders_summary_year#aggregate:amount": 1}}
     })
 
     self.assertPartialData("Orders_summary_year", ["id", "year", "count", "amount", "group" ], [
@@ -314,6 +319,8 @@ class TestDerived(test_engine.EngineTestCase):
         },
         "Orders": {
           "#lookup##summary#Orders_summary_year": 1, "#summary#Orders_summary_year": 1,
+          "#lookup##summary#Orders_summary_year#aggregate:": 1,
+          "#lookup##summary#Orders_summary_year#aggregate:amount": 1,
         },
       },
     })
@@ -586,6 +586,102 @@ class TestEngine(EngineTestCase):
           [ 22,   "Albany",   "NY"   , 2, 2],
         ])})
 
+  def test_fetch_table_chunk(self):
+    self.load_sample(testutil.parse_test_sample(self.sample1))
+    self.add_records('Address', ['city', 'state', 'amount'], [
+      ['Buffalo', 'NY', 3],
+      ['Boston', 'MA', 4],
+      ['Rochester', 'NY', 5],
+    ])
+    self.remove_record('Address', 22)
+
+    def fetch_all(**kwargs):
+      # Fetch all chunks, returning the row IDs of each one.
+      chunks = []
+      start_row_id = 0
+      while start_row_id is not None:
+        data, start_row_id = self.engine.fetch_table_chunk('Address', start_row_id=start_row_id,
+                                                           **kwargs)
+        chunks.append(data.row_ids)
+      return chunks
+
+    self.assertEqual(fetch_all(limit=2), [[21, 23], [24, 25]])
+    self.assertEqual(fetch_all(limit=4), [[21, 23, 24, 25]])
+    self.assertEqual(fetch_all(limit=1, query={'state': ['NY']}), [[21], [23], [25]])
+    self.assertEqual(fetch_all(query={'state': ['CA']}), [[]])
+    self.assertEqual(fetch_all(limit=None), [[21, 23, 24, 25]])
+    for limit in (0, -1):
+      with self.assertRaisesRegex(ValueError, "Invalid limit"):
+        self.engine.fetch_table_chunk('Address', limit=limit)
+
+    # Columns may be selected, and the values match those of fetch_table.
+    data, next_row_id = self.engine.fetch_table_chunk('Address', col_ids=['amount'],
+                                                      start_row_id=22, limit=2)
+    self.assertEqual(next_row_id, 25)
+    self.assertEqual(data.row_ids, [23, 24])
+    self.assertEqual(data.columns, {'amount': [3.0, 4.0]})
+    data, next_row_id = self.engine.fetch_table_chunk('Address')
+    self.assertEqual(next_row_id, None)
+    self.assertEqual(actions.get_action_repr(data),
+                     actions.get_action_repr(self.engine.fetch_table('Address')))
+
+    with self.assertRaisesRegex(KeyError, "Table Address has no column foo"):
+      self.engine.fetch_table_chunk('Address', col_ids=['amount', 'foo'])
+
+    # Columns that wouldn't be fetched otherwise can't be selected either.
+    self.add_column('Address', 'double', formula='$amount * 2')
+    data, _ = self.engine.fetch_table_chunk('Address', col_ids=['double'], limit=1)
+    self.assertEqual(data.columns, {'double': [2.0]})
+    with self.assertRaisesRegex(KeyError, "Column double of table Address can't be fetched"):
+      self.engine.fetch_table_chunk('Address', col_ids=['double'], formulas=False)
+    with self.assertRaisesRegex(KeyError, "Column columns of table _grist_Tables can't be"):
+      self.engine.fetch_table_chunk('_grist_Tables', col_ids=['tableId', 'columns'])
+    data, _ = self.engine.fetch_table_chunk('_grist_Tables', col_ids=['tableId', 'columns'],
+                                            private=True)
+    self.assertEqual(data.columns['tableId'], ['Address'])
+
+  def test_fetch_table_indexed_query(self):
+    self.load_sample(testutil.parse_test_sample(self.sample1))
+    self.add_records('Address', ['city', 'state', 'amount'], [
+      ['Buffalo', 'NY', 3],
+      ['Boston', 'MA', 4],
+    ])
+    indexed = []
+    orig_get_indexed_rows = self.engine._get_indexed_rows
+    def get_indexed_rows(table, col, values):
+      result = orig_get_indexed_rows(table, col, values)
+      indexed.append((col.col_id, result))
+      return result
+    self.engine._get_indexed_rows = get_indexed_rows
+
+    def fetch_row_ids(query):
+      del indexed[:]
+      return self.engine.fetch_table('Address', query=query).row_ids
+
+    # Without a lookup on the column, there is no index to use.
+    self.assertEqual(fetch_row_ids({'state': ['NY']}), [21, 22, 23])
+    self.assertEqual(indexed, [('state', None)])
+
+    # Lookups by state create an index, which gets used, and stays up to date.
+    self.add_column('Address', 'sameState', type='Any', isFormula=True,
+                    formula='len(Address.lookupRecords(state=$state))')
+    self.assertEqual(fetch_row_ids({'state': ['NY']}), [21, 22, 23])
+    self.assertEqual(indexed, [('state', {21, 22, 23})])
+    self.update_record('Address', 22, state='MA')
+    self.assertEqual(fetch_row_ids({'state': ['MA', 'CA']}), [22, 24])
+    self.assertEqual(indexed, [('state', {22, 24})])
+    self.assertEqual(fetch_row_ids({'state': ['NY', 'MA'], 'city': ['Boston', 'Buffalo']}),
+                     [23, 24])
+
+    # The index is not used for values of the wrong type, which it may not map correctly.
+    self.assertEqual(fetch_row_ids({'state': [17]}), [])
+    self.assertEqual(indexed, [('state', None)])
+
+    # Chunks use the index too.
+    data, next_row_id = self.engine.fetch_table_chunk('Address', query={'state': ['NY', 'MA']},
+                                                      start_row_id=22, limit=1)
+    self.assertEqual((data.row_ids, next_row_id), ([22], 23))
+
   def test_schema_restore_on_error(self):
     # Simulate an error inside a DocAction, and make sure we restore the schema (don't leave it in
     # inconsistent with metadata).
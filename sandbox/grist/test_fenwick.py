@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from fenwick import FenwickTree
+
+class TestFenwickTree(unittest.TestCase):
+  def assertPrefixSums(self, tree, values):
+    self.assertEqual(len(tree), len(values))
+    self.assertEqual([tree.prefix_sum(i) for i in range(len(values) + 1)],
+                     [sum(values[:i]) for i in range(len(values) + 1)])
+
+  def test_prefix_sums(self):
+    self.assertPrefixSums(FenwickTree(), [])
+    values = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+    tree = FenwickTree(values)
+    self.assertPrefixSums(tree, values)
+
+    tree.set(0, 10)
+    tree.set(7, -6)
+    values[0], values[7] = 10, -6
+    self.assertPrefixSums(tree, values)
+
+    tree.append(8)
+    tree.append(-1)
+    self.assertEqual(tree.pop(), -1)
+    values.append(8)
+    self.assertPrefixSums(tree, values)
+
+  def test_history_independent(self):
+    # A tree changed in any way should have exactly the same sums as one built from its values.
+    rand = random.Random(17)
+    values = [rand.uniform(-1e6, 1e6) for _ in range(100)]
+    tree = FenwickTree(values)
+    for _ in range(500):
+      op = rand.random()
+      if op < 0.6 and values:
+        i = rand.randrange(len(values))
+        values[i] = rand.uniform(-1e6, 1e6)
+        tree.set(i, values[i])
+      elif op < 0.8:
+        values.append(rand.uniform(-1e6, 1e6))
+        tree.append(values[-1])
+      elif values:
+        self.assertEqual(tree.pop(), values.pop())
+
+    expected = FenwickTree(values)
+    self.assertEqual([tree.prefix_sum(i) for i in range(len(values) + 1)],
+                     [expected.prefix_sum(i) for i in range(len(values) + 1)])
+
+
+if __name__ == "__main__":
+  unittest.main()
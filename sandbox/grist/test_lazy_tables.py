@@ -0,0 +1,141 @@
+import testutil
+import test_engine
+
+
+class TestLazyTables(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Projects", [
+        [1, "Name",       "Text",         False, "", "", ""],
+        [2, "Budget",     "Numeric",      False, "", "", ""],
+        [3, "Hours",      "Numeric",      True,
+         "SUM(Tasks.lookupRecords(Project=$id).Hours)", "", ""],
+      ]],
+      [2, "Tasks", [
+        [11, "Project",   "Ref:Projects", False, "", "", ""],
+        [12, "Hours",     "Numeric",      False, "", "", ""],
+      ]],
+      [3, "Report", [
+        [21, "Project",   "Text",         False, "", "", ""],
+        [22, "Budget",    "Numeric",      True,
+         "Projects.lookupOne(Name=$Project).Budget", "", ""],
+      ]],
+      [4, "Archive", [
+        [31, "Note",      "Text",         False, "", "", ""],
+        [32, "Length",    "Int",          True,  "len($Note)", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Projects": [
+        ["id", "Name",  "Budget"],
+        [1,    "Alpha", 100],
+        [2,    "Beta",  200],
+      ],
+      "Tasks": [
+        ["id", "Project", "Hours"],
+        [1,    1,         2],
+        [2,    1,         3],
+        [3,    2,         4],
+      ],
+      # Formula values are included, as stored in the document.
+      "Report": [
+        ["id", "Project", "Budget"],
+        [1,    "Beta",    200],
+      ],
+      "Archive": [
+        ["id", "Note",  "Length"],
+        [1,    "old",   3],
+        [2,    "older", 5],
+      ],
+    }
+  })
+
+  def load_lazily(self, lazy_table_ids):
+    # Like load_sample(), but registers the given tables to be loaded lazily.
+    self.loaded = []
+    def make_load_func(data):
+      def load_func():
+        self.loaded.append(data.table_id)
+        return data
+      return load_func
+
+    schema = self.sample["SCHEMA"]
+    self.engine.load_meta_tables(schema['_grist_Tables'], schema['_grist_Tables_column'])
+    for table_id, data in self.sample["DATA"].items():
+      if table_id in lazy_table_ids:
+        self.engine.register_lazy_table(table_id, len(data.row_ids), make_load_func(data))
+      else:
+        self.engine.load_table(data)
+    self.apply_user_action(['Calculate'])
+
+  def test_load_on_access(self):
+    self.load_lazily({"Tasks", "Report", "Archive"})
+
+    # Formulas in Projects need Tasks, so it got loaded, but not the other tables, whose formulas
+    # didn't get computed.
+    self.assertEqual(self.loaded, ["Tasks"])
+    self.assertEqual(self.call_counts, {
+      "Projects": {"#lookup#": 2, "Hours": 2},
+      "Tasks": {"#lookup#": 3, "#lookup#Project": 3},
+    })
+    self.assertTableData("Projects", cols="subset", data=[
+      ["id", "Name",  "Hours"],
+      [1,    "Alpha", 5.0],
+      [2,    "Beta",  4.0],
+    ])
+    self.assertEqual(self.engine.count_rows(), {"total": 8, 1: 2, 2: 3, 3: 1, 4: 2})
+
+    # Fetching a table loads it, and computes its formulas like on a normal open.
+    self.call_counts.clear()
+    self.assertEqual(self.engine.fetch_table("Archive").row_ids, [1, 2])
+    self.assertEqual(self.loaded, ["Tasks", "Archive"])
+    self.apply_user_action(['Calculate'])
+    self.assertEqual(self.call_counts, {"Archive": {"#lookup#": 2, "Length": 2}})
+    self.assertTableData("Archive", data=[
+      ["id", "Note",  "Length"],
+      [1,    "old",   3],
+      [2,    "older", 5],
+    ])
+
+    # Changing a table's records loads it first.
+    self.call_counts.clear()
+    self.update_record("Report", 1, Project="Alpha")
+    self.assertEqual(self.loaded, ["Tasks", "Archive", "Report"])
+    self.assertTableData("Report", data=[
+      ["id", "Project", "Budget"],
+      [1,    "Alpha",   100.0],
+    ])
+    self.assertEqual(self.call_counts, {
+      "Report": {"#lookup#": 1, "Budget": 1},
+      "Projects": {"#lookup#Name": 2},
+    })
+
+  def test_load_dependents(self):
+    self.load_lazily({"Report", "Archive"})
+    self.assertEqual(self.loaded, [])
+
+    # Changes to Projects may affect formulas in Report, so it gets loaded, and recomputed
+    # correctly. Archive doesn't depend on Projects, and stays unloaded.
+    self.update_record("Projects", 2, Budget=250)
+    self.assertEqual(self.loaded, ["Report"])
+    self.assertTableData("Report", data=[
+      ["id", "Project", "Budget"],
+      [1,    "Beta",    250.0],
+    ])
+
+    # Schema changes may affect anything, so load all remaining tables.
+    self.add_column("Tasks", "Note", type="Text")
+    self.assertEqual(self.loaded, ["Report", "Archive"])
+    self.assertTableData("Archive", cols="subset", data=[
+      ["id", "Length"],
+      [1,    3],
+      [2,    5],
+    ])
+
+  def test_table_sources(self):
+    self.load_lazily(set())
+    sources = self.engine._get_table_sources()
+    self.assertEqual(sources["Projects"], {"Tasks"})
+    self.assertEqual(sources["Tasks"], {"Projects"})
+    self.assertEqual(sources["Report"], {"Projects", "Tasks"})
+    self.assertEqual(sources["Archive"], set())
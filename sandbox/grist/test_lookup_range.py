@@ -0,0 +1,152 @@
+import datetime
+
+import moment
+import testutil
+import test_engine
+
+def D(year, month, day):
+  return moment.date_to_ts(datetime.date(year, month, day))
+
+class TestLookupRange(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Accounts", [
+        [1, "Name",     "Text",     False, "", "", ""],
+        [2, "Recent",   "Any",      True,
+         "Tx.lookupRecords(Account=$id, Date=GT(DATE(2024,1,2))).id", "", ""],
+      ]],
+      [2, "Tx", [
+        [11, "Account", "Ref:Accounts", False, "", "", ""],
+        [12, "Date",    "Date",     False, "", "", ""],
+        [13, "Amount",  "Numeric",  False, "", "", ""],
+        [14, "Balance", "Numeric",  True,
+         "SUM(Tx.lookupRecords(Account=$Account, Date=LE($Date)).Amount)", "", ""],
+        [15, "Nearby",  "Any",      True,
+         "if $Date:\n"
+         "  return Tx.lookupRecords(Date=BETWEEN($Date, DATEADD($Date, days=1)),\n"
+         "                          order_by='-Amount').id", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Accounts": [
+        ["id", "Name"],
+        [1,    "Cash"],
+        [2,    "Bank"],
+      ],
+      "Tx": [
+        ["id", "Account", "Date",         "Amount"],
+        [1,    1,         D(2024,1,1),    10],
+        [2,    1,         D(2024,1,3),    20],
+        [3,    2,         D(2024,1,2),    5],
+        [4,    1,         D(2024,1,5),    1],
+        [5,    1,         None,           100],
+      ],
+    }
+  })
+
+  def test_range_lookups(self):
+    self.load_sample(self.sample)
+    self.assertTableData("Tx", cols="subset", data=[
+      ["id", "Balance", "Nearby"],
+      [1,    10,        [1, 3]],
+      [2,    30,        [2]],
+      [3,    5,         [2, 3]],
+      [4,    31,        [4]],
+      [5,    0,         None],
+    ])
+    self.assertTableData("Accounts", cols="subset", data=[
+      ["id", "Recent"],
+      [1,    [2, 4]],
+      [2,    []],
+    ])
+
+    # Adding a record only recomputes the rows whose ranges include its date (along with the new
+    # row itself), rather than all rows of the same account.
+    self.call_counts.clear()
+    self.add_record("Tx", Account=1, Date=D(2024,1,4), Amount=1000)
+    self.assertEqual(self.call_counts["Tx"]["Balance"], 2)
+    self.assertEqual(self.call_counts["Tx"]["Nearby"], 2)
+    self.assertEqual(self.call_counts["Accounts"], {"Recent": 1})
+    self.assertTableData("Tx", cols="subset", data=[
+      ["id", "Balance", "Nearby"],
+      [1,    10,        [1, 3]],
+      [2,    30,        [6, 2]],
+      [3,    5,         [2, 3]],
+      [4,    1031,      [4]],
+      [5,    0,         None],
+      [6,    1030,      [6, 4]],
+    ])
+    self.assertTableData("Accounts", cols="subset", data=[
+      ["id", "Recent"],
+      [1,    [2, 6, 4]],
+      [2,    []],
+    ])
+
+    # Changing an amount recomputes the balances that include it, and the Nearby lookups, since
+    # they are ordered by amount.
+    self.call_counts.clear()
+    self.update_record("Tx", 2, Amount=50)
+    self.assertEqual(self.call_counts["Tx"]["Balance"], 3)
+    self.assertEqual(self.call_counts["Tx"]["Nearby"], 2)
+    self.assertTableData("Tx", cols="subset", data=[
+      ["id", "Balance", "Nearby"],
+      [1,    10,        [1, 3]],
+      [2,    60,        [6, 2]],
+      [3,    5,         [2, 3]],
+      [4,    1061,      [4]],
+      [5,    0,         None],
+      [6,    1060,      [6, 4]],
+    ])
+
+    # Moving a record to another account and date affects ranges covering the old and new values.
+    self.call_counts.clear()
+    self.update_record("Tx", 1, Account=2, Date=D(2024,1,3))
+    self.assertTableData("Tx", cols="subset", data=[
+      ["id", "Balance", "Nearby"],
+      [1,    15,        [6, 2, 1]],
+      [2,    50,        [6, 2, 1]],
+      [3,    5,         [2, 1, 3]],
+      [4,    1051,      [4]],
+      [5,    0,         None],
+      [6,    1050,      [6, 4]],
+    ])
+    self.assertTableData("Accounts", cols="subset", data=[
+      ["id", "Recent"],
+      [1,    [2, 6, 4]],
+      [2,    [1]],
+    ])
+
+    # Removing a record affects ranges that include it.
+    self.call_counts.clear()
+    self.remove_record("Tx", 4)
+    self.assertEqual(self.call_counts["Tx"], {"Nearby": 1})
+    self.assertTableData("Tx", cols="subset", data=[
+      ["id", "Balance", "Nearby"],
+      [1,    15,        [6, 2, 1]],
+      [2,    50,        [6, 2, 1]],
+      [3,    5,         [2, 1, 3]],
+      [5,    0,         None],
+      [6,    1050,      [6]],
+    ])
+
+    # Range lookup maps get removed once no formula uses them.
+    range_map_id = "#lookup##range:Date#-Amount"
+    self.assertIn(range_map_id, self.engine.tables["Tx"]._special_cols)
+    self.modify_column("Tx", "Nearby", formula="$Amount")
+    self.assertNotIn(range_map_id, self.engine.tables["Tx"]._special_cols)
+
+  def test_range_lookup_errors(self):
+    self.load_sample(self.sample)
+    self.add_column("Accounts", "Both", isFormula=True, formula=(
+      "try:\n"
+      "  return Tx.lookupRecords(Date=LE(DATE(2024,1,9)), Amount=GE(0))\n"
+      "except ValueError as e:\n"
+      "  return str(e)"))
+    # Results are sorted by the range column, so can be searched using find.*() methods.
+    self.add_column("Accounts", "Last", isFormula=True, formula=(
+      "Tx.lookupRecords(Account=$id, Date=GE(DATE(2024,1,2))).find.le(DATE(2024,1,4)).id"))
+    self.assertTableData("Accounts", cols="subset", data=[
+      ["id", "Both", "Last"],
+      [1,    "At most one field may be looked up by range, got Amount and Date", 2],
+      [2,    "At most one field may be looked up by range, got Amount and Date", 3],
+    ])
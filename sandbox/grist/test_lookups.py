@@ -24,6 +24,15 @@ class TestLookups(test_engine.EngineTestCase):
       [6,   "3:4",  "New Haven:West Haven" ]
     ])
 
+  def test_lookup_relations_memory(self):
+    # The memory used to track lookups is reported in table stats, and released when unused.
+    self.load_sample(testsamples.sample_students)
+    used = self.engine.get_table_stats()["lookup_relations_bytes"]
+    self.assertGreater(used, 0)
+    self.modify_column("Students", "schoolIds", formula="''")
+    self.modify_column("Students", "schoolCities", formula="''")
+    self.assertLess(self.engine.get_table_stats()["lookup_relations_bytes"], used)
+
 
   #----------------------------------------
   def test_lookup_dependencies(self, pre_loaded=False):
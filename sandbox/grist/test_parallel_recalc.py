@@ -0,0 +1,240 @@
+import json
+import os
+import tempfile
+import unittest
+
+import actions
+import objtypes
+import parallel_recalc
+import testutil
+import test_engine
+
+
+@unittest.skipUnless(parallel_recalc.is_supported(), "requires os.fork")
+class TestParallelRecalc(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Items", [
+        [1, "Name",   "Text",     False, "", "", ""],
+        [2, "Price",  "Numeric",  False, "", "", ""],
+        [3, "Double", "Numeric",  True,  "$Price * 2", "", ""],
+        [4, "Label",  "Text",     True,  "'%s: %s' % ($Name, $Double)", "", ""],
+      ]],
+      [2, "Sales", [
+        [11, "Item",  "Ref:Items", False, "", "", ""],
+        [12, "Qty",   "Int",       False, "", "", ""],
+        [13, "Total", "Numeric",   True,  "$Item.Double * $Qty", "", ""],
+        [14, "Bad",   "Numeric",   True,  "1 / $Qty", "", ""],
+      ]],
+      [3, "Stores", [
+        [21, "City",  "Text",     False, "", "", ""],
+        [22, "Upper", "Text",     True,  "$City.upper()", "", ""],
+        [23, "Sales", "Int",      True,  "len(Sales.lookupRecords(Qty=$id))", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Items": [
+        ["id", "Name", "Price"],
+        [1,    "a",    2],
+        [2,    "b",    3],
+        [3,    "c",    4],
+      ],
+      "Sales": [
+        ["id", "Item", "Qty"],
+        [1,    1,      1],
+        [2,    1,      0],
+        [3,    2,      2],
+      ],
+      "Stores": [
+        ["id", "City"],
+        [1,    "Ames"],
+        [2,    "Boise"],
+      ],
+    }
+  })
+
+  def run_actions(self, num_workers):
+    self.setUp()
+    self.engine.set_recalc_workers(num_workers)
+    self.load_sample(self.sample)
+    results = []
+    user_actions = [
+      ["BulkUpdateRecord", "Items", [1, 2, 3], {"Price": [5, 6, 7]}],
+      ["BulkUpdateRecord", "Stores", [1, 2], {"City": ["Chicago", "Denver"]}],
+      ["UpdateRecord", "Sales", 2, {"Item": 3, "Qty": 2}],
+      ["ModifyColumn", "Items", "Double", {"formula": "$Price * 3"}],
+      ["ModifyColumn", "Stores", "Upper", {"formula": "$City.lower()"}],
+    ]
+    for user_action in user_actions:
+      out_actions = self.apply_user_action(user_action)
+      # Encode actions, to compare error values (which aren't comparable as objects).
+      results.append(json.dumps([actions.get_action_repr(a) for a in out_actions.stored] +
+                                [actions.get_action_repr(a) for a in out_actions.undo],
+                                default=objtypes.encode_object))
+    return results, self.getFullEngineData()
+
+  def test_same_results(self):
+    # With workers, results should be the same as without, whether or not work actually gets
+    # done in workers.
+    serial_results = self.run_actions(0)
+
+    # Count the cells computed in workers, and let workers take on even this little work.
+    counts = []
+    orig_recompute_in_workers = parallel_recalc.recompute_in_workers
+    orig_min_cells = parallel_recalc.MIN_PARALLEL_CELLS
+    def recompute_in_workers(engine, num_workers):
+      counts.append(orig_recompute_in_workers(engine, num_workers))
+      return counts[-1]
+    parallel_recalc.recompute_in_workers = recompute_in_workers
+    parallel_recalc.MIN_PARALLEL_CELLS = 0
+    try:
+      parallel_results = self.run_actions(4)
+    finally:
+      parallel_recalc.recompute_in_workers = orig_recompute_in_workers
+      parallel_recalc.MIN_PARALLEL_CELLS = orig_min_cells
+
+    self.assertEqual(parallel_results, serial_results)
+    # Workers did some of the work (e.g. for changes to Items and Stores prices together), but not
+    # all (e.g. Stores.Sales depends on a lookup, so doesn't get computed in a worker).
+    self.assertGreater(sum(counts), 0)
+    self.assertLess(sum(counts), 24)
+
+    # Check a few values, to make sure they aren't both wrong.
+    self.assertTableData("Sales", cols="subset", data=[
+      ["id", "Total", "Bad"],
+      [1,    15,      1.0],
+      [2,    42,      0.5],
+      [3,    36,      0.5],
+    ])
+    self.assertTableData("Stores", cols="subset", data=[
+      ["id", "Upper",   "Sales"],
+      [1,    "chicago", 1],
+      [2,    "denver",  2],
+    ])
+
+  def test_fork_failure(self):
+    # If workers can't be forked, all work is done in the parent.
+    serial_results = self.run_actions(0)
+    orig_fork = os.fork
+    orig_min_cells = parallel_recalc.MIN_PARALLEL_CELLS
+    def fork():
+      raise OSError(11, "Resource temporarily unavailable")
+    os.fork = fork
+    parallel_recalc.MIN_PARALLEL_CELLS = 0
+    try:
+      parallel_results = self.run_actions(4)
+    finally:
+      os.fork = orig_fork
+      parallel_recalc.MIN_PARALLEL_CELLS = orig_min_cells
+    self.assertEqual(parallel_results, serial_results)
+
+  lookup_sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Src", [
+        [1, "k", "Int",     False, "", "", ""],
+        [2, "v", "Numeric", False, "", "", ""],
+      ]],
+      [2, "A1", [
+        [11, "Key", "Int",     False, "", "", ""],
+        [12, "F",   "Numeric", True,  "Src.lookupOne(k=$Key).v", "", ""],
+      ]],
+      [3, "A2", [
+        [21, "Key", "Int",     False, "", "", ""],
+        [22, "G",   "Numeric", True,  "Src.lookupOne(k=$Key).v * 10", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Src": [["id", "k", "v"], [1, 1, 1], [2, 2, 2]],
+      "A1": [["id", "Key"], [1, 1], [2, 2]],
+      "A2": [["id", "Key"], [1, 1], [2, 2]],
+    }
+  })
+
+  def test_known_lookup_edges(self):
+    # Formulas that use a lookup relation already in the graph must not be computed in workers:
+    # the parent wouldn't learn which keys they looked up, and would not recompute them later.
+    orig_min_cells = parallel_recalc.MIN_PARALLEL_CELLS
+    parallel_recalc.MIN_PARALLEL_CELLS = 0
+    try:
+      self.engine.set_recalc_workers(4)
+      self.load_sample(self.lookup_sample)
+      self.apply_user_action(["BulkUpdateRecord", "Src", [1, 2], {"v": [5, 6]}])
+      self.apply_user_action(["BulkUpdateRecord", "Src", [1, 2], {"v": [7, 8]}])
+    finally:
+      parallel_recalc.MIN_PARALLEL_CELLS = orig_min_cells
+
+    self.assertTableData("A1", cols="subset", data=[["id", "F"], [1, 7], [2, 8]])
+    self.assertTableData("A2", cols="subset", data=[["id", "G"], [1, 70], [2, 80]])
+
+  def test_lazy_table(self):
+    # A worker must not load a lazy table (that would call back into Node over the channel it
+    # shares with the parent), so the parent does that, once.
+    parent_pid = os.getpid()
+    loads = tempfile.TemporaryFile()
+    self.addCleanup(loads.close)
+    sample = testutil.parse_test_sample({
+      "SCHEMA": [
+        [1, "Src", [[1, "v", "Numeric", False, "", "", ""]]],
+        [2, "A1", [
+          [11, "Key", "Int",     False, "", "", ""],
+          [12, "F",   "Numeric", True,  "$Key * 2", "", ""],
+        ]],
+        [3, "A2", [
+          [21, "Src", "Ref:Src", False, "", "", ""],
+          [22, "G",   "Numeric", True,  "$Src.v * 10", "", ""],
+        ]],
+      ],
+      "DATA": {
+        "Src": [["id", "v"], [1, 5], [2, 6]],
+        "A1": [["id", "Key"], [1, 1], [2, 2]],
+        "A2": [["id", "Src"], [1, 1], [2, 2]],
+      }
+    })
+    def load_func():
+      os.write(loads.fileno(), b"parent;" if os.getpid() == parent_pid else b"worker;")
+      return sample["DATA"]["Src"]
+
+    orig_min_cells = parallel_recalc.MIN_PARALLEL_CELLS
+    parallel_recalc.MIN_PARALLEL_CELLS = 0
+    try:
+      self.engine.set_recalc_workers(2)
+      schema = sample["SCHEMA"]
+      self.engine.load_meta_tables(schema['_grist_Tables'], schema['_grist_Tables_column'])
+      self.engine.register_lazy_table("Src", 2, load_func)
+      self.engine.load_table(sample["DATA"]["A1"])
+      self.engine.load_table(sample["DATA"]["A2"])
+      self.apply_user_action(['Calculate'])
+    finally:
+      parallel_recalc.MIN_PARALLEL_CELLS = orig_min_cells
+
+    loads.seek(0)
+    self.assertEqual(loads.read(), b"parent;")
+    self.assertTableData("A1", cols="subset", data=[["id", "F"], [1, 2], [2, 4]])
+    self.assertTableData("A2", cols="subset", data=[["id", "G"], [1, 50], [2, 60]])
+
+  def test_components(self):
+    self.load_sample(self.sample)
+    # Invalidate particular rows, since invalidating whole columns clears their dependents'
+    # dependencies, which would leave each column in its own component.
+    get_column = lambda table_id, col_id: self.engine.tables[table_id].get_column(col_id)
+    self.engine.invalidate_column(get_column("Items", "Price"), [1, 2, 3])
+    self.engine.invalidate_column(get_column("Stores", "City"), [1, 2])
+    self.engine.invalidate_column(get_column("Sales", "Qty"), [2])
+    # pylint:disable=protected-access
+    components = parallel_recalc._get_components(self.engine)
+    node = lambda table_id, col_id: get_column(table_id, col_id).node
+    # Items columns and Sales.Total are connected by the reference; Stores.Sales depends on a dirty
+    # lookup map, so is left for the parent.
+    self.assertEqual(components, [
+      (9, [node("Items", "Double"), node("Items", "Label"), node("Sales", "Total")]),
+      (1, [node("Sales", "Bad")]),
+      (2, [node("Stores", "Upper")]),
+    ])
+    self.assertEqual(parallel_recalc._assign(components, 2), [
+      [node("Items", "Double"), node("Items", "Label"), node("Sales", "Total")],
+      [node("Sales", "Bad"), node("Stores", "Upper")],
+    ])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,52 @@
+import datetime
+import unittest
+
+import parse_data
+
+
+class TestParseData(unittest.TestCase):
+  def test_get_table_data(self):
+    dt = datetime.datetime
+    # Values that don't match a column's type are kept as text, as long as there are few enough.
+    rows = [[1, "a", dt(2020, 1, 1), True, "n/a"]] * 10 + [
+      [2.0,   "b",  None,           False],
+      [False, 3.0,  "x",            "y",   5],
+    ]
+    self.assertEqual(parse_data.get_table_data(rows, 5), [
+      {"type": "Numeric", "data": [1] * 10 + [2, 0]},
+      {"type": "Any", "data": ["a"] * 10 + ["b", "3"]},
+      {"type": "Date", "data": [1577836800.0] * 10 + [None, "x"]},
+      {"type": "Bool", "data": [True] * 10 + [False, "y"]},
+      {"type": "Numeric", "data": ["n/a"] * 10 + ["", 5]},
+    ])
+
+  def test_get_table_data_num_rows(self):
+    # With num_rows, types are still guessed from the full sample.
+    rows = [[1], [2], [3]] + [["x"]] * 30
+    self.assertEqual(parse_data.get_table_data(iter(rows), 1, num_rows=3),
+                     [{"type": "Any", "data": ["1", "2", "3"]}])
+    self.assertEqual(parse_data.get_table_data(iter(rows), 1, num_rows=35),
+                     parse_data.get_table_data(iter(rows), 1))
+    rows = [[1]] * (parse_data.SAMPLE_ROWS + 5)
+    self.assertEqual(parse_data.get_table_data(iter(rows), 1, num_rows=parse_data.SAMPLE_ROWS + 2),
+                     [{"type": "Numeric", "data": [1] * (parse_data.SAMPLE_ROWS + 2)}])
+
+  def test_detector_decided(self):
+    # Once too many values can't be converted to any basic type, the detector is done.
+    detector = parse_data.ColumnDetector(max_values=50)
+    for value in [1, 2, "a", "b", "--"] * 2 + ["c"]:
+      detector.add_value(value)
+    self.assertFalse(detector.is_decided())
+    detector.add_value("d")
+    self.assertTrue(detector.is_decided())
+    self.assertIs(detector.get_converter(), parse_data.AnyConverter)
+
+    detector = parse_data.ColumnDetector()
+    for value in [1, 2.5, "a", "--"] * 10 + [3] * 100:
+      detector.add_value(value)
+    self.assertFalse(detector.is_decided())
+    self.assertIs(detector.get_converter(), parse_data.NumericConverter)
+
+
+if __name__ == "__main__":
+  unittest.main()
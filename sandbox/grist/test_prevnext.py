@@ -73,7 +73,8 @@ class TestPrevNext(test_engine.EngineTestCase):
     expected.sort(key=lambda r: r["id"])
     return expected
 
-  def do_test(self, formula, group_key=None, sort_key=None, sort_reverse=False):
+  def do_test(self, formula, group_key=None, sort_key=None, sort_reverse=False,
+              cumul_formula=None):
     calc_expected = lambda: self.calc_expected(
         group_key=group_key, sort_key=sort_key, sort_reverse=sort_reverse)
 
@@ -89,6 +90,8 @@ class TestPrevNext(test_engine.EngineTestCase):
     # (3) Try a few actions that affect the data, and calculate again.
     self.do_setup()
     self.modify_column('Purchases', 'Prev', formula=formula)
+    if cumul_formula:
+      self.modify_column('Purchases', 'Cumul', formula=cumul_formula)
 
     # Check the initial data.
     assertPrevValid()
@@ -340,6 +343,101 @@ class TestPrevNext(test_engine.EngineTestCase):
           [8,       D(2023,12,5), "A",        4     ],
     ])
 
+  def test_cumsum(self):
+    # CUMSUM() should produce the same running totals as following the chain of PREVIOUS() calls.
+    self.do_test("PREVIOUS(rec, order_by=None)",
+        cumul_formula="CUMSUM(rec, 'Amount', order_by=None)",
+        sort_key=lambda r: r.manualSort)
+    self.do_test("PREVIOUS(rec, group_by=('Customer',), order_by='-Date')",
+        cumul_formula="CUMSUM(rec, 'Amount', group_by=('Customer',), order_by='-Date')",
+        group_key=(lambda r: r.Customer), sort_key=lambda r: (SafeSortKey(r.Date), -r.id),
+        sort_reverse=True)
+    self.do_test("PREVIOUS(rec, group_by='Category', order_by='Date')",
+        cumul_formula="CUMSUM(rec, 'Amount', group_by='Category', order_by='Date')",
+        group_key=(lambda r: r.Category), sort_key=lambda r: SafeSortKey(r.Date))
+
+  def test_cumsum_updates(self):
+    self.do_setup()
+    self.modify_column('Purchases', 'Cumul', formula="CUMSUM(rec, 'Amount', order_by='Date')")
+    self.assertTableData('Purchases', cols="subset", data=[
+      ["id", "Date",       "Amount", "Cumul"],
+      [1,    D(2023,12,1), 10,       10],
+      [2,    D(2023,12,4), 17,       127],
+      [3,    D(2023,12,3), 20,       110],
+      [4,    D(2023,12,9), 40,       1287],
+      [5,    D(2023,12,2), 80,       90],
+      [6,    D(2023,12,6), 160,      927],
+      [7,    D(2023,12,7), 320,      1247],
+      [8,    D(2023,12,5), 640,      767],
+    ])
+
+    # Only the running totals at and after a changed record get recalculated.
+    self.update_record('Purchases', 7, Amount=300)
+    self.assertEqual(self.call_counts['Purchases']['Cumul'], 2)
+    self.update_record('Purchases', 4, Date=D(2023,12,3))
+    self.assertEqual(self.call_counts['Purchases']['Cumul'], 5)
+    self.assertTableData('Purchases', cols="subset", rows="subset", data=[
+      ["id", "Date",       "Amount", "Cumul"],
+      [4,    D(2023,12,3), 40,       150],
+      [7,    D(2023,12,7), 300,      1267],
+    ])
+
+    # An error in the summed column is raised for all records in the group.
+    self.add_column('Purchases', 'Ratio', formula="1 / ($id - 3)")
+    self.modify_column('Purchases', 'Cumul',
+        formula="CUMSUM(rec, 'Ratio', group_by='Category', order_by=None)")
+    div_error = objtypes.RaisedException(ZeroDivisionError())
+    self.assertTableData('Purchases', cols="subset", data=[
+      ["id", "Category", "Cumul"],
+      [1,    "A",        div_error],
+      [2,    "A",        div_error],
+      [3,    "A",        div_error],
+      [4,    "A",        div_error],
+      [5,    "B",        0.5],
+      [6,    "B",        0.5 + 1/3],
+      [7,    "A",        div_error],
+      [8,    "A",        div_error],
+    ])
+    # Each cell gets its own copy of the error.
+    cumul = self.engine.tables['Purchases'].get_column('Cumul')
+    self.assertIsNot(cumul.raw_get(1).error, cumul.raw_get(2).error)
+    self.assertEqual(str(cumul.raw_get(1).error), str(cumul.raw_get(2).error))
+    self.update_record('Purchases', 3, Category="B")
+    self.assertTableData('Purchases', cols="subset", data=[
+      ["id", "Category", "Cumul"],
+      [1,    "A",        -0.5],
+      [2,    "A",        -1.5],
+      [3,    "B",        div_error],
+      [4,    "A",        -0.5],
+      [5,    "B",        div_error],
+      [6,    "B",        div_error],
+      [7,    "A",        -0.25],
+      [8,    "A",        -0.04999999999999999],
+    ])
+
+  def test_cumsum_rename(self):
+    self.do_setup()
+    self.modify_column('Purchases', 'Cumul',
+        formula="CUMSUM(rec, 'Amount', group_by='Category', order_by='Date')")
+    self.apply_user_action(['RenameColumn', 'Purchases', 'Category', 'cat'])
+    self.apply_user_action(['RenameColumn', 'Purchases', 'Date', 'when'])
+    self.apply_user_action(['RenameColumn', 'Purchases', 'Amount', 'Dollars'])
+    self.assertTableData('_grist_Tables_column', cols="subset", rows="subset", data=[
+      dict(id=27, colId="Cumul",
+           formula="CUMSUM(rec, 'Dollars', group_by='cat', order_by='when')")
+    ])
+    self.assertTableData('Purchases', cols="subset", data=[
+      ["id", "cat", "Cumul"],
+      [1,    "A",   10],
+      [2,    "A",   47],
+      [3,    "A",   30],
+      [4,    "A",   1047],
+      [5,    "B",   80],
+      [6,    "B",   240],
+      [7,    "A",   1007],
+      [8,    "A",   687],
+    ])
+
   def test_prevnext_rename_result_attr(self):
     self.do_setup()
     self.add_column('Purchases', 'PrevAmount', formula="PREVIOUS(rec, order_by=None).Amount")
@@ -0,0 +1,89 @@
+import testutil
+import test_engine
+
+
+class TestProfiler(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Items", [
+        [1, "Name",   "Text",     False, "", "", ""],
+        [2, "Price",  "Numeric",  False, "", "", ""],
+        [3, "Amount", "Numeric",  True,  "$Total * 2", "", ""],
+        [4, "Total",  "Numeric",  True,  "$Price * len(Sales.lookupRecords(Item=$id))", "", ""],
+      ]],
+      [2, "Sales", [
+        [11, "Item",  "Ref:Items", False, "", "", ""],
+        [12, "Price", "Numeric",  True,  "$Item.Price", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Items": [
+        ["id", "Name", "Price"],
+        [1,    "a",    2],
+        [2,    "b",    3],
+      ],
+      "Sales": [
+        ["id", "Item"],
+        [1,    1],
+        [2,    1],
+        [3,    2],
+      ],
+    }
+  })
+
+  def test_profile(self):
+    self.load_sample(self.sample)
+    self.assertEqual(self.engine.get_profile(), {"columns": [], "actions": []})
+
+    self.engine.start_profiling()
+    self.update_record("Items", 2, Price=4)
+    # Stats are only cleared when requested.
+    self.assertEqual(len(self.engine.get_profile()["actions"]), 1)
+    self.assertEqual(len(self.engine.get_profile(clear=True)["actions"]), 1)
+    self.update_record("Items", 1, Price=5)
+    profile = self.engine.stop_profiling()
+
+    # Amount gets evaluated first, and interrupted to compute Total, which it needs. The dependency
+    # edges were all known from loading, so none get added.
+    columns = {(c["tableId"], c["colId"]): c for c in profile["columns"]}
+    self.assertEqual(
+      {node: (c["count"], c["orderErrors"], c["edges"], c["lookups"])
+       for node, c in columns.items()},
+      {
+        ("Items", "Amount"): (2, 1, 0, 0),
+        ("Items", "Total"): (1, 0, 0, 1),
+        ("Sales", "Price"): (2, 0, 0, 0),
+      })
+    self.assertEqual(columns[("Items", "Total")]["lookupsPerCell"], 1)
+    for c in profile["columns"]:
+      self.assertLessEqual(c["selfTime"], c["totalTime"])
+    self.assertEqual([c["selfTime"] for c in profile["columns"]],
+                     sorted((c["selfTime"] for c in profile["columns"]), reverse=True))
+
+    self.assertEqual(len(profile["actions"]), 1)
+    action = profile["actions"][0]
+    self.assertEqual(action["actions"], [["UpdateRecord", "Items"]])
+    self.assertEqual(action["cells"], 5)
+    self.assertEqual(action["columns"], [
+      {"tableId": "Items", "colId": "Amount", "count": 2},
+      {"tableId": "Items", "colId": "Total", "count": 1},
+      {"tableId": "Sales", "colId": "Price", "count": 2},
+    ])
+
+    # Once stopped, nothing gets collected, and measuring cells does nothing.
+    profiler = self.engine._profiler    # pylint:disable=protected-access
+    self.assertIs(profiler.measure(None), profiler.measure(None))
+    self.update_record("Items", 1, Price=6)
+    self.assertEqual(self.engine.get_profile(), {"columns": [], "actions": []})
+    self.assertTableData("Items", cols="subset", data=[
+      ["id", "Amount", "Total"],
+      [1,    24.0,     12.0],
+      [2,    8.0,      4.0],
+    ])
+
+    # A changed formula starts without dependencies, so its evaluation adds edges.
+    self.engine.start_profiling()
+    self.modify_column("Items", "Total", formula="$Price * len(Sales.lookupRecords(Item=$id)) + 1")
+    columns = {(c["tableId"], c["colId"]): c for c in self.engine.stop_profiling()["columns"]}
+    self.assertEqual(columns[("Items", "Total")]["count"], 2)
+    self.assertEqual(columns[("Items", "Total")]["edges"], 3)
@@ -245,6 +245,27 @@ class TestRelabeling(unittest.TestCase):
     self.assertEqual(r.prepare_inserts(slist, [0.0]), ([(0, 1.0)], [2.0]))
     self.assertEqual(r.prepare_inserts(slist, [float('-inf')]), ([(0, 2.0)], [1.0]))
 
+  def test_sorted_key_view(self):
+    # A list sorted by wrapped keys, seen through a SortedKeyView, gets the same results as a list
+    # sorted by the keys themselves, including when existing items need adjustments.
+    class Wrapped(object):
+      def __init__(self, key):
+        self.key = key
+      def __lt__(self, other):
+        return self.key < other.key
+
+    keys = [1.0, r.nextfloat(1.0), r.nextfloat(r.nextfloat(1.0)), 2.0, 5.0]
+    plain = SortedListWithKey((Item(v, k) for (v, k) in zip('abcde', keys)), key=lambda i: i.key)
+    wrapped = SortedListWithKey(list(plain), key=lambda i: Wrapped(i.key))
+    view = r.SortedKeyView(wrapped, lambda i: i.key, Wrapped)
+    self.assertEqual(len(view), 5)
+    self.assertIs(view[3], plain[3])
+    for new_keys in ([0.0], [keys[1], keys[1]], [3.0, 6.0, keys[2]]):
+      result = r.prepare_inserts(view, new_keys)
+      self.assertEqual(result, r.prepare_inserts(plain, new_keys))
+    # Check that adjustments were actually exercised.
+    self.assertTrue(r.prepare_inserts(view, [keys[1]])[0])
+
   def test_with_dups(self):
     slist = SortedListWithKey(key=lambda i: i.key)
     slist.update(Item(v, k) for (v, k) in zip('abcdef', [1, 1, 1, 2, 2, 2]))
@@ -0,0 +1,83 @@
+import random
+import unittest
+
+import rowset
+from rowset import RowSet
+
+class TestRowSet(unittest.TestCase):
+  def test_ranges(self):
+    rows = RowSet([5, 1, 2, 3, 8, 9, 2])
+    self.assertEqual(rows.ranges(), [(1, 4), (5, 6), (8, 10)])
+    self.assertEqual(list(rows), [1, 2, 3, 5, 8, 9])
+    self.assertEqual(len(rows), 6)
+    self.assertEqual(repr(rows), "RowSet(1-3, 5, 8-9)")
+
+    # Adjacent ranges get merged, and removing from the middle of a range splits it.
+    rows.update([4, 6, 7])
+    self.assertEqual(rows.ranges(), [(1, 10)])
+    rows -= [3, 4, 9, 20]
+    self.assertEqual(rows.ranges(), [(1, 3), (5, 9)])
+    self.assertEqual(len(rows), 6)
+    self.assertIn(5, rows)
+    self.assertNotIn(4, rows)
+    self.assertNotIn(9, rows)
+
+    other = rows - RowSet(range(2, 7))
+    self.assertEqual(other.ranges(), [(1, 2), (7, 9)])
+    self.assertEqual(rows.ranges(), [(1, 3), (5, 9)])
+    self.assertEqual(other, RowSet([1, 7, 8]))
+    self.assertFalse(RowSet())
+
+  def test_scattered(self):
+    # Many short ranges get kept as a SortedSet, until enough rows in ranges get added.
+    rows = RowSet(range(1, 4001, 2))
+    self.assertEqual(len(rows), 2000)
+    self.assertIsNotNone(rows._rows)    # pylint:disable=protected-access
+    self.assertEqual(rows.ranges()[:2], [(1, 2), (3, 4)])
+    self.assertIn(3999, rows)
+    self.assertNotIn(4000, rows)
+    rows.update([2, 4])
+    self.assertEqual(rows.ranges()[:2], [(1, 6), (7, 8)])
+    rows -= range(1, 3000)
+    self.assertEqual(list(rows)[:2], [3001, 3003])
+    self.assertEqual(len(rows), 500)
+    other = rows.copy()
+    rows.update(range(1, 10001))
+    self.assertIsNone(rows._rows)       # pylint:disable=protected-access
+    self.assertEqual(rows.ranges(), [(1, 10001)])
+    self.assertEqual(other, RowSet(range(3001, 4001, 2)))
+    other -= other.copy()
+    self.assertEqual(other.ranges(), [])
+
+  def test_random(self):
+    # Compare to a plain set, combining with few runs (handled one at a time) and with many runs
+    # (handled by merging all ranges), and with sets kept as SortedSets.
+    # pylint:disable=protected-access
+    orig_max_scattered_runs = rowset._MAX_SCATTERED_RUNS
+    for max_scattered_runs in (orig_max_scattered_runs, 3):
+      rowset._MAX_SCATTERED_RUNS = max_scattered_runs
+      try:
+        self._check_random()
+      finally:
+        rowset._MAX_SCATTERED_RUNS = orig_max_scattered_runs
+
+  def _check_random(self):
+    rand = random.Random(3)
+    for _ in range(500):
+      expected = set()
+      rows = RowSet()
+      for _ in range(20):
+        row_ids = [rand.randrange(60) for _ in range(rand.choice([1, 3, 20, 40]))]
+        arg = RowSet(row_ids) if rand.random() < 0.5 else row_ids
+        if rand.random() < 0.6:
+          expected.update(row_ids)
+          rows.update(arg)
+        else:
+          expected.difference_update(row_ids)
+          rows -= arg
+        self.assertEqual(list(rows), sorted(expected))
+        self.assertEqual(len(rows), len(expected))
+        self.assertEqual(rows, RowSet(sorted(expected)))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,200 @@
+import datetime
+
+import lookup
+import objtypes
+import testutil
+import test_engine
+
+# Pairs of (incrementally maintained formula, equivalent formula that gets evaluated in full).
+FORMULAS = [
+  ("Sum",   "SUM($group.Amount)",     "SUM(list($group.Amount))"),
+  ("Num",   "COUNT($group.Amount)",   "COUNT(list($group.Amount))"),
+  ("Avg",   "AVERAGE($group.Amount)", "AVERAGE(list($group.Amount))"),
+  ("Min",   "MIN($group.Amount)",     "MIN(list($group.Amount))"),
+  ("Max",   "MAX($group.Amount)",     "MAX(list($group.Amount))"),
+]
+
+class TestSummaryAggregates(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Tx", [
+        [11, "Cat",     "Text",     False, "", "", ""],
+        [12, "Amount",  "Any",      False, "", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Tx": [
+        ["id", "Cat", "Amount"],
+        [1,    "a",   10],
+        [2,    "a",   2.5],
+        [3,    "b",   True],
+        [4,    "b",   "x"],
+        [5,    "c",   -4],
+        [6,    "a",   0.25],
+      ],
+    }
+  })
+
+  def load_summary(self):
+    self.load_sample(self.sample)
+    self.apply_user_action(["CreateViewSection", 1, 0, "record", [11], None])
+    for (col_id, formula, full_formula) in FORMULAS:
+      self.add_column("Tx_summary_Cat", col_id, formula=formula)
+      self.add_column("Tx_summary_Cat", "Full" + col_id, formula=full_formula)
+
+  def assertMatchesFull(self, expected_data):
+    # Check the incrementally maintained values, and that they match full evaluation exactly.
+    col_ids = ["id", "count"] + [f[0] for f in FORMULAS]
+    self.assertTableData("Tx_summary_Cat", cols="subset", data=[col_ids] + expected_data)
+    table = self.engine.tables["Tx_summary_Cat"]
+    for row_id in table.row_ids:
+      for (col_id, _, _) in FORMULAS:
+        value = table.get_column(col_id).raw_get(row_id)
+        full_value = table.get_column("Full" + col_id).raw_get(row_id)
+        if isinstance(value, objtypes.RaisedException):
+          self.assertEqual(type(value.error), type(full_value.error))
+        else:
+          self.assertEqual((type(value), value), (type(full_value), full_value))
+
+  def test_summary_aggregates(self):
+    self.load_summary()
+    div_error = objtypes.RaisedException(ZeroDivisionError())
+    self.assertMatchesFull([
+      [1, 3,  12.75,  3,  4.25,  0.25,  10],
+      [2, 2,  1,      0,  div_error, 0, 0],
+      [3, 1,  -4,     1,  -4.0,  -4,    -4],
+    ])
+
+    # A change to one record only updates the aggregates for its group.
+    self.call_counts.clear()
+    self.update_record("Tx", 2, Amount=7)
+    self.assertEqual(self.call_counts["Tx"], {
+      "#lookup##summary#Tx_summary_Cat#aggregate:Amount": 1})
+    self.assertEqual(self.call_counts["Tx_summary_Cat"], {
+      "Sum": 1, "Num": 1, "Avg": 1, "Min": 1, "Max": 1,
+      "FullSum": 1, "FullNum": 1, "FullAvg": 1, "FullMin": 1, "FullMax": 1})
+    self.assertMatchesFull([
+      [1, 3,  17.25,  3,  5.75,  0.25,  10],
+      [2, 2,  1,      0,  div_error, 0, 0],
+      [3, 1,  -4,     1,  -4.0,  -4,    -4],
+    ])
+
+    # Moving records between groups updates both groups.
+    self.update_record("Tx", 1, Cat="b")
+    self.assertEqual(self.call_counts["Tx_summary_Cat"]["Sum"], 2)
+    self.add_record("Tx", Cat="c", Amount=-4.0)
+    self.assertMatchesFull([
+      [1, 2,  7.25,   2,  3.625, 0.25,  7],
+      [2, 3,  11,     1,  10.0,  10,    10],
+      [3, 2,  -8.0,   2,  -4.0,  -4,    -4],
+    ])
+
+    self.remove_record("Tx", 5)
+    self.update_record("Tx", 4, Amount=0.5)
+    self.assertMatchesFull([
+      [1, 2,  7.25,   2,  3.625, 0.25,  7],
+      [2, 3,  11.5,   2,  5.25,  0.5,   10],
+      [3, 1,  -4.0,   1,  -4.0,  -4.0,  -4.0],
+    ])
+
+    # Float sums don't drift as values get added and removed.
+    self.update_record("Tx", 4, Amount=1e20)
+    self.update_record("Tx", 4, Amount=0.5)
+    self.assertMatchesFull([
+      [1, 2,  7.25,   2,  3.625, 0.25,  7],
+      [2, 3,  11.5,   2,  5.25,  0.5,   10],
+      [3, 1,  -4.0,   1,  -4.0,  -4.0,  -4.0],
+    ])
+
+  def test_summary_aggregate_float_order(self):
+    # Float sums depend on the order of addition, and match SUM() and AVERAGE(), which add up
+    # values in the order of records.
+    self.load_summary()
+    self.update_record("Tx", 1, Amount=0.1)
+    self.update_record("Tx", 2, Amount=0.2)
+    self.update_record("Tx", 6, Amount=0.3)
+    self.assertMatchesFull([
+      [1, 3,  0.1 + 0.2 + 0.3, 3, (0.1 + 0.2 + 0.3) / 3, 0.1, 0.3],
+      [2, 2,  1,      0,  objtypes.RaisedException(ZeroDivisionError()), 0, 0],
+      [3, 1,  -4,     1,  -4.0,  -4,    -4],
+    ])
+    self.assertNotEqual(0.1 + 0.2 + 0.3, 0.6)
+
+    # Adding a record earlier in the group changes the order of addition too. Large ints aren't
+    # exact as floats, so AVERAGE() of them gets added up in order as well.
+    self.update_record("Tx", 3, Cat="a", Amount=0.3)
+    self.update_record("Tx", 5, Amount=2**53 + 1)
+    self.add_record("Tx", Cat="c", Amount=1)
+    self.assertMatchesFull([
+      [1, 4,  0.1 + 0.2 + 0.3 + 0.3, 4, (0.1 + 0.2 + 0.3 + 0.3) / 4, 0.1, 0.3],
+      [2, 1,  0,      0,  objtypes.RaisedException(ZeroDivisionError()), 0, 0],
+      [3, 2,  2**53 + 2, 2, (0.0 + (2**53 + 1) + 1) / 2, 1, 2**53 + 1],
+    ])
+
+  def test_summary_aggregate_float_sum_cost(self):
+    # Float sums are added up in row order, but adding or changing the last rows of a group only
+    # adds up those rows again, however big the group. Sums of floats with integer values don't
+    # need adding up in order at all.
+    def pending(agg):
+      # The number of values to add up at the next read of a float sum.
+      return len(agg.sum_order) - len(agg.running_sums)
+
+    for size in (100, 10000):
+      values = {r: r * 0.1 for r in range(1, size + 1)}
+      agg = lookup._GroupAggregate(False)
+      for row_id, value in values.items():
+        agg.add(row_id, value)
+      self.assertEqual(agg.get('SUM'), sum(values[r] for r in sorted(values)))
+      self.assertEqual(pending(agg), 0)
+
+      values[size + 1] = 0.7
+      agg.add(size + 1, 0.7)
+      self.assertEqual(pending(agg), 1)
+      agg.remove(size + 1, 0.7)
+      values[size + 1] = 0.3
+      agg.add(size + 1, 0.3)
+      self.assertEqual(pending(agg), 1)
+      self.assertEqual(agg.get('SUM'), sum(values[r] for r in sorted(values)))
+      self.assertEqual(agg.get('AVERAGE'), sum(values[r] for r in sorted(values)) / (size + 1))
+
+      # A change earlier in the group affects the running totals from there on.
+      agg.remove(size // 2, values.pop(size // 2))
+      self.assertEqual(pending(agg), size + 1 - size // 2)
+      self.assertEqual(agg.get('SUM'), sum(values[r] for r in sorted(values)))
+
+      agg = lookup._GroupAggregate(False)
+      for row_id in range(1, size + 1):
+        agg.add(row_id, float(row_id))
+      agg.add(size + 1, True)
+      self.assertEqual(agg.get('SUM'), float(sum(range(1, size + 1)) + 1))
+      self.assertEqual(agg.get('AVERAGE'), sum(range(1, size + 1)) / float(size))
+      self.assertIsNone(agg.running_sums)
+
+  def test_summary_aggregate_fallback(self):
+    self.load_summary()
+
+    # Dates are counted, but MIN and MAX of them are evaluated in full, as are sums with infinity.
+    self.update_record("Tx", 5, Amount=datetime.date(2024, 1, 1))
+    self.update_record("Tx", 4, Amount=float('inf'))
+    self.assertMatchesFull([
+      [1, 3,  12.75,  3,  4.25,  0.25,  10],
+      [2, 2,  float('inf'), 1, float('inf'), float('inf'), float('inf')],
+      [3, 1,  0,      1,  objtypes.RaisedException(ZeroDivisionError()),
+       datetime.date(2024, 1, 1), datetime.date(2024, 1, 1)],
+    ])
+
+    # An error in the aggregated column produces the same error as a full evaluation.
+    self.modify_column("Tx", "Amount", isFormula=True, formula="1 / ($id - 3)")
+    self.assertMatchesFull([
+      [1, 3,  -0.5 - 1 + 1/3, 3, (-0.5 - 1 + 1/3) / 3, -1.0, 1/3],
+      [2, 2,  objtypes.RaisedException(ZeroDivisionError())] + [
+        objtypes.RaisedException(ZeroDivisionError())] * 4,
+      [3, 1,  0.5,    1,  0.5,   0.5,   0.5],
+    ])
+
+    # Formulas that aren't simple aggregates are evaluated as usual, and unused aggregate maps
+    # get removed.
+    for (col_id, _, full_formula) in FORMULAS:
+      self.modify_column("Tx_summary_Cat", col_id, formula=full_formula)
+    self.modify_column("Tx_summary_Cat", "count", formula="len(list($group))")
+    self.assertEqual([c for c in self.engine.tables["Tx"]._special_cols if "aggregate" in c], [])
@@ -154,6 +154,8 @@ class TestSummaryChoiceList(EngineTestCase):
         # simple summary and lookup
         '#summary#Source_summary_other': column.ReferenceColumn,
         '#lookup##summary#Source_summary_other': lookup.LookupMapColumn,
+        # maintains the count of each group
+        '#lookup##summary#Source_summary_other#aggregate:': lookup.AggregateMapColumn,
 
         '#summary#Source_summary_choices1_other': column.ReferenceListColumn,
         "#lookup#_Contains(value='#summary#Source_summary_choices1_other', "
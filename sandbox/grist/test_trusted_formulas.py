@@ -0,0 +1,123 @@
+import engine
+import testutil
+import test_engine
+
+
+class TestTrustedFormulas(test_engine.EngineTestCase):
+  sample = testutil.parse_test_sample({
+    "SCHEMA": [
+      [1, "Items", [
+        [1, "Price",  "Numeric",  False, "", "", ""],
+        [2, "Qty",    "Int",      False, "", "", ""],
+        [3, "Total",  "Numeric",  True,  "$Price * $Qty", "", ""],
+      ]],
+      [2, "Orders", [
+        [11, "Item",  "Ref:Items", False, "", "", ""],
+        [12, "Cost",  "Numeric",  True,  "$Item.Total * 2", "", ""],
+      ]],
+      [3, "Log", [
+        [21, "Note",  "Text",     False, "", "", ""],
+        [22, "Seen",  "Any",      True,  "bool(NOW()) and $Note", "", ""],
+      ]],
+    ],
+    "DATA": {
+      "Items": [
+        ["id", "Price", "Qty"],
+        [1,    2.5,     4],
+        [2,    10,      1],
+      ],
+      "Orders": [
+        ["id", "Item"],
+        [1,    1],
+        [2,    2],
+        [3,    1],
+      ],
+      "Log": [
+        ["id", "Note"],
+        [1,    "a"],
+      ],
+    }
+  })
+
+  def reopen(self, fingerprint):
+    # Loads the current data, including formula values, into a new engine, as if the document got
+    # reopened. Returns the result of trust_formula_values().
+    schema = {t: self.engine.fetch_table(t) for t in ('_grist_Tables', '_grist_Tables_column')}
+    data = [self.engine.fetch_table(t) for t in ('Items', 'Orders', 'Log')]
+
+    formula_tracer = self.engine.formula_tracer
+    self.engine = engine.Engine()
+    self.engine.formula_tracer = formula_tracer
+    self.engine.load_meta_tables(schema['_grist_Tables'], schema['_grist_Tables_column'])
+    for table_data in data:
+      self.engine.load_table(table_data)
+    trusted = self.engine.trust_formula_values(fingerprint)
+    self.call_counts.clear()
+    self.apply_user_action(['Calculate'])
+    return trusted
+
+  def test_trusted_values(self):
+    self.load_sample(self.sample)
+    fingerprint = self.engine.get_formula_fingerprint()
+
+    # With a matching fingerprint, only formulas using NOW() get computed on open (along with
+    # internal lookup maps).
+    self.assertTrue(self.reopen(fingerprint))
+    self.assertEqual(self.call_counts, {
+      "Items": {"#lookup#": 2},
+      "Orders": {"#lookup#": 3},
+      "Log": {"#lookup#": 1, "Seen": 1},
+    })
+    self.assertTableData("Orders", data=[
+      ["id", "Item", "Cost"],
+      [1,    1,      20.0],
+      [2,    2,      20.0],
+      [3,    1,      20.0],
+    ])
+
+    # A change to a table recomputes its trusted formulas, and those of tables depending on it.
+    # After that, dependencies are known, and changes get propagated as usual.
+    self.update_record("Items", 2, Qty=3)
+    self.assertEqual(self.call_counts, {"Items": {"Total": 2}, "Orders": {"Cost": 3}})
+    self.assertTableData("Orders", cols="subset", data=[
+      ["id", "Cost"],
+      [1,    20.0],
+      [2,    60.0],
+      [3,    20.0],
+    ])
+    self.call_counts.clear()
+    self.update_record("Items", 1, Price=5)
+    self.assertEqual(self.call_counts, {"Items": {"Total": 1}, "Orders": {"Cost": 2}})
+
+    # A change to a table that nothing depends on doesn't affect other trusted formulas.
+    self.assertTrue(self.reopen(fingerprint))
+    self.call_counts.clear()
+    self.update_record("Orders", 1, Item=2)
+    self.assertEqual(self.call_counts, {"Orders": {"Cost": 3}})
+    self.assertTableData("Orders", cols="subset", data=[
+      ["id", "Cost"],
+      [1,    60.0],
+      [2,    60.0],
+      [3,    40.0],
+    ])
+
+  def test_fingerprint(self):
+    self.load_sample(self.sample)
+    fingerprint = self.engine.get_formula_fingerprint()
+    self.modify_column("Orders", "Cost", formula="$Item.Total * 3")
+    self.assertNotEqual(self.engine.get_formula_fingerprint(), fingerprint)
+
+    # With a fingerprint that doesn't match, all formulas get computed.
+    self.assertFalse(self.reopen(fingerprint))
+    self.assertEqual(self.call_counts, {
+      "Items": {"#lookup#": 2, "Total": 2},
+      "Orders": {"#lookup#": 3, "Cost": 3},
+      "Log": {"#lookup#": 1, "Seen": 1},
+    })
+
+    # Schema changes make all trusted values get recomputed.
+    self.assertTrue(self.reopen(self.engine.get_formula_fingerprint()))
+    self.call_counts.clear()
+    self.add_column("Log", "Extra", type="Text")
+    self.assertEqual(self.call_counts,
+                     {"Items": {"Total": 2}, "Orders": {"Cost": 3}, "Log": {"Extra": 1}})
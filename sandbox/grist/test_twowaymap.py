@@ -1,5 +1,8 @@
+import random
 import unittest
+
 import twowaymap
+from rowset import RowSet
 
 class TestTwoWayMap(unittest.TestCase):
   def assertTwoWayMap(self, twmap, forward, reverse):
@@ -149,6 +152,149 @@ class TestTwoWayMap(unittest.TestCase):
 
     self.assertTwoWayMap(tmap, {1: ["a"]}, {"a": [1]})
 
+  def test_lookup_set_sorted_versions(self):
+    # Sorted versions of a LookupSet get updated as the set changes, without re-sorting.
+    values = {1: 30, 2: 10, 3: 20, 4: 40}
+    class SortKey(object):
+      def __init__(self, row_id):
+        self.row_id = row_id
+        self.value = values[row_id]
+        if self.value is ValueError:
+          raise ValueError("Invalid value")
+      def __lt__(self, other):
+        return (self.value, self.row_id) < (other.value, other.row_id)
+
+    tmap = twowaymap.TwoWayMap(left=twowaymap.LookupSet, right="single")
+    for row_id in (1, 2, 3):
+      tmap.insert(row_id, "a")
+    lookup_set = tmap.lookup_right("a")
+    by_value = lookup_set.sorted_versions["v"] = twowaymap.SortedRowIds(lookup_set, SortKey)
+    by_id = lookup_set.sorted_versions["id"] = twowaymap.SortedRowIds(lookup_set, None)
+    self.assertEqual(by_value.get_list(), [2, 3, 1])
+    self.assertEqual(by_id.get_list(), [1, 2, 3])
+
+    tmap.insert(4, "a")
+    tmap.remove(2, "a")
+    self.assertEqual(by_value.get_list(), [3, 1, 4])
+    self.assertEqual(by_id.get_list(), [1, 3, 4])
+
+    values[4] = 5
+    by_value.update(4)
+    by_value.update(2)    # Not in the set, so ignored.
+    self.assertEqual(by_value.get_list(), [4, 3, 1])
+    self.assertIs(by_value.get_list(), by_value.get_list())
+
+    # If a key can't be computed, the sorted version is no longer valid, and stops changing.
+    values[5] = ValueError
+    tmap.insert(5, "a")
+    self.assertFalse(by_value.valid)
+    tmap.remove(1, "a")
+    self.assertEqual(by_id.get_list(), [3, 4, 5])
+
+    # Lists returned earlier don't change, since they may be kept in RecordSets.
+    old_list = by_id.get_list()
+    tmap.insert(2, "a")
+    tmap.insert(7, "a")
+    self.assertEqual(old_list, [3, 4, 5])
+    self.assertEqual(by_id.get_list(), [2, 3, 4, 5, 7])
+
+    # Changes don't touch the list (which would take O(N) each), and it only gets built again
+    # when requested after changes.
+    # pylint:disable=protected-access
+    for row_id in range(10, 20):
+      tmap.insert(row_id, "a")
+      self.assertIsNone(by_id._list)
+    new_list = by_id.get_list()
+    self.assertEqual(new_list, [2, 3, 4, 5, 7] + list(range(10, 20)))
+    self.assertIs(by_id.get_list(), new_list)
+
+  def test_row_key_map(self):
+    interner = twowaymap.KeyInterner()
+    rkmap = twowaymap.RowKeyMap(interner)
+    other = twowaymap.RowKeyMap(interner)
+    self.assertFalse(rkmap)
+
+    rkmap.insert(1, ("a",))
+    rkmap.insert(2, ("a",))
+    rkmap.insert(2, ("a",))           # A no-op, since this pair already exists.
+    rkmap.insert(3, ("b",))
+    rkmap.insert(3, ("c",))           # Several keys for one row.
+    rkmap.insert(10**9, ("b",))       # Far beyond other row_ids.
+    other.insert(1, ("a",))
+    self.assertTrue(rkmap)
+    self.assertEqual(len(interner), 3)
+    self.assertEqual(set(rkmap.lookup_right(("a",))), {1, 2})
+    self.assertEqual(set(rkmap.lookup_right(("b",))), {3, 10**9})
+    self.assertEqual(set(rkmap.lookup_right(("c",))), {3})
+    self.assertEqual(rkmap.lookup_right(("d",), ()), ())
+    self.assertEqual(rkmap.lookup_left(3), {("b",), ("c",)})
+    self.assertEqual(rkmap.lookup_left(4), None)
+    self.assertEqual(rkmap.left_all(), {1, 2, 3, 10**9})
+    with self.assertRaises(TypeError):
+      rkmap.insert(5, (["unhashable"],))
+    self.assertEqual(rkmap.left_all(), {1, 2, 3, 10**9})
+
+    rkmap.remove_left(3)
+    rkmap.remove_left(1)
+    rkmap.remove_left(4)              # Not present, so a no-op.
+    self.assertEqual(set(rkmap.lookup_right(("b",))), {10**9})
+    self.assertEqual(rkmap.lookup_right(("c",)), None)
+    self.assertEqual(rkmap.left_all(), {2, 10**9})
+    # Keys no longer used by any map get released.
+    self.assertEqual(len(interner), 2)
+    self.assertGreater(rkmap.memory_size(), 0)
+
+    rkmap.clear()
+    self.assertFalse(rkmap)
+    self.assertEqual(len(interner), 1)
+    other.clear()
+    self.assertEqual(len(interner), 0)
+
+  def test_inverse_index(self):
+    # Rows 4 and 1 are out of order, and row 2 refers to 20 twice.
+    index = twowaymap.InverseIndex([(1, 10), (2, 20), (2, 20), (3, 10), (4, 10**9), (1, 20)])
+    self.assertEqual(list(index.lookup(10)), [1, 3])
+    self.assertEqual(list(index.lookup(20)), [1, 2])
+    self.assertEqual(list(index.lookup(10**9)), [4])
+    self.assertEqual(list(index.lookup(11)), [])
+
+    index.add(5, 10)
+    index.add(5, 10)                  # A no-op, since this reference exists.
+    index.remove(1, 10)
+    index.remove(1, 11)               # Not present, so a no-op.
+    index.add(6, 10**9)
+    self.assertEqual(list(index.lookup(10)), [3, 5])
+    self.assertEqual(list(index.lookup(10**9)), [4, 6])
+    self.assertEqual(index.lookup_many([10, 20, 10**9]), {1, 2, 3, 4, 5, 6})
+    self.assertEqual(index.lookup_many(RowSet(range(0, 15))), {3, 5})
+    self.assertGreater(index.memory_size(), 0)
+
+    index.clear()
+    self.assertEqual(index.lookup_many(RowSet(range(0, 30))), set())
+
+  def test_inverse_index_random(self):
+    # Compare to a dict of sets, with enough changes to get them merged into the arrays.
+    rand = random.Random(5)
+    expected = {}
+    pairs = [(rand.randrange(1, 500), rand.randrange(1, 100)) for _ in range(1000)]
+    for row_id, target in pairs:
+      expected.setdefault(target, set()).add(row_id)
+    index = twowaymap.InverseIndex(sorted(pairs))
+    for i in range(5000):
+      row_id, target = rand.randrange(1, 500), rand.choice([rand.randrange(1, 100), 10**6])
+      if rand.random() < 0.5:
+        index.add(row_id, target)
+        expected.setdefault(target, set()).add(row_id)
+      else:
+        index.remove(row_id, target)
+        expected.get(target, set()).discard(row_id)
+      if i % 500 == 0:
+        for t in list(range(100)) + [10**6]:
+          self.assertEqual(list(index.lookup(t)), sorted(expected.get(t, ())))
+        targets = [rand.randrange(100) for _ in range(20)]
+        self.assertEqual(index.lookup_many(RowSet(targets)),
+                         set().union(*(expected.get(t, ()) for t in targets)))
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -1259,6 +1259,24 @@ class TestUserActions(test_engine.EngineTestCase):
       ]
     )
 
+    # Check that with on_many: all, each value updates all of its matches.
+    check(
+      {"first_name": ["John", "Bob", "Alice"]},
+      {"color": ["pink", "gray", "white"]},
+      {"on_many": "all"},
+      [
+        ["AddRecord", "Table1", 5, {"color": "white", "first_name": "Alice"}],
+        ["BulkUpdateRecord", "Table1", [1, 2, 3, 4], {"color": ["pink", "pink", "pink", "gray"]}],
+      ],
+      [
+        {
+          "recordIds": [[1, 2, 3], [4], [5]],
+          "addRecordIds": [5],
+          "updateRecordIds": [[1, 2, 3], [4]],
+        }
+      ]
+    )
+
     # Check that unworkable values (additions with add: False, updates with update: False, and on_many: none)
     # have the right result
     check(
@@ -13,6 +13,14 @@ right="single"). Then m.insert(key, value) sets the given key to the given value
 value previously set, since the "right" dataset is "single" values), m.lookup_left(key) returns
 that value, and m.lookup_right(value) returns a `set` of keys that map to the value.
 """
+import array
+import bisect
+import itertools
+import sys
+
+from sortedcontainers import SortedList
+
+from rowset import RowSet
 
 # Special sentinel value which can never be legitimately stored in TwoWayMap, to easily tell the
 # difference between a present and absent value.
@@ -236,8 +244,8 @@ def _set_remove(container, value):
 
 register_container(set, _set_make, _set_add, _set_remove)
 
-# A version of `set` that maintains also sorted versions of the set. Used in lookups, to cache the
-# sorted lookup results.
+# A version of `set` that maintains also sorted versions of the set. Used in lookups, to keep the
+# sorted lookup results. The sorted versions are SortedRowIds, keyed by sort_spec.
 class LookupSet(set):
   def __init__(self, iterable=[]):
     super(LookupSet, self).__init__(list(iterable))
@@ -248,17 +256,90 @@ def _LookupSet_make(value):
 def _LookupSet_add(container, value):
   if value not in container:
     container.add(value)
-    container.sorted_versions.clear()
+    for sorted_row_ids in container.sorted_versions.values():
+      sorted_row_ids.add(value)
     return True
   return False
 def _LookupSet_remove(container, value):
   if value in container:
     container.discard(value)
-    container.sorted_versions.clear()
+    for sorted_row_ids in container.sorted_versions.values():
+      sorted_row_ids.remove(value)
 
 register_container(LookupSet, _LookupSet_make, _LookupSet_add, _LookupSet_remove)
 
 
+class SortedRowIds(object):
+  """
+  The row_ids of a LookupSet sorted using a sort_key (as returned by sort_key.make_sort_key), or
+  by row_id if sort_key is None. It's maintained as rows get added, removed, or change their sort
+  values, rather than re-sorted on every change.
+
+  Each row's key is computed when the row is added or updated, and kept in a SortedList, so each
+  change takes O(log N). The plain list of row_ids, for use in RecordSets, is built from it by
+  get_list(), only when there were changes since the last call. A list returned by get_list() may
+  be kept (e.g. in a cell's value), so it never changes later.
+
+  Computing a key may raise an exception (e.g. if a sort value is an error). In that case, the
+  SortedRowIds is no longer valid, and should be rebuilt when next needed.
+  """
+  __slots__ = ('sort_key', 'valid', '_keys', '_sorted', '_list')
+
+  def __init__(self, row_ids, sort_key):
+    self.sort_key = sort_key
+    self.valid = True
+    if sort_key:
+      self._keys = {r: sort_key(r) for r in row_ids}
+      self._sorted = SortedList(self._keys.values())
+    else:
+      self._keys = None
+      self._sorted = SortedList(row_ids)
+    # The list of row_ids last returned by get_list(), or None if there were changes since then.
+    self._list = None
+
+  def add(self, row_id):
+    if not self.valid:
+      return
+    if self.sort_key:
+      try:
+        key = self.sort_key(row_id)
+      except Exception:   # pylint: disable=broad-except
+        self._invalidate()
+        return
+      self._keys[row_id] = key
+    else:
+      key = row_id
+    self._sorted.add(key)
+    self._list = None
+
+  def remove(self, row_id):
+    if not self.valid:
+      return
+    self._sorted.remove(self._keys.pop(row_id) if self.sort_key else row_id)
+    self._list = None
+
+  def update(self, row_id):
+    """
+    Moves row_id to its new place, if its sort values have changed. Does nothing for row_ids
+    not in the set.
+    """
+    if self.valid and self.sort_key and row_id in self._keys:
+      self.remove(row_id)
+      self.add(row_id)
+
+  def get_list(self):
+    if self._list is None:
+      if self.sort_key:
+        self._list = [key.row_id for key in self._sorted]
+      else:
+        self._list = list(self._sorted)
+    return self._list
+
+  def _invalidate(self):
+    self.valid = False
+    self._keys = self._sorted = self._list = None
+
+
 # Allow `list` to be used as a bin type.
 def _list_make(value):
   return [value]
@@ -274,3 +355,393 @@ def _list_remove(container, value):
     pass
 
 register_container(list, _list_make, _list_add, _list_remove)
+
+
+class KeyInterner(object):
+  """
+  Assigns small integer ids to hashable keys, so that structures which map many rows to the same
+  keys can store ints rather than references to separate but equal key objects. Ids are
+  reference-counted, and get reused once their key is no longer used.
+  """
+  __slots__ = ('_ids', '_keys', '_refs', '_free')
+
+  def __init__(self):
+    self._ids = {}      # Maps key to its id.
+    self._keys = []     # Maps id to its key, or None for a free id.
+    self._refs = []     # Maps id to its reference count.
+    self._free = []     # Free ids, to reuse.
+
+  def __len__(self):
+    return len(self._ids)
+
+  def acquire(self, key):
+    """ Returns the id of key, creating one if needed, and increments its reference count. """
+    key_id = self._ids.get(key)
+    if key_id is None:
+      if self._free:
+        key_id = self._free.pop()
+        self._keys[key_id] = key
+      else:
+        key_id = len(self._keys)
+        self._keys.append(key)
+        self._refs.append(0)
+      self._ids[key] = key_id
+    self._refs[key_id] += 1
+    return key_id
+
+  def release(self, key_id, count=1):
+    """ Decrements the reference count of key_id, and frees it when it's no longer used. """
+    self._refs[key_id] -= count
+    if not self._refs[key_id]:
+      del self._ids[self._keys[key_id]]
+      self._keys[key_id] = None
+      self._free.append(key_id)
+
+  def get_id(self, key, default=None):
+    return self._ids.get(key, default)
+
+  def get_key(self, key_id):
+    return self._keys[key_id]
+
+  def memory_size(self):
+    """ Returns the approximate number of bytes used, not counting the keys themselves. """
+    return (sys.getsizeof(self._ids) + sys.getsizeof(self._keys) + sys.getsizeof(self._refs) +
+            sys.getsizeof(self._free))
+
+
+class RowKeyMap(object):
+  """
+  Maps rows to keys and back, like TwoWayMap(left=set, right=set), but uses much less memory for
+  the common case of a single key per row, and a single row per key, e.g. when each formula cell
+  does one lookup.
+
+  Keys are stored as ids from a KeyInterner, which may be shared by several RowKeyMaps. Each row's
+  key id is kept in an array indexed by row_id, and only rows with several keys get a set of key
+  ids. Similarly, a key id maps to a single row_id, and only to a set if several rows use it. Rows
+  far beyond the end of the array (since row_ids may be sparse) also use a set, and keep using it
+  if the array grows to include them.
+  """
+  __slots__ = ('_interner', '_row_keys', '_other_row_keys', '_key_rows')
+
+  # Values in _row_keys are 1 + key_id for rows with a single key, or one of these.
+  _NONE = 0
+  _SEVERAL = -1
+
+  def __init__(self, interner):
+    self._interner = interner
+    self._row_keys = array.array('l')
+    self._other_row_keys = {}   # Maps row_id to a set of key ids, for rows not in _row_keys.
+    self._key_rows = {}         # Maps key id to a row_id, or to a set of several row_ids.
+
+  def __bool__(self):
+    return bool(self._key_rows)
+
+  def lookup_left(self, row_id, default=None):
+    """ Returns the set of keys for the given row_id. """
+    key_ids = self._get_key_ids(row_id)
+    if not key_ids:
+      return default
+    return {self._interner.get_key(k) for k in key_ids}
+
+  def lookup_right(self, key, default=None):
+    """ Returns the row_ids for the given key, as a set or tuple. """
+    rows = self._key_rows.get(self._interner.get_id(key), default)
+    return (rows,) if isinstance(rows, int) else rows
+
+  def left_all(self):
+    """ Returns the set of all row_ids. """
+    row_keys = self._row_keys
+    return set(itertools.compress(range(len(row_keys)), row_keys)).union(self._other_row_keys)
+
+  def insert(self, row_id, key):
+    """ Inserts the (row_id, key) pair. Raises TypeError if the key is unhashable. """
+    key_id = self._interner.acquire(key)
+    if not self._add_row_key(row_id, key_id):
+      self._interner.release(key_id)
+      return
+    rows = self._key_rows.get(key_id)
+    if rows is None:
+      self._key_rows[key_id] = row_id
+    elif isinstance(rows, int):
+      self._key_rows[key_id] = {rows, row_id}
+    else:
+      rows.add(row_id)
+
+  def remove_left(self, row_id):
+    """ Removes all keys for the given row_id. """
+    key_ids = self._get_key_ids(row_id)
+    if not key_ids:
+      return
+    if row_id < len(self._row_keys):
+      self._row_keys[row_id] = self._NONE
+    self._other_row_keys.pop(row_id, None)
+    for key_id in key_ids:
+      rows = self._key_rows[key_id]
+      if isinstance(rows, int):
+        del self._key_rows[key_id]
+      else:
+        rows.discard(row_id)
+        if len(rows) == 1:
+          self._key_rows[key_id] = rows.pop()
+      self._interner.release(key_id)
+
+  def clear(self):
+    for key_id, rows in self._key_rows.items():
+      self._interner.release(key_id, 1 if isinstance(rows, int) else len(rows))
+    self._row_keys = array.array('l')
+    self._other_row_keys.clear()
+    self._key_rows.clear()
+
+  def memory_size(self):
+    """ Returns the approximate number of bytes used, not counting the keys themselves. """
+    size = sys.getsizeof(self._row_keys) + sys.getsizeof(self._other_row_keys)
+    size += sum(sys.getsizeof(key_ids) for key_ids in self._other_row_keys.values())
+    size += sys.getsizeof(self._key_rows)
+    size += sum(sys.getsizeof(rows) for rows in self._key_rows.values() if not isinstance(rows, int))
+    return size
+
+  def _get_key_ids(self, row_id):
+    row_keys = self._row_keys
+    if row_id < len(row_keys):
+      stored = row_keys[row_id]
+      if stored > 0:
+        return (stored - 1,)
+    return self._other_row_keys.get(row_id, ())
+
+  def _add_row_key(self, row_id, key_id):
+    # Adds key_id for row_id, returning False if it was already there.
+    row_keys = self._row_keys
+    size = len(row_keys)
+    if size <= row_id < 2 * size + 1024:
+      row_keys.extend(itertools.repeat(self._NONE, max(row_id + 1, 2 * size) - size))
+    if row_id < len(row_keys):
+      stored = row_keys[row_id]
+      if stored == self._NONE and row_id not in self._other_row_keys:
+        row_keys[row_id] = key_id + 1
+        return True
+      if stored > 0:
+        if stored == key_id + 1:
+          return False
+        row_keys[row_id] = self._SEVERAL
+        self._other_row_keys[row_id] = {stored - 1, key_id}
+        return True
+    key_ids = self._other_row_keys.setdefault(row_id, set())
+    if key_id in key_ids:
+      return False
+    key_ids.add(key_id)
+    return True
+
+
+class InverseIndex(object):
+  """
+  Maps target row_ids to the sets of row_ids that refer to them, e.g. from the rows of a Reference
+  or ReferenceList column. It's like a dict of sets, but uses a few bytes per reference rather
+  than a set per target and a slot per reference.
+
+  Most references are kept in two arrays, as in a compressed sparse row matrix: the referring rows
+  for target t are _rows[_offsets[t]:_offsets[t + 1]], sorted. Later changes are kept in small
+  dicts of added and removed references, which get merged into the arrays once they grow to a
+  fraction of their size. Targets far beyond the number of references (since row_ids may be
+  sparse) get a set in _sparse instead of a slot in _offsets.
+  """
+  __slots__ = ('_offsets', '_rows', '_sparse', '_added', '_removed', '_delta_count')
+
+  def __init__(self, pairs=()):
+    self.reset(pairs)
+
+  def reset(self, pairs):
+    """
+    Replaces the contents with the given (referring_row_id, target_row_id) pairs, building the
+    arrays in one pass. It's fastest when pairs are in order of referring_row_id.
+    """
+    referring, targets = array.array('l'), array.array('l')
+    sparse = {}
+    for row_id, target in pairs:
+      if target >= 0:
+        referring.append(row_id)
+        targets.append(target)
+      else:
+        sparse.setdefault(target, set()).add(row_id)
+    if not self._build(referring, targets, sparse):
+      # Some target got its rows out of order, or repeated; sort and build again.
+      pairs = sorted(set(zip(referring, targets)))
+      self._build(array.array('l', (r for r, _ in pairs)), array.array('l', (t for _, t in pairs)),
+                  sparse)
+    self._added = {}      # Maps target to a set of referring rows added since the last reset.
+    self._removed = {}    # Maps target to a set of referring rows removed from the arrays.
+    self._delta_count = 0
+
+  def _build(self, referring, targets, sparse):
+    # Count references per target, leaving the ones with very large targets for _sparse.
+    dense_limit = 2 * len(targets) + 1024
+    num_targets = max((t + 1 for t in targets if t < dense_limit), default=0)
+    offsets = array.array('l', itertools.repeat(0, num_targets + 1))
+    for target in targets:
+      if target < num_targets:
+        offsets[target + 1] += 1
+    for i in range(num_targets):
+      offsets[i + 1] += offsets[i]
+
+    # Place referring rows at their target's position, in the order they come in. Returns False
+    # if that doesn't leave each target's rows sorted and distinct.
+    rows = array.array('l', itertools.repeat(0, offsets[num_targets]))
+    positions = offsets[:num_targets]
+    for row_id, target in zip(referring, targets):
+      if target < num_targets:
+        pos = positions[target]
+        if pos > offsets[target] and rows[pos - 1] >= row_id:
+          return False
+        rows[pos] = row_id
+        positions[target] = pos + 1
+      else:
+        sparse.setdefault(target, set()).add(row_id)
+    self._offsets = offsets
+    self._rows = rows
+    self._sparse = sparse
+    return True
+
+  def lookup(self, target):
+    """ Returns the row_ids referring to target, as a sorted sequence. """
+    rows = self._base_rows(target)
+    removed = self._removed.get(target)
+    if removed:
+      rows = [r for r in rows if r not in removed]
+    added = self._added.get(target)
+    if added:
+      rows = sorted(itertools.chain(rows, added))
+    return rows
+
+  def lookup_many(self, targets):
+    """
+    Returns the set of row_ids referring to any of the given targets. For a RowSet of targets,
+    the rows for each range of targets get collected with a single slice of the arrays.
+    """
+    result = set()
+    if isinstance(targets, RowSet):
+      for start, end in targets.ranges():
+        self._collect_range(result, start, end)
+    else:
+      for target in targets:
+        result.update(self.lookup(target))
+    return result
+
+  def add(self, row_id, target):
+    """ Adds a reference from row_id to target. """
+    removed = self._removed.get(target)
+    if removed and row_id in removed:
+      self._discard_delta(self._removed, row_id, target)
+      return
+    sparse = self._sparse.get(target)
+    if sparse is not None:
+      sparse.add(row_id)
+      return
+    if self._in_arrays(row_id, target):
+      return
+    added = self._added.setdefault(target, set())
+    if row_id not in added:
+      added.add(row_id)
+      self._add_delta()
+
+  def add_many(self, pairs):
+    """
+    Adds references for the given (referring_row_id, target_row_id) pairs. Many references get
+    merged with the arrays in one pass, rather than added one at a time.
+    """
+    pairs = list(pairs)
+    if self._delta_count + len(pairs) <= len(self._rows) // 2 + 1024:
+      for row_id, target in pairs:
+        self.add(row_id, target)
+    elif not self._rows and not self._sparse and not self._added:
+      self.reset(pairs)
+    else:
+      self.reset(itertools.chain(self._iter_pairs(), pairs))
+
+  def remove(self, row_id, target):
+    """ Removes the reference from row_id to target, if there is one. """
+    added = self._added.get(target)
+    if added and row_id in added:
+      self._discard_delta(self._added, row_id, target)
+      return
+    sparse = self._sparse.get(target)
+    if sparse is not None:
+      sparse.discard(row_id)
+      if not sparse:
+        del self._sparse[target]
+      return
+    if self._in_arrays(row_id, target):
+      removed = self._removed.setdefault(target, set())
+      if row_id not in removed:
+        removed.add(row_id)
+        self._add_delta()
+
+  def clear(self):
+    self.reset(())
+
+  def memory_size(self):
+    """ Returns the approximate number of bytes used. """
+    size = sys.getsizeof(self._offsets) + sys.getsizeof(self._rows)
+    for delta in (self._sparse, self._added, self._removed):
+      size += sys.getsizeof(delta) + sum(sys.getsizeof(rows) for rows in delta.values())
+    return size
+
+  def _base_rows(self, target):
+    # Returns the referring rows kept for target in the arrays or in _sparse.
+    offsets = self._offsets
+    if 0 <= target < len(offsets) - 1:
+      return self._rows[offsets[target]:offsets[target + 1]]
+    return sorted(self._sparse.get(target, ()))
+
+  def _collect_range(self, result, start, end):
+    # Adds to result the row_ids referring to targets in range(start, end).
+    def targets_in_range(delta):
+      if end - start < len(delta):
+        return [t for t in range(start, end) if t in delta]
+      return sorted(t for t in delta if start <= t < end)
+
+    # Slice the arrays between any targets with removed rows, which are handled one at a time.
+    offsets = self._offsets
+    pos = max(start, 0)
+    dense_end = min(end, len(offsets) - 1)
+    for target in targets_in_range(self._removed) + [dense_end]:
+      if pos < target:
+        result.update(self._rows[offsets[pos]:offsets[target]])
+      if target < dense_end:
+        result.update(self.lookup(target))
+      pos = target + 1
+
+    for delta in (self._added, self._sparse):
+      for target in targets_in_range(delta):
+        result.update(delta[target])
+
+  def _in_arrays(self, row_id, target):
+    offsets = self._offsets
+    if not 0 <= target < len(offsets) - 1:
+      return False
+    end = offsets[target + 1]
+    pos = bisect.bisect_left(self._rows, row_id, offsets[target], end)
+    return pos < end and self._rows[pos] == row_id
+
+  def _discard_delta(self, delta, row_id, target):
+    rows = delta[target]
+    rows.discard(row_id)
+    if not rows:
+      del delta[target]
+    self._delta_count -= 1
+
+  def _add_delta(self):
+    # Merge changes into the arrays once there are enough of them, so that the total cost of
+    # merging stays proportional to the number of changes.
+    self._delta_count += 1
+    if self._delta_count > len(self._rows) // 2 + 1024:
+      self.reset(self._iter_pairs())
+
+  def _iter_pairs(self):
+    # Yields all (referring_row_id, target_row_id) pairs, grouped by target and sorted.
+    num_targets = len(self._offsets) - 1
+    for target in range(num_targets):
+      for row_id in self.lookup(target):
+        yield (row_id, target)
+    others = set(self._sparse).union(t for t in self._added if not 0 <= t < num_targets)
+    for target in sorted(others):
+      for row_id in self.lookup(target):
+        yield (row_id, target)
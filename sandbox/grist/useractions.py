@@ -115,6 +115,13 @@ def override_action(action_name, table_id):
   return do_wrap
 
 
+def has_action_override(action_name, table_id):
+  """
+  Returns whether the given action has a special implementation for the given table.
+  """
+  return (action_name, table_id) in _action_method_overrides
+
+
 def from_repr(user_action):
   """
   Converts a UserAction array into an object such as UpdateRecord.
@@ -1161,10 +1168,11 @@ class UserActions(object):
     # as we don't know them until the records are created.
     new_record_indexes = []
 
-    for i in range(length):
-      current_require = {key: vals[i] for key, vals in decoded_require.items()}
-      records = list(table.lookup_records(**current_require))
-      if not records and add:
+    # Look up all the keys at once, which is much faster than a lookupRecords() call per key.
+    matches = table.lookup_row_ids_many(decoded_require, length)
+
+    for i, row_ids in enumerate(matches):
+      if not row_ids and add:
         values = {key: require[key][i] for key in require_add_keys}
         values.update({key: vals[i] for key, vals in col_values.items()})
         add_record_ids.append(values.pop("id", None))
@@ -1172,21 +1180,19 @@ class UserActions(object):
           add_record_values[key].append(value)
         new_record_indexes.append(i)
 
-      if records and update:
-        if len(records) > 1:
+      if row_ids and update:
+        if len(row_ids) > 1:
           if on_many == "first":
-            records = records[:1]
+            row_ids = row_ids[:1]
           elif on_many == "none":
             continue
 
-        for record in records:
-          update_record_ids.append(record.id)
-          for key, vals in col_values.items():
-            update_record_values[key].append(vals[i])
+        update_record_ids.extend(row_ids)
+        for key, vals in col_values.items():
+          update_record_values[key].extend([vals[i]] * len(row_ids))
 
-        matched_record_ids = [record.id for record in records]
-        result['recordIds'][i] = matched_record_ids
-        result['updateRecordIds'].append(matched_record_ids)
+        result['recordIds'][i] = row_ids
+        result['updateRecordIds'].append(row_ids)
 
     if add_record_ids:
       new_record_ids = self.BulkAddRecord(table_id, add_record_ids, add_record_values)
@@ -6,10 +6,9 @@ formulas. Any typed column may also contain values of a wrong type, and those al
 representation. Finally, every type defines a default value, used when the column is first
 created, and for new records.
 
-For values of type int or bool, It's possible to save some memory by using JS typed arrays or
-Python's array.array. However, at least on the Python side, it means that we need an additional
-data structure for values of the wrong type, and the memory savings aren't that great to be worth
-the extra complexity.
+For values of primitive types (such as Numeric, Date, Int, or Bool), columns save memory by using
+Python's array.array, with an additional sparse data structure for values of the wrong type. See
+column_storage.py for details.
 """
 # pylint: disable=unidiomatic-typecheck
 import csv